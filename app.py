@@ -3,11 +3,37 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import bisect
+import gzip
+import hashlib
+import functools
+import importlib
+import json
+import math
 import os
+import random
 import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 from typing import Optional
 from datetime import datetime, date
+from io import BytesIO
 import warnings
+from dados_comuns import (
+    ARQUIVO_MANIFESTO, COLUNAS_CHAVES_TEMPO, COLUNAS_QA_METRICAS, DIMENSOES_ATENDIMENTOS, DIMENSOES_AVALIACOES,
+    DIRETORIO_PARTICIONADO, adicionar_chaves_tempo, atribuir_unidade_avaliacoes, calcular_metricas_qa,
+    construir_dimensoes, dia_key, diferenca_tabelas, dimensoes_do_manifesto, ler_manifesto, ler_particoes,
+    comparar_memoria, memoria_colunas, otimizar_tipos, particoes_no_periodo, rotulo_mes,
+)
+from ia_simulada import FakeStreamingClient
 warnings.filterwarnings('ignore')
 
 # ============================================================================
@@ -129,8 +155,187 @@ st.markdown(f"""
 # FUNÇÕES DE CARREGAMENTO DE DADOS (COM CACHE)
 # ============================================================================
 
+def _versao_arquivo(path: str) -> str:
+    """Identificador da versão do dataset (caminho + mtime + tamanho do arquivo de origem)."""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+def _garantir_chaves_tempo(data):
+    """Arquivos gerados antes das chaves de tempo: materializa as chaves no carregamento."""
+    if 'dia_key' not in data['atendimentos'].columns:
+        adicionar_chaves_tempo(data['atendimentos'], 'data_atendimento')
+    if data.get('avaliacoes') is not None and 'dia_key' not in data['avaliacoes'].columns:
+        adicionar_chaves_tempo(data['avaliacoes'], 'data_avaliacao')
+
+def _garantir_unidade_avaliacoes(data):
+    """Arquivos gerados antes da atribuição de unidade no pipeline: atribui uma vez no carregamento."""
+    if data.get('avaliacoes') is not None and 'unidade' not in data['avaliacoes'].columns:
+        atribuir_unidade_avaliacoes(data['avaliacoes'], data['atendimentos'])
+
+def _garantir_qa(data):
+    """
+    Arquivos gerados antes das métricas consolidadas (ou só CSV): calcula a tabela de QA e
+    as ocorrências uma vez no carregamento. Linhas do relatório antigo que dependem da base
+    bruta (ex.: dados faltando antes da limpeza) são preservadas.
+    """
+    qa = data.get('qa')
+    if qa is not None and 'Tabela' in qa.columns and data.get('qa_ocorrencias') is not None:
+        return
+    df_metricas, df_ocorrencias = calcular_metricas_qa(data['atendimentos'], data.get('avaliacoes'))
+    if qa is not None and 'Categoria' in qa.columns:
+        antigas = qa[~qa['Categoria'].isin(df_metricas['Categoria'])].reindex(columns=COLUNAS_QA_METRICAS)
+        df_metricas = pd.concat([antigas, df_metricas], ignore_index=True)
+    data['qa'] = df_metricas
+    data['qa_ocorrencias'] = df_ocorrencias
+
+OTIMIZAR_TIPOS = os.environ.get('DASHBOARD_OTIMIZAR_TIPOS', '1') != '0'
+TABELAS_OTIMIZADAS = ('atendimentos', 'avaliacoes', 'qa_ocorrencias')
+
+def _compactar_tipos(data):
+    """
+    Tipos compactos nas tabelas grandes (categóricas, inteiros estreitos, datas em datetime64),
+    guardando a comparação antes/depois por coluna em data['memoria'] para o painel de desempenho.
+    DASHBOARD_OTIMIZAR_TIPOS=0 desliga (só mede).
+    """
+    data['memoria'] = {}
+    for nome in TABELAS_OTIMIZADAS:
+        df = data.get(nome)
+        if df is None:
+            continue
+        if OTIMIZAR_TIPOS:
+            data[nome], data['memoria'][nome] = otimizar_tipos(df)
+        else:
+            data['memoria'][nome] = comparar_memoria(df, df)
+
+def _ordem_por_data(df, coluna_data) -> Optional[np.ndarray]:
+    """Posições das linhas ordenadas por data (mais recente primeiro), calculadas uma vez por carga."""
+    if df is None:
+        return None
+    ordenado = df[coluna_data].sort_values(ascending=False, kind='stable', na_position='last')
+    return df.index.get_indexer(ordenado.index)
+
+def _build_all_ordens(data) -> dict:
+    return {
+        'atendimentos': _ordem_por_data(data['atendimentos'], 'data_atendimento'),
+        'avaliacoes': _ordem_por_data(data.get('avaliacoes'), 'data_avaliacao'),
+    }
+
+def _build_all_dimensoes(data) -> dict:
+    return {
+        'atendimentos': construir_dimensoes(data['atendimentos'], DIMENSOES_ATENDIMENTOS, 'data_atendimento'),
+        'avaliacoes': construir_dimensoes(data.get('avaliacoes'), DIMENSOES_AVALIACOES, 'data_avaliacao'),
+    }
+
+PARTICOES_CACHE_MAX_ENTRIES = 8  # períodos carregados mantidos em memória
+
+def _versao_manifesto() -> Optional[str]:
+    """
+    Versão do dataset particionado; None sem manifesto, com manifesto ilegível ou de versão
+    desconhecida, ou sem pyarrow (usa o Excel).
+    """
+    try:
+        import pyarrow  # noqa: F401
+        versao = _versao_arquivo(os.path.join(DIRETORIO_PARTICIONADO, ARQUIVO_MANIFESTO))
+    except (ImportError, FileNotFoundError):
+        return None
+    return versao if _manifesto_valido(versao) else None
+
+@st.cache_data(max_entries=4)
+def _manifesto_valido(versao: str) -> bool:
+    """Lê o manifesto uma vez por versão (mtime + tamanho) em vez de a cada rerun."""
+    return ler_manifesto() is not None
+
+def load_data(data_min: Optional[date] = None, data_max: Optional[date] = None, avisar: bool = True):
+    """
+    Carrega os dados. Com o dataset particionado gerado pelo processamento
+    (dados_particionados/manifest.json), lê só as partições que intersectam
+    [data_min, data_max] (sem limites, todo o histórico); sem ele, carrega o Excel
+    (ou o CSV) inteiro e o período é aplicado depois, pelos filtros.
+    """
+    versao = _versao_manifesto()
+    if versao is not None:
+        data = _load_data_particionado(versao, data_min, data_max)
+    else:
+        data = _load_data_arquivos()
+    if data is not None:
+        # Fora da função em cache: o Streamlit repetiria a mensagem a cada leitura do cache
+        # (ex.: carregar_dimensoes e load_data na mesma página, sem o dataset particionado)
+        if avisar:
+            st.success(data['mensagem_carga'])
+        st.session_state['_resumo_memoria'] = data['resumo_memoria']  # só o resumo, sem as tabelas
+    return data
+
+def carregar_dimensoes() -> Optional[dict]:
+    """
+    Dimensões de todo o histórico (opções dos filtros e limites de data). Com o dataset
+    particionado vêm do manifesto, sem ler nenhuma partição.
+    """
+    versao = _versao_manifesto()
+    if versao is not None:
+        return _dimensoes_particionado(versao)
+    data = _load_data_arquivos()
+    return None if data is None else data['dimensoes']
+
+@st.cache_data
+def _dimensoes_particionado(versao: str) -> dict:
+    tabelas = ler_manifesto()['tabelas']
+    return {
+        'atendimentos': dimensoes_do_manifesto(tabelas['atendimentos']),
+        'avaliacoes': (
+            dimensoes_do_manifesto(tabelas['avaliacoes']) if 'avaliacoes' in tabelas
+            else construir_dimensoes(None, DIMENSOES_AVALIACOES, 'data_avaliacao')
+        ),
+    }
+
+RESUMOS_PRE_CALCULADOS = ('resumo_diag', 'resumo_diag_unidade', 'resumo_diag_prof')
+
+def _versao_periodo(versao: str, data_min: Optional[date], data_max: Optional[date]) -> str:
+    """Versão das linhas de um período do dataset particionado (entra nas assinaturas dos filtros)."""
+    return f"{versao}:{data_min}:{data_max}"
+
+@st.cache_data
+def _resumos_particionado(versao: str) -> dict:
+    """Resumos pré-calculados do dataset particionado (tabelas pequenas), sem abrir nenhuma partição."""
+    inteiras = ler_manifesto()['inteiras']
+    return {
+        nome: pd.read_parquet(os.path.join(DIRETORIO_PARTICIONADO, inteiras[nome])) if inteiras.get(nome) else None
+        for nome in RESUMOS_PRE_CALCULADOS
+    }
+
+@st.cache_data(max_entries=PARTICOES_CACHE_MAX_ENTRIES)
+def _load_data_particionado(versao: str, data_min: Optional[date], data_max: Optional[date]):
+    manifesto = ler_manifesto()
+    data = {'versao': _versao_periodo(versao, data_min, data_max), 'particoes': {}}
+    for nome in ('atendimentos', 'avaliacoes'):
+        entrada = manifesto['tabelas'].get(nome)
+        if entrada is None:
+            data[nome] = None
+            continue
+        particoes = particoes_no_periodo(entrada, data_min, data_max)
+        data[nome] = ler_particoes(DIRETORIO_PARTICIONADO, entrada, particoes)
+        data['particoes'][nome] = {
+            'lidas': len(particoes),
+            'total': len(entrada['particoes']),
+            'bytes': sum(p['bytes'] for p in particoes),
+        }
+    data.update(_resumos_particionado(versao))
+    for nome in ('qa', 'qa_ocorrencias'):
+        arquivo = manifesto['inteiras'].get(nome)
+        data[nome] = pd.read_parquet(os.path.join(DIRETORIO_PARTICIONADO, arquivo)) if arquivo else None
+
+    _garantir_chaves_tempo(data)
+    _garantir_unidade_avaliacoes(data)
+    _garantir_qa(data)
+    _compactar_tipos(data)
+    data['dimensoes'] = _dimensoes_particionado(versao)
+    data['ordem_data'] = _build_all_ordens(data)
+    data['resumo_memoria'] = _resumo_memoria(data)
+    lidas = data['particoes']['atendimentos']
+    data['mensagem_carga'] = f"✅ Dados carregados do dataset particionado ({lidas['lidas']} de {lidas['total']} meses de atendimentos)"
+    return data
+
 @st.cache_data
-def load_data():
+def _load_data_arquivos():
     """
     Carrega os dados do arquivo Excel ou faz fallback para CSV.
     Retorna um dicionário com os dataframes necessários.
@@ -140,6 +345,7 @@ def load_data():
     # Tentar carregar do Excel primeiro
     try:
         excel_file = pd.ExcelFile('atendimentos_por_diagnostico.xlsx')
+        data['versao'] = _versao_arquivo('atendimentos_por_diagnostico.xlsx')
         
         # Carregar aba principal
         data['atendimentos'] = pd.read_excel(excel_file, sheet_name='Atendimentos_Com_Diagnostico')
@@ -177,7 +383,19 @@ def load_data():
         except:
             data['qa'] = None
             
-        st.success("✅ Dados carregados do arquivo Excel")
+        try:
+            data['qa_ocorrencias'] = pd.read_excel(excel_file, sheet_name='QA_Ocorrencias')
+        except:
+            data['qa_ocorrencias'] = None
+            
+        _garantir_chaves_tempo(data)
+        _garantir_unidade_avaliacoes(data)
+        _garantir_qa(data)
+        _compactar_tipos(data)
+        data['dimensoes'] = _build_all_dimensoes(data)
+        data['ordem_data'] = _build_all_ordens(data)
+        data['resumo_memoria'] = _resumo_memoria(data)
+        data['mensagem_carga'] = "✅ Dados carregados do arquivo Excel"
         return data
         
     except FileNotFoundError:
@@ -188,6 +406,7 @@ def load_data():
     # Fallback: carregar CSV
     try:
         data['atendimentos'] = pd.read_csv('Atendimentos_Com_Diagnostico.csv', encoding='utf-8-sig')
+        data['versao'] = _versao_arquivo('Atendimentos_Com_Diagnostico.csv')
         data['atendimentos']['data_atendimento'] = pd.to_datetime(data['atendimentos']['data_atendimento'])
         if 'data_avaliacao_origem' in data['atendimentos'].columns:
             data['atendimentos']['data_avaliacao_origem'] = pd.to_datetime(
@@ -206,7 +425,15 @@ def load_data():
             data['resumo_diag_prof'] = None
         
         data['qa'] = None
-        st.success("✅ Dados carregados do arquivo CSV")
+        data['qa_ocorrencias'] = None
+        _garantir_chaves_tempo(data)
+        _garantir_unidade_avaliacoes(data)
+        _garantir_qa(data)
+        _compactar_tipos(data)
+        data['dimensoes'] = _build_all_dimensoes(data)
+        data['ordem_data'] = _build_all_ordens(data)
+        data['resumo_memoria'] = _resumo_memoria(data)
+        data['mensagem_carga'] = "✅ Dados carregados do arquivo CSV"
         return data
         
     except FileNotFoundError:
@@ -216,101 +443,768 @@ def load_data():
         st.error(f"❌ Erro ao carregar CSV: {str(e)}")
         return None
 
-@st.cache_data
-def compute_resumos(df):
-    """Computa resumos a partir da base filtrada se não existirem."""
+RESUMOS_CACHE_MAX_ENTRIES = 64
+RESUMOS_CACHE_TTL = 3600  # segundos
+
+@st.cache_data(max_entries=RESUMOS_CACHE_MAX_ENTRIES, ttl=RESUMOS_CACHE_TTL)
+def compute_resumos(assinatura: tuple, _df):
+    """
+    Computa resumos a partir da base filtrada se não existirem.
+    A chave do cache é a assinatura dos filtros (inclui a versão do dataset);
+    o dataframe (`_df`) não é hasheado pelo Streamlit. Os resumos são derivados
+    dos agregados do recorte (compute_aggregates), sem reagrupar as linhas.
+    """
+    agg = compute_aggregates(assinatura, _df)
     resumos = {}
     
-    df_com_diag = df[df['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
+    resumos['diag'] = agg['diag'][agg['diag']['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
+    resumos['diag'] = resumos['diag'].sort_values('n_atendimentos', ascending=False).reset_index(drop=True)
     
-    resumos['diag'] = df_com_diag.groupby('diagnostico_vigente').size().reset_index(name='n_atendimentos')
-    resumos['diag'] = resumos['diag'].sort_values('n_atendimentos', ascending=False)
+    resumos['diag_unidade'] = agg['diag_unidade'][agg['diag_unidade']['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
+    resumos['diag_unidade'] = resumos['diag_unidade'].sort_values(['diagnostico_vigente', 'n_atendimentos'], ascending=[True, False]).reset_index(drop=True)
     
-    resumos['diag_unidade'] = df_com_diag.groupby(['diagnostico_vigente', 'unidade']).size().reset_index(name='n_atendimentos')
-    resumos['diag_unidade'] = resumos['diag_unidade'].sort_values(['diagnostico_vigente', 'n_atendimentos'], ascending=[True, False])
-    
-    resumos['diag_prof'] = df_com_diag.groupby(['diagnostico_vigente', 'profissional_atendimento']).size().reset_index(name='n_atendimentos')
-    resumos['diag_prof'] = resumos['diag_prof'].sort_values(['diagnostico_vigente', 'n_atendimentos'], ascending=[True, False])
+    resumos['diag_prof'] = agg['diag_prof'][agg['diag_prof']['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
+    resumos['diag_prof'] = resumos['diag_prof'].sort_values(['diagnostico_vigente', 'n_atendimentos'], ascending=[True, False]).reset_index(drop=True)
     
     return resumos
 
+# ============================================================================
+# AGREGAÇÕES DO RECORTE
+# ============================================================================
+
+AGREGADOS_CACHE_MAX_ENTRIES = 64
+AGREGADOS_CACHE_TTL = 3600  # segundos
+
+def _rollup(cubo: pd.DataFrame, chaves: list) -> pd.DataFrame:
+    return cubo.groupby(chaves, observed=True)['n_atendimentos'].sum().reset_index()
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def compute_aggregates(assinatura: tuple, _df) -> dict:
+    """
+    Agregados do recorte usados por gráficos, tabelas e resumos.
+    Um único groupby sobre as linhas gera o cubo mês × diagnóstico × unidade × profissional;
+    as demais contagens são derivadas do cubo (pequeno).
+    """
+    chaves = {
+        'mes_key': _df['mes_key'],
+        'diagnostico_vigente': _df['diagnostico_vigente'],
+        'unidade': _df['unidade'],
+        'profissional_atendimento': _df['profissional_atendimento'],
+    }
+    cubo = (
+        pd.DataFrame(chaves)
+        .groupby(list(chaves), dropna=False, observed=True)
+        .size()
+        .reset_index(name='n_atendimentos')
+    )
+    # Contagens diárias (pré-agregadas) para a série temporal em dia / semana / mês
+    dia_diag = (
+        pd.DataFrame({'dia_key': _df['dia_key'], 'diagnostico_vigente': _df['diagnostico_vigente']})
+        .groupby(['dia_key', 'diagnostico_vigente'], dropna=True, observed=True)
+        .size()
+        .reset_index(name='n_atendimentos')
+    )
+    return _agregados_do_cubo(cubo, dia_diag)
+
+def _agregados_do_cubo(cubo: pd.DataFrame, dia_diag: pd.DataFrame) -> dict:
+    """Dicionário de agregados a partir do cubo e das contagens diárias (qualquer motor de consulta)."""
+    return {
+        'cubo': cubo,
+        'dia_diag': dia_diag,
+        'diag': _rollup(cubo, ['diagnostico_vigente']),
+        'unidade': _rollup(cubo, ['unidade']),
+        'profissional': _rollup(cubo, ['profissional_atendimento']),
+        'diag_unidade': _rollup(cubo, ['diagnostico_vigente', 'unidade']),
+        'diag_prof': _rollup(cubo, ['diagnostico_vigente', 'profissional_atendimento']),
+    }
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def compute_resumo_diag_unidade(assinatura: tuple, _resumo_diag_unidade: pd.DataFrame, _agregados: dict) -> pd.DataFrame:
+    """Resumo pré-calculado Diagnóstico × Unidade restrito aos valores presentes no recorte."""
+    return _resumo_diag_unidade[
+        _resumo_diag_unidade['diagnostico_vigente'].isin(_agregados['diag']['diagnostico_vigente']) &
+        _resumo_diag_unidade['unidade'].isin(_agregados['unidade']['unidade'])
+    ]
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def compute_top_profissionais(assinatura: tuple, top_n: int, _resumo_diag_prof: pd.DataFrame, _agregados: dict) -> pd.DataFrame:
+    """Top N profissionais de cada diagnóstico do recorte (resumo pré-calculado)."""
+    df_resumo = _resumo_diag_prof[
+        _resumo_diag_prof['diagnostico_vigente'].isin(_agregados['diag']['diagnostico_vigente'])
+    ]
+    return (
+        df_resumo.sort_values('n_atendimentos', ascending=False, kind='stable')
+        .groupby('diagnostico_vigente', sort=True, observed=True)
+        .head(top_n)
+        .sort_values(['diagnostico_vigente', 'n_atendimentos'], ascending=[True, False], kind='stable')
+        .reset_index(drop=True)
+    )
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def contar_avaliacoes(assinatura: tuple, chaves: tuple, _df: pd.DataFrame) -> pd.DataFrame:
+    """Nº de avaliações do recorte por `chaves` (uma linha por combinação presente)."""
+    return _df.groupby(list(chaves), observed=True).size().reset_index(name='n_avaliacoes')
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def compute_diag_unidade_avaliacoes(assinatura: tuple, ano: str, profissional: str, _df: pd.DataFrame):
+    """
+    Avaliações por diagnóstico × unidade, com os filtros opcionais de ano e profissional ('Todos'
+    = sem filtro). Retorna (contagens, top 15 diagnósticos, top 10 unidades).
+    """
+    mask = np.ones(len(_df), dtype=bool)
+    if ano != 'Todos':
+        mask &= (_df['ano'] == int(ano)).to_numpy(dtype=bool, na_value=False)
+    if profissional != 'Todos':
+        mask &= (_df['profissional_avaliacao'] == profissional).to_numpy(dtype=bool, na_value=False)
+    df_sub = _df[mask]
+    contagens = df_sub.groupby(['diagnostico', 'unidade'], observed=True).size().reset_index(name='n_avaliacoes')
+    top_diag = df_sub.groupby('diagnostico', observed=True).size().nlargest(15).index
+    top_unidades = df_sub.groupby('unidade', observed=True).size().nlargest(10).index
+    return contagens, top_diag, top_unidades
+
+# ============================================================================
+# SÉRIE TEMPORAL (GRANULARIDADE E DOWNSAMPLING)
+# ============================================================================
+
+GRANULARIDADES_SERIE = {'dia': 'Dia', 'semana': 'Semana', 'mes': 'Mês'}
+_FREQ_SERIE = {'dia': 'D', 'semana': 'W-MON', 'mes': 'MS'}
+SERIE_MAX_PONTOS = 2000  # somando todos os traços: limita o JSON da figura qualquer que seja o histórico
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def compute_serie_temporal(assinatura: tuple, granularidade: str, _agg_dia_diag: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tabela período × diagnóstico (índice = início do período) a partir das contagens diárias.
+    Semanas começam na segunda-feira; períodos sem atendimento entram com zero.
+    """
+    if _agg_dia_diag.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='periodo'))
+    chaves = _agg_dia_diag['dia_key'].astype('int64')
+    datas = pd.to_datetime(pd.DataFrame({'year': chaves // 10000, 'month': chaves // 100 % 100, 'day': chaves % 100}))
+    if granularidade == 'semana':
+        datas = datas - pd.to_timedelta(datas.dt.weekday, unit='D')
+    elif granularidade == 'mes':
+        datas = datas - pd.to_timedelta(datas.dt.day - 1, unit='D')
+    tabela = pd.pivot_table(
+        pd.DataFrame({'periodo': datas, 'diagnostico_vigente': _agg_dia_diag['diagnostico_vigente'],
+                      'n_atendimentos': _agg_dia_diag['n_atendimentos']}),
+        index='periodo', columns='diagnostico_vigente', values='n_atendimentos',
+        aggfunc='sum', fill_value=0, observed=True,
+    )
+    periodos = pd.date_range(tabela.index.min(), tabela.index.max(), freq=_FREQ_SERIE[granularidade], name='periodo')
+    return tabela.reindex(periodos, fill_value=0)
+
+def lttb_indices(y: np.ndarray, n_pontos: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets sobre pontos igualmente espaçados: índices de `n_pontos`
+    pontos que preservam picos e vales da série (o primeiro e o último sempre entram).
+    """
+    n = len(y)
+    if n_pontos >= n or n_pontos < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    x = np.arange(n, dtype=float)
+    # n_pontos - 2 baldes entre o primeiro e o último ponto
+    limites = np.linspace(1, n - 1, n_pontos - 1).astype(np.int64)
+    indices = np.empty(n_pontos, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_pontos - 2):
+        inicio, fim = limites[i], limites[i + 1]
+        prox_fim = limites[i + 2] if i + 2 < len(limites) else n
+        # Terceiro vértice: média do balde seguinte
+        mx, my = x[fim:prox_fim].mean(), y[fim:prox_fim].mean()
+        areas = np.abs((x[a] - mx) * (y[inicio:fim] - y[a]) - (x[a] - x[inicio:fim]) * (my - y[a]))
+        a = inicio + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+# ============================================================================
+# ÍNDICE DE BUSCA DE PACIENTES
+# ============================================================================
+
+AJUDA_BUSCA_PACIENTE = "Trecho do ID, sem diferenciar maiúsculas. O termo é literal: caracteres como . * ? não são curingas."
+
+class PatientSearchIndex:
+    """
+    Índice de n-gramas sobre os IDs distintos de pacientes.
+    Resolve a busca em pacientes e depois em posições de linha (paciente → linhas),
+    sem varrer a coluna inteira a cada rerun. Prefixos e termos mais curtos que o
+    n-grama saem de faixas (bisect) sobre chaves ordenadas, sem varrer os pacientes.
+    """
+
+    def __init__(self, paciente_ids: pd.Series, n: int = 3, max_consultas: int = 256):
+        codigos, pacientes = pd.factorize(paciente_ids.astype(str), sort=False)
+        self.n = n
+        self.pacientes = [str(p) for p in pacientes]
+        minusculos = [p.lower() for p in self.pacientes]
+        self._minusculos = np.array(minusculos, dtype=np.str_)  # conferência vetorizada dos candidatos
+        self._codigo_por_id = {p: i for i, p in enumerate(self.pacientes)}
+
+        # paciente → linhas: posições ordenadas por código, fatiadas por limites
+        self._ordem = np.argsort(codigos, kind='stable')
+        self._limites = np.searchsorted(codigos[self._ordem], np.arange(len(self.pacientes) + 1))
+
+        # n-grama → códigos de pacientes
+        postings = defaultdict(set)
+        for codigo, texto in enumerate(minusculos):
+            for i in range(len(texto) - n + 1):
+                postings[texto[i:i + n]].add(codigo)
+        self._postings = {gram: np.fromiter(sorted(cods), dtype=np.int64) for gram, cods in postings.items()}
+
+        # IDs ordenados (busca por prefixo) e sufixos cortados em n - 1 caracteres
+        # (termos mais curtos que o n-grama: o termo está no ID se algum sufixo começa com ele)
+        self._ids_ordenados, self._codigos_por_id_ordenado = self._chaves_ordenadas(
+            (texto, codigo) for codigo, texto in enumerate(minusculos)
+        )
+        self._sufixos, self._codigos_por_sufixo = self._chaves_ordenadas(
+            (texto[i:i + n - 1], codigo) for codigo, texto in enumerate(minusculos) for i in range(len(texto))
+        )
+
+        # Consultas já resolvidas (a digitação incremental reaproveita o prefixo)
+        self._consultas = {}
+        self._max_consultas = max_consultas
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _chaves_ordenadas(pares) -> tuple:
+        """(chaves ordenadas, códigos na mesma ordem) a partir de pares (chave, código)."""
+        pares = sorted(pares)
+        return [chave for chave, _ in pares], np.fromiter((codigo for _, codigo in pares), dtype=np.int64, count=len(pares))
+
+    @staticmethod
+    def _faixa(chaves: list, codigos: np.ndarray, termo: str) -> np.ndarray:
+        """Códigos (ordenados, sem repetição) das chaves que começam com o termo."""
+        inicio = bisect.bisect_left(chaves, termo)
+        fim = bisect.bisect_left(chaves, termo + '\U0010ffff', lo=inicio)
+        return np.unique(codigos[inicio:fim])
+
+    def buscar_prefixo(self, termo: str) -> np.ndarray:
+        """Códigos dos pacientes cujo ID começa com o termo (sem diferenciar maiúsculas)."""
+        return self._faixa(self._ids_ordenados, self._codigos_por_id_ordenado, termo.lower())
+
+    def buscar_pacientes(self, termo: str, exato: bool = False, prefixo: bool = False) -> np.ndarray:
+        """Retorna os códigos dos pacientes que casam com o termo."""
+        if exato:
+            codigo = self._codigo_por_id.get(termo)
+            return np.array([] if codigo is None else [codigo], dtype=np.int64)
+        if prefixo:
+            return self.buscar_prefixo(termo)
+
+        termo = termo.lower()
+        if termo in self._consultas:
+            return self._consultas[termo]
+
+        # Reaproveitar o resultado do maior prefixo já consultado (subconjunto garantido)
+        candidatos = None
+        for k in range(len(termo) - 1, 0, -1):
+            if termo[:k] in self._consultas:
+                candidatos = self._consultas[termo[:k]]
+                break
+
+        if candidatos is None:
+            if len(termo) < self.n:
+                # Termo curto: a faixa dos sufixos já é a resposta exata
+                candidatos = self._faixa(self._sufixos, self._codigos_por_sufixo, termo)
+            else:
+                grams = {termo[i:i + self.n] for i in range(len(termo) - self.n + 1)}
+                listas = sorted((self._postings.get(g) for g in grams), key=lambda a: 0 if a is None else len(a))
+                if listas[0] is None:
+                    candidatos = np.array([], dtype=np.int64)
+                else:
+                    candidatos = listas[0]
+                    for lista in listas[1:]:
+                        candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+
+        # Os n-gramas (ou o prefixo reaproveitado) dão candidatos; o termo inteiro é conferido em lote
+        resultado = candidatos[np.char.find(self._minusculos[candidatos], termo) >= 0]
+        with self._lock:
+            if len(self._consultas) >= self._max_consultas:
+                self._consultas.pop(next(iter(self._consultas)), None)
+            self._consultas[termo] = resultado
+        return resultado
+
+    def linhas(self, codigos: np.ndarray) -> np.ndarray:
+        """Posições (ordenadas) das linhas dos pacientes informados."""
+        if len(codigos) == 0:
+            return np.array([], dtype=np.int64)
+        partes = [self._ordem[self._limites[c]:self._limites[c + 1]] for c in codigos]
+        return np.sort(np.concatenate(partes))
+
+    def buscar_linhas(self, termo: str, exato: bool = False, prefixo: bool = False) -> np.ndarray:
+        return self.linhas(self.buscar_pacientes(termo, exato=exato, prefixo=prefixo))
+
+@st.cache_resource(max_entries=4)
+def get_patient_index(versao: str, _paciente_ids: pd.Series) -> PatientSearchIndex:
+    """Índice de pacientes compartilhado entre páginas e sessões, construído uma vez por versão do dataset."""
+    return PatientSearchIndex(_paciente_ids)
+
 # ============================================================================
 # FUNÇÕES DE FILTROS
 # ============================================================================
 
-def apply_filters(df, filtros):
-    """Aplica os filtros selecionados ao dataframe."""
-    df_filtrado = df.copy()
-    
+def _filter_mask(df, filtros, indice_pacientes: Optional[PatientSearchIndex] = None) -> np.ndarray:
+    """Máscara booleana (por posição) das linhas que atendem aos filtros."""
+    mask = np.ones(len(df), dtype=bool)
+
     # Filtro de datas
-    if filtros['data_min'] and filtros['data_max']:
+    if filtros['data_min'] and filtros['data_max'] and 'dia_key' in df.columns:
+        # Chaves AAAAMMDD inclusivas nos dois extremos
+        dias = df['dia_key'].to_numpy()
+        mask &= (dias >= dia_key(filtros['data_min'])) & (dias <= dia_key(filtros['data_max']))
+    elif filtros['data_min'] and filtros['data_max']:
         # Converter date para datetime (início do dia)
         data_min_dt = pd.Timestamp(filtros['data_min']).normalize()
         # Final do dia (incluir todo o dia final)
         data_max_dt = pd.Timestamp(filtros['data_max']).normalize() + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
-        
-        df_filtrado = df_filtrado[
-            (pd.to_datetime(df_filtrado['data_atendimento']) >= data_min_dt) &
-            (pd.to_datetime(df_filtrado['data_atendimento']) <= data_max_dt)
-        ]
-    
+
+        datas = pd.to_datetime(df['data_atendimento'])
+        mask &= ((datas >= data_min_dt) & (datas <= data_max_dt)).to_numpy()
+
     # Filtro de diagnóstico
     if filtros['diagnosticos'] and len(filtros['diagnosticos']) > 0:
-        df_filtrado = df_filtrado[df_filtrado['diagnostico_vigente'].isin(filtros['diagnosticos'])]
-    
+        mask &= df['diagnostico_vigente'].isin(filtros['diagnosticos']).to_numpy()
+
     # Filtro de unidade
     if filtros['unidades'] and len(filtros['unidades']) > 0:
-        df_filtrado = df_filtrado[df_filtrado['unidade'].isin(filtros['unidades'])]
-    
+        mask &= df['unidade'].isin(filtros['unidades']).to_numpy()
+
     # Filtro de profissional
     if filtros['profissionais'] is not None and len(filtros['profissionais']) > 0:
-        df_filtrado = df_filtrado[df_filtrado['profissional_atendimento'].isin(filtros['profissionais'])]
-    
+        mask &= df['profissional_atendimento'].isin(filtros['profissionais']).to_numpy()
+
     # Filtro de paciente
+    if filtros['paciente_busca']:
+        prefixo = bool(filtros.get('paciente_prefixo'))
+        if indice_pacientes is not None:
+            mask_paciente = np.zeros(len(df), dtype=bool)
+            mask_paciente[indice_pacientes.buscar_linhas(
+                filtros['paciente_busca'], exato=filtros['paciente_exato'], prefixo=prefixo,
+            )] = True
+            mask &= mask_paciente
+        elif filtros['paciente_exato']:
+            mask &= (df['paciente_id'] == filtros['paciente_busca']).to_numpy()
+        elif prefixo:
+            mask &= df['paciente_id'].str.lower().str.startswith(filtros['paciente_busca'].lower(), na=False).to_numpy()
+        else:
+            mask &= df['paciente_id'].str.contains(filtros['paciente_busca'], case=False, regex=False, na=False).to_numpy()
+
+    return mask
+
+def apply_filters(df, filtros, indice_pacientes: Optional[PatientSearchIndex] = None):
+    """Aplica os filtros selecionados ao dataframe."""
+    return df[_filter_mask(df, filtros, indice_pacientes)]
+
+def _conjunto(valores) -> tuple:
+    """Conjunto de valores selecionados em forma canônica (ordenado, hashable)."""
+    return tuple(sorted(str(v) for v in valores)) if valores else ()
+
+def _filter_signature(filtros, versao: str) -> tuple:
+    """Assinatura canônica dos filtros (conjuntos ordenados, limites de data, termo e modo da busca)."""
+    # O termo entra literalmente (sem strip): a busca por substring considera espaços
+    busca = filtros.get('paciente_busca') or ''
+    exato = bool(filtros.get('paciente_exato')) if busca else False
+    return (
+        versao,
+        str(filtros.get('data_min')) if filtros.get('data_min') else None,
+        str(filtros.get('data_max')) if filtros.get('data_max') else None,
+        _conjunto(filtros.get('diagnosticos')),
+        _conjunto(filtros.get('unidades')),
+        _conjunto(filtros.get('profissionais')),
+        busca,
+        exato,
+        bool(filtros.get('paciente_prefixo')) if busca and not exato else False,
+    )
+
+def _montar_kpis(total_atendimentos: int, pacientes_unicos: int, diagnosticos_distintos: int, sem_diag_count: int) -> dict:
+    return {
+        'total_atendimentos': int(total_atendimentos),
+        'pacientes_unicos': int(pacientes_unicos),
+        'diagnosticos_distintos': int(diagnosticos_distintos),
+        'sem_diag_count': int(sem_diag_count),
+        'pct_sem_diag': (sem_diag_count / total_atendimentos * 100) if total_atendimentos > 0 else 0.0,
+    }
+
+def _compute_kpis(df_filtrado) -> dict:
+    return _montar_kpis(
+        len(df_filtrado),
+        df_filtrado['paciente_id'].nunique(),
+        df_filtrado['diagnostico_vigente'].nunique(),
+        (df_filtrado['diagnostico_vigente'] == 'SEM DIAGNÓSTICO').sum(),
+    )
+
+# ============================================================================
+# CACHE DE RECORTES FILTRADOS
+# ============================================================================
+
+SLICE_CACHE_MAX_ENTRIES = 128
+SLICE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class FilteredSliceCache:
+    """
+    Cache LRU (por processo) das linhas selecionadas por cada assinatura de filtros
+    e dos KPIs derivados. Limitado por número de entradas e por memória.
+    """
+
+    def __init__(self, max_entries: int = SLICE_CACHE_MAX_ENTRIES, max_bytes: int = SLICE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chave):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada
+
+    def put(self, chave, posicoes: np.ndarray, kpis: dict):
+        with self._lock:
+            if chave in self._entradas:
+                self._bytes -= self._entradas.pop(chave)[0].nbytes
+            self._entradas[chave] = (posicoes, kpis)
+            self._bytes += posicoes.nbytes
+            while self._entradas and (len(self._entradas) > self.max_entries or self._bytes > self.max_bytes):
+                _, (pos_removida, _) = self._entradas.popitem(last=False)
+                self._bytes -= pos_removida.nbytes
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / total) if total else 0.0,
+            }
+
+@st.cache_resource
+def get_slice_cache() -> FilteredSliceCache:
+    """Cache de recortes compartilhado entre páginas e sessões."""
+    return FilteredSliceCache()
+
+def get_filtered_slice(df, filtros, versao: str, indice_pacientes: Optional[PatientSearchIndex] = None):
+    """
+    Retorna (df_filtrado, kpis, assinatura) reaproveitando o recorte em cache quando
+    a assinatura dos filtros já foi vista (ex.: rerun disparado por um slider).
+    """
+    assinatura = _filter_signature(filtros, versao)
+    cache = get_slice_cache()
+    entrada = cache.get(assinatura)
+    if entrada is not None:
+        posicoes, kpis = entrada
+        return df.iloc[posicoes], kpis, assinatura
+
+    mask = _filter_mask(df, filtros, indice_pacientes)
+    posicoes = np.flatnonzero(mask).astype(np.int32 if len(df) < 2**31 else np.int64)
+    df_filtrado = df.iloc[posicoes]
+    kpis = _compute_kpis(df_filtrado)
+    cache.put(assinatura, posicoes, kpis)
+    return df_filtrado, kpis, assinatura
+
+# ============================================================================
+# MOTOR DE CONSULTA (PANDAS OU DUCKDB)
+# ============================================================================
+
+# 'pandas': filtros e agregações sobre o dataframe em memória (padrão);
+# 'duckdb': KPIs e agregados do Dashboard em SQL direto sobre o dataset particionado;
+# 'comparar': executa os dois, exibe o resultado do pandas e avisa se divergirem.
+MOTORES_CONSULTA = ('pandas', 'duckdb', 'comparar')
+MOTOR_CONSULTA_PADRAO = os.environ.get('DASHBOARD_MOTOR_CONSULTA', 'pandas').strip().lower()
+DUCKDB_JANELA_METRICAS = 200
+
+def duckdb_disponivel() -> bool:
+    """O motor DuckDB requer o pacote `duckdb` e o dataset particionado (processar_dados.py)."""
+    try:
+        import duckdb  # noqa: F401
+    except ImportError:
+        return False
+    return _versao_manifesto() is not None
+
+def motor_consulta_ativo() -> str:
+    """Motor escolhido no painel de desempenho (padrão: DASHBOARD_MOTOR_CONSULTA); sem DuckDB, pandas."""
+    motor = st.session_state.get('motor_consulta', MOTOR_CONSULTA_PADRAO)
+    if motor not in MOTORES_CONSULTA or motor == 'pandas' or not duckdb_disponivel():
+        return 'pandas'
+    return motor
+
+def filtros_para_sql(filtros: dict) -> tuple:
+    """
+    Traduz o dicionário de filtros da sidebar (o mesmo de apply_filters) em uma condição
+    WHERE parametrizada, com a mesma semântica: seleção vazia = sem filtro, datas
+    inclusivas (pela dia_key) e busca de paciente por substring (ou prefixo) sem diferenciar
+    maiúsculas.
+    """
+    condicoes, parametros = [], []
+
+    def _em(coluna, valores):
+        condicoes.append(f"{coluna} IN ({', '.join('?' * len(valores))})")
+        parametros.extend(str(v) for v in valores)
+
+    if filtros['data_min'] and filtros['data_max']:
+        condicoes.append("dia_key BETWEEN ? AND ?")
+        parametros += [dia_key(filtros['data_min']), dia_key(filtros['data_max'])]
+    if filtros['diagnosticos']:
+        _em('diagnostico_vigente', filtros['diagnosticos'])
+    if filtros['unidades']:
+        _em('unidade', filtros['unidades'])
+    if filtros['profissionais'] is not None and len(filtros['profissionais']) > 0:
+        _em('profissional_atendimento', filtros['profissionais'])
     if filtros['paciente_busca']:
         if filtros['paciente_exato']:
-            df_filtrado = df_filtrado[df_filtrado['paciente_id'] == filtros['paciente_busca']]
+            condicoes.append("paciente_id = ?")
+            parametros.append(filtros['paciente_busca'])
+        elif filtros.get('paciente_prefixo'):
+            condicoes.append("starts_with(lower(paciente_id), ?)")
+            parametros.append(filtros['paciente_busca'].lower())
         else:
-            df_filtrado = df_filtrado[df_filtrado['paciente_id'].str.contains(filtros['paciente_busca'], case=False, na=False)]
-    
-    return df_filtrado
+            condicoes.append("contains(lower(paciente_id), ?)")
+            parametros.append(filtros['paciente_busca'].lower())
+    return (" AND ".join(condicoes) or "TRUE"), parametros
+
+class DuckDBQueryEngine:
+    """
+    Consultas DuckDB sobre o dataset particionado. Só as partições do período (pelo manifesto)
+    são abertas; os filtros viram WHERE, empurrado para a leitura do Parquet junto com as
+    colunas usadas, e só os agregados (pequenos) voltam para o Python.
+    """
+
+    def __init__(self, diretorio: str = DIRETORIO_PARTICIONADO):
+        import duckdb
+
+        self.diretorio = diretorio
+        self._conexao = duckdb.connect()
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=DUCKDB_JANELA_METRICAS)
+        self._totais = defaultdict(int)
+
+    def _arquivos(self, filtros: dict) -> list:
+        entrada = ler_manifesto(self.diretorio)['tabelas']['atendimentos']
+        com_periodo = filtros['data_min'] and filtros['data_max']
+        particoes = particoes_no_periodo(
+            entrada,
+            filtros['data_min'] if com_periodo else None,
+            filtros['data_max'] if com_periodo else None,
+            unidades=filtros['unidades'] or None,
+        )
+        return [os.path.join(self.diretorio, p['arquivo']) for p in particoes]
+
+    def consultar(self, sql: str, parametros: list) -> pd.DataFrame:
+        inicio = time.perf_counter()
+        cursor = self._conexao.cursor()  # um cursor por consulta: a conexão é compartilhada entre sessões
+        try:
+            resultado = cursor.execute(sql, parametros).df()
+        finally:
+            cursor.close()
+        with self._lock:
+            self._totais['consultas'] += 1
+            self._latencias.append(time.perf_counter() - inicio)
+        return resultado
+
+    def kpis_e_agregados(self, filtros: dict) -> tuple:
+        """(kpis, agregados) do recorte, nos mesmos formatos de _compute_kpis e compute_aggregates."""
+        where, parametros = filtros_para_sql(filtros)
+        arquivos = self._arquivos(filtros)
+        if not arquivos:
+            # Nenhuma partição no período: consulta vazia sobre uma partição qualquer (mantém o esquema)
+            particoes = ler_manifesto(self.diretorio)['tabelas']['atendimentos']['particoes']
+            if not particoes:
+                return self._recorte_vazio()
+            arquivos = [os.path.join(self.diretorio, particoes[0]['arquivo'])]
+            where, parametros = "FALSE", []
+        fonte = f"read_parquet(?) WHERE {where}"
+        parametros = [arquivos] + parametros
+
+        totais = self.consultar(f"""
+            SELECT count(*), count(DISTINCT paciente_id), count(DISTINCT diagnostico_vigente),
+                   count(*) FILTER (WHERE diagnostico_vigente = 'SEM DIAGNÓSTICO')
+            FROM {fonte}
+        """, parametros).iloc[0]
+        cubo = self.consultar(f"""
+            SELECT mes_key, diagnostico_vigente, unidade, profissional_atendimento, count(*) AS n_atendimentos
+            FROM {fonte}
+            GROUP BY ALL ORDER BY ALL
+        """, parametros)
+        dia_diag = self.consultar(f"""
+            SELECT dia_key, diagnostico_vigente, count(*) AS n_atendimentos
+            FROM {fonte} AND dia_key IS NOT NULL AND diagnostico_vigente IS NOT NULL
+            GROUP BY ALL ORDER BY ALL
+        """, parametros)
+        return _montar_kpis(*totais.tolist()), _agregados_do_cubo(cubo, dia_diag)
+
+    @staticmethod
+    def _recorte_vazio() -> tuple:
+        """(kpis, agregados) zerados, para um dataset sem nenhuma partição de atendimentos."""
+        cubo = pd.DataFrame({
+            'mes_key': pd.Series(dtype='int32'),
+            'diagnostico_vigente': pd.Series(dtype=object),
+            'unidade': pd.Series(dtype=object),
+            'profissional_atendimento': pd.Series(dtype=object),
+            'n_atendimentos': pd.Series(dtype='int64'),
+        })
+        dia_diag = pd.DataFrame({
+            'dia_key': pd.Series(dtype='int32'),
+            'diagnostico_vigente': pd.Series(dtype=object),
+            'n_atendimentos': pd.Series(dtype='int64'),
+        })
+        return _montar_kpis(0, 0, 0, 0), _agregados_do_cubo(cubo, dia_diag)
+
+    def registrar_comparacao(self, divergiu: bool):
+        with self._lock:
+            self._totais['comparacoes'] += 1
+            self._totais['divergencias'] += int(divergiu)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencias = list(self._latencias)
+            totais = dict(self._totais)
+        return {
+            'consultas': totais.get('consultas', 0),
+            'comparacoes': totais.get('comparacoes', 0),
+            'divergencias': totais.get('divergencias', 0),
+            'latencia_p50_s': float(np.percentile(latencias, 50)) if latencias else None,
+            'latencia_p95_s': float(np.percentile(latencias, 95)) if latencias else None,
+        }
+
+@st.cache_resource
+def get_duckdb_engine() -> DuckDBQueryEngine:
+    """Conexão DuckDB compartilhada entre sessões."""
+    return DuckDBQueryEngine()
+
+@st.cache_data(max_entries=AGREGADOS_CACHE_MAX_ENTRIES, ttl=AGREGADOS_CACHE_TTL)
+def compute_aggregates_duckdb(assinatura: tuple, _filtros: dict) -> tuple:
+    """(kpis, agregados) do recorte pelo DuckDB; a assinatura (que inclui a versão do dataset) é a chave."""
+    return get_duckdb_engine().kpis_e_agregados(_filtros)
+
+def comparar_motores(kpis_a: dict, agregados_a: dict, kpis_b: dict, agregados_b: dict) -> list:
+    """Divergências entre os KPIs e agregados de dois motores (lista vazia = idênticos)."""
+    diferencas = [
+        f"KPI {chave}: {kpis_a[chave]} × {kpis_b[chave]}"
+        for chave in kpis_a if not math.isclose(kpis_a[chave], kpis_b[chave])
+    ]
+    for nome in agregados_a:
+        diferenca = diferenca_tabelas(agregados_a[nome], agregados_b[nome])
+        if diferenca:
+            diferencas.append(f"{nome}: {diferenca}")
+    return diferencas
+
+class RecorteDashboard:
+    """
+    Recorte do Dashboard Principal: KPIs, agregados e resumos já calculados pelo motor ativo.
+    As linhas (período carregado em pandas e recorte filtrado) só são lidas quando pedidas
+    pela tabela detalhada ou por uma exportação; no modo 'duckdb' nenhuma linha é lida antes.
+    """
+
+    def __init__(self, filtros: dict, assinatura: tuple, kpis: dict, agregados: dict, resumos: dict,
+                 data: Optional[dict] = None, df_filtrado: Optional[pd.DataFrame] = None):
+        self.filtros = filtros
+        self.assinatura = assinatura
+        self.kpis = kpis
+        self.agregados = agregados
+        self.resumos = resumos
+        self._data = data
+        self._df_filtrado = df_filtrado
+
+    def dados(self) -> Optional[dict]:
+        """Linhas do período (load_data); a mensagem de carga já não se aplica aqui."""
+        if self._data is None:
+            self._data = load_data(self.filtros['data_min'], self.filtros['data_max'], avisar=False)
+        return self._data
+
+    def linhas(self) -> pd.DataFrame:
+        """Linhas do recorte filtrado (pelo cache de recortes)."""
+        if self._df_filtrado is None:
+            data = self.dados()
+            df = data['atendimentos']
+            indice_pacientes = get_patient_index(data['versao'], df['paciente_id'])
+            self._df_filtrado = get_filtered_slice(df, self.filtros, data['versao'], indice_pacientes)[0]
+        return self._df_filtrado
+
+def consultar_recorte(filtros: dict) -> Optional[RecorteDashboard]:
+    """
+    Recorte do Dashboard pelo motor de consulta ativo. No modo 'duckdb' só os agregados
+    (pequenos) voltam para o Python; nos demais o período é carregado e filtrado em pandas.
+    """
+    motor = motor_consulta_ativo()
+    if motor == 'duckdb':
+        versao = _versao_manifesto()
+        assinatura = _filter_signature(filtros, _versao_periodo(versao, filtros['data_min'], filtros['data_max']))
+        kpis, agregados = compute_aggregates_duckdb(assinatura, filtros)
+        st.session_state.pop('_resumo_memoria', None)  # nenhuma tabela carregada nesta execução
+        return RecorteDashboard(filtros, assinatura, kpis, agregados, _resumos_particionado(versao))
+
+    # Com o dataset particionado, só os meses do período são lidos
+    data = load_data(filtros['data_min'], filtros['data_max'])
+    if data is None:
+        return None
+    df = data['atendimentos']
+    indice_pacientes = get_patient_index(data['versao'], df['paciente_id'])
+    df_filtrado, kpis, assinatura = get_filtered_slice(df, filtros, data['versao'], indice_pacientes)
+    agregados = compute_aggregates(assinatura, df_filtrado)
+    if motor == 'comparar':
+        kpis_duckdb, agregados_duckdb = compute_aggregates_duckdb(assinatura, filtros)
+        diferencas = comparar_motores(kpis, agregados, kpis_duckdb, agregados_duckdb)
+        get_duckdb_engine().registrar_comparacao(bool(diferencas))
+        if diferencas:
+            st.warning("⚠️ DuckDB e pandas divergem neste recorte: " + "; ".join(diferencas[:3]))
+    resumos = {nome: data.get(nome) for nome in RESUMOS_PRE_CALCULADOS}
+    return RecorteDashboard(filtros, assinatura, kpis, agregados, resumos, data=data, df_filtrado=df_filtrado)
 
 # ============================================================================
 # FUNÇÕES DE VISUALIZAÇÃO
 # ============================================================================
 
-def plot_serie_temporal(df, segmentar_por_diag=False):
-    """Gera gráfico de série temporal mensal."""
-    df_ts = df.copy()
-    df_ts['ano_mes'] = df_ts['data_atendimento'].dt.to_period('M').astype(str)
-    
-    if segmentar_por_diag and len(df_ts['diagnostico_vigente'].unique()) <= 10:
-        # Stacked area chart por diagnóstico
-        df_agg = df_ts.groupby(['ano_mes', 'diagnostico_vigente']).size().reset_index(name='n_atendimentos')
-        fig = px.area(
-            df_agg, 
-            x='ano_mes', 
-            y='n_atendimentos', 
-            color='diagnostico_vigente',
-            title='Série Temporal de Atendimentos (por Diagnóstico)',
-            labels={'ano_mes': 'Mês', 'n_atendimentos': 'Nº de Atendimentos'},
-            color_discrete_sequence=COLOR_PALETTE
-        )
+def plot_serie_temporal(serie, granularidade='mes', segmentar_por_diag=False, max_pontos=SERIE_MAX_PONTOS):
+    """
+    Gráfico de série temporal (WebGL) a partir da tabela período × diagnóstico.
+    Com mais pontos que `max_pontos`, os períodos exibidos são escolhidos por LTTB sobre o total
+    (os mesmos em todos os traços, para o empilhamento continuar alinhado).
+    """
+    rotulo = GRANULARIDADES_SERIE[granularidade]
+    segmentar = segmentar_por_diag and 0 < serie.shape[1] <= 10
+    if segmentar:
+        # Área empilhada por diagnóstico (maiores embaixo)
+        tracos = serie[serie.sum().sort_values(ascending=False).index]
+        titulo = 'Série Temporal de Atendimentos (por Diagnóstico)'
     else:
-        # Linha simples com cor primária teal
-        df_agg = df_ts.groupby('ano_mes').size().reset_index(name='n_atendimentos')
-        fig = px.line(
-            df_agg, 
-            x='ano_mes', 
-            y='n_atendimentos',
-            title='Série Temporal de Atendimentos',
-            labels={'ano_mes': 'Mês', 'n_atendimentos': 'Nº de Atendimentos'},
-            markers=True,
-            color_discrete_sequence=[COLORS['primary']]
-        )
-    
+        tracos = serie.sum(axis=1).to_frame('Atendimentos')
+        titulo = 'Série Temporal de Atendimentos'
+
+    indices = lttb_indices(tracos.sum(axis=1).to_numpy(), max(3, max_pontos // max(1, tracos.shape[1])))
+    tracos = tracos.iloc[indices]
+    formato_x = {'dia': '%d/%m/%Y', 'semana': 'semana de %d/%m/%Y', 'mes': '%m/%Y'}[granularidade]
+
+    fig = go.Figure()
+    acumulado = np.zeros(len(tracos))
+    for i, coluna in enumerate(tracos.columns):
+        valores = tracos[coluna].to_numpy()
+        acumulado = acumulado + valores
+        fig.add_trace(go.Scattergl(
+            x=tracos.index,
+            y=acumulado if segmentar else valores,
+            customdata=valores,
+            name=str(coluna),
+            mode='lines' if len(tracos) > 60 else 'lines+markers',
+            fill=('tozeroy' if i == 0 else 'tonexty') if segmentar else None,
+            line=dict(color=COLOR_PALETTE[i % len(COLOR_PALETTE)] if segmentar else COLORS['primary']),
+            xhoverformat=formato_x,
+            hovertemplate='%{customdata:,}',
+            showlegend=segmentar,
+        ))
+
     fig.update_layout(
-        xaxis_title='Mês',
+        title=titulo,
+        xaxis_title=rotulo,
         yaxis_title='Nº de Atendimentos',
         hovermode='x unified',
         height=400,
@@ -322,10 +1216,9 @@ def plot_serie_temporal(df, segmentar_por_diag=False):
     )
     return fig
 
-def plot_top_diagnosticos(df, top_n=10):
-    """Gráfico de barras horizontais com top diagnósticos."""
-    df_com_diag = df[df['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
-    df_top = df_com_diag.groupby('diagnostico_vigente').size().reset_index(name='n_atendimentos')
+def plot_top_diagnosticos(agg_diag, top_n=10):
+    """Gráfico de barras horizontais com top diagnósticos (a partir das contagens por diagnóstico)."""
+    df_top = agg_diag[agg_diag['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
     df_top = df_top.sort_values('n_atendimentos', ascending=True).tail(top_n)
     
     # Gradiente customizado do teal claro ao escuro
@@ -355,14 +1248,13 @@ def plot_top_diagnosticos(df, top_n=10):
     )
     return fig
 
-def plot_heatmap_diag_unidade(df):
-    """Heatmap de diagnóstico × unidade."""
-    df_com_diag = df[df['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
-    df_pivot = df_com_diag.groupby(['diagnostico_vigente', 'unidade']).size().reset_index(name='n_atendimentos')
+def plot_heatmap_diag_unidade(agg_diag_unidade):
+    """Heatmap de diagnóstico × unidade (a partir das contagens diagnóstico × unidade)."""
+    df_pivot = agg_diag_unidade[agg_diag_unidade['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']
     
     # Limitar a top diagnósticos e unidades para legibilidade
-    top_diag = df_com_diag.groupby('diagnostico_vigente').size().nlargest(10).index
-    top_unidades = df_com_diag.groupby('unidade').size().nlargest(10).index
+    top_diag = df_pivot.groupby('diagnostico_vigente', observed=True)['n_atendimentos'].sum().nlargest(10).index
+    top_unidades = df_pivot.groupby('unidade', observed=True)['n_atendimentos'].sum().nlargest(10).index
     
     df_pivot = df_pivot[
         df_pivot['diagnostico_vigente'].isin(top_diag) &
@@ -394,6 +1286,304 @@ def plot_heatmap_diag_unidade(df):
     )
     return fig
 
+# ============================================================================
+# TABELAS PAGINADAS
+# ============================================================================
+
+TAMANHOS_PAGINA = [25, 50, 100, 250, 500]
+
+def render_tabela_paginada(df_base, df_recorte, ordem_data, key: str, coluna_data: str, colunas_padrao=None):
+    """
+    Tabela detalhada paginada no servidor: apenas a página visível é materializada
+    e enviada ao navegador.
+    - A ordenação por data usa a ordem pré-calculada do dataset (`ordem_data`), sem reordenar o recorte.
+    - Outras colunas são ordenadas no servidor, só sobre a coluna escolhida.
+    """
+    total = len(df_recorte)
+    st.markdown(f"**Total de registros:** {total:,}")
+    if total == 0:
+        st.info("Nenhum registro para os filtros selecionados.")
+        return
+
+    colunas = list(df_base.columns)
+    colunas_padrao = [c for c in (colunas_padrao or colunas) if c in colunas]
+
+    col_a, col_b, col_c, col_d = st.columns([3, 2, 1, 1])
+    with col_a:
+        colunas_sel = st.multiselect("Colunas", options=colunas, default=colunas_padrao, key=f"{key}_colunas")
+    with col_b:
+        ordenar_por = st.selectbox("Ordenar por", options=colunas, index=colunas.index(coluna_data), key=f"{key}_ordem")
+    with col_c:
+        decrescente = st.checkbox("Decrescente", value=True, key=f"{key}_desc")
+    with col_d:
+        tamanho = st.selectbox("Linhas/página", options=TAMANHOS_PAGINA, index=2, key=f"{key}_tamanho")
+
+    # Posições (em df_base) das linhas do recorte, na ordem pedida
+    posicoes_recorte = df_base.index.get_indexer(df_recorte.index)
+    if ordenar_por == coluna_data and ordem_data is not None:
+        selecionadas = np.zeros(len(df_base), dtype=bool)
+        selecionadas[posicoes_recorte] = True
+        ordem = ordem_data[selecionadas[ordem_data]]
+        if not decrescente:
+            ordem = ordem[::-1]
+    else:
+        ordenado = df_recorte[ordenar_por].sort_values(ascending=not decrescente, kind='stable', na_position='last')
+        ordem = df_base.index.get_indexer(ordenado.index)
+
+    n_paginas = max(1, -(-total // tamanho))
+    if st.session_state.get(f"{key}_pagina", 1) > n_paginas:
+        st.session_state[f"{key}_pagina"] = 1  # recorte encolheu: volta à primeira página
+    pagina = st.number_input("Página", min_value=1, max_value=n_paginas, value=1, step=1, key=f"{key}_pagina")
+    inicio = (int(pagina) - 1) * tamanho
+    fim = min(inicio + tamanho, total)
+
+    cols_idx = [df_base.columns.get_loc(c) for c in (colunas_sel or colunas_padrao)]
+    df_pagina = df_base.iloc[ordem[inicio:fim], cols_idx]
+    st.dataframe(df_pagina, use_container_width=True, height=500)
+    st.caption(f"Página {int(pagina)} de {n_paginas} · linhas {inicio + 1:,}–{fim:,} de {total:,}")
+
+# ============================================================================
+# EXPORTAÇÃO SOB DEMANDA
+# ============================================================================
+
+EXPORT_CACHE_MAX_ENTRIES = 16
+EXPORT_CACHE_TTL = 1800  # segundos
+EXPORT_LINHAS_POR_BLOCO = 50_000
+
+FORMATOS_EXPORTACAO = {
+    'CSV': ('csv', 'text/csv'),
+    'CSV.gz': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+def _csv_em_blocos(df, destino, linhas_por_bloco: int = EXPORT_LINHAS_POR_BLOCO):
+    """Escreve o CSV em blocos de linhas (BOM UTF-8 no início), sem montar o texto inteiro em memória."""
+    destino.write('\ufeff'.encode('utf-8'))
+    for inicio in range(0, max(len(df), 1), linhas_por_bloco):
+        bloco = df.iloc[inicio:inicio + linhas_por_bloco]
+        destino.write(bloco.to_csv(index=False, header=(inicio == 0)).encode('utf-8'))
+
+@st.cache_data(max_entries=EXPORT_CACHE_MAX_ENTRIES, ttl=EXPORT_CACHE_TTL, show_spinner=False)
+def gerar_exportacao_tabela(assinatura: tuple, formato: str, _df) -> bytes:
+    """Arquivo do recorte no formato pedido, em cache pela assinatura dos filtros."""
+    output = BytesIO()
+    if formato == 'CSV':
+        _csv_em_blocos(_df, output)
+    elif formato == 'CSV.gz':
+        with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6) as gz:
+            _csv_em_blocos(_df, gz)
+    elif formato == 'Parquet':
+        _df.to_parquet(output, index=False)
+    else:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    return output.getvalue()
+
+@st.cache_data(max_entries=EXPORT_CACHE_MAX_ENTRIES, ttl=EXPORT_CACHE_TTL, show_spinner=False)
+def gerar_exportacao_resumos(assinatura: tuple, _resumo_consolidado: dict) -> bytes:
+    """Excel (em memória) com uma aba por resumo, em cache pela assinatura dos filtros."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df_sheet in _resumo_consolidado.items():
+            df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+    return output.getvalue()
+
+def _formatos_disponiveis() -> list:
+    try:
+        import pyarrow  # noqa: F401
+        return list(FORMATOS_EXPORTACAO)
+    except ImportError:
+        return [f for f in FORMATOS_EXPORTACAO if f != 'Parquet']
+
+def render_botao_exportacao(rotulo: str, key: str, pedido, gerar, file_name: str, mime: str):
+    """
+    O arquivo só é gerado quando o usuário pede ("Preparar"). Enquanto o pedido
+    (assinatura + formato) não muda, os reruns reaproveitam o arquivo em cache.
+    """
+    if st.session_state.get(key) != pedido:
+        if not st.button(f"⚙️ Preparar {rotulo}", key=f"{key}_preparar"):
+            return
+        st.session_state[key] = pedido
+
+    with st.spinner(f"Gerando {rotulo}..."):
+        dados = gerar()
+    st.download_button(
+        label=f"📥 Download {rotulo}",
+        data=dados,
+        file_name=file_name,
+        mime=mime,
+        key=f"{key}_download",
+    )
+
+# ============================================================================
+# EXPORTAÇÕES EM SEGUNDO PLANO
+# ============================================================================
+
+EXPORT_JOBS_MAX_WORKERS = 2
+EXPORT_ARTEFATO_TTL = 3600  # segundos
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), 'dashboard_exportacoes')
+
+class ExportJobManager:
+    """
+    Fila de exportações pesadas executadas em threads de fundo (por processo).
+    Os arquivos prontos ficam em um diretório temporário e expiram após `ttl` segundos.
+    """
+
+    def __init__(self, max_workers: int = EXPORT_JOBS_MAX_WORKERS, diretorio: str = EXPORT_DIR, ttl: int = EXPORT_ARTEFATO_TTL):
+        self.diretorio = diretorio
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exportacao')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def submit(self, descricao: str, nome_arquivo: str, mime: str, tarefa) -> str:
+        """
+        Enfileira `tarefa(caminho, progresso)`, que deve gravar o arquivo em `caminho`
+        e chamar `progresso(fracao, mensagem)` ao longo do trabalho.
+        """
+        self.limpar_expirados()
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'descricao': descricao,
+            'nome_arquivo': nome_arquivo,
+            'mime': mime,
+            'caminho': os.path.join(self.diretorio, f"{job_id}_{nome_arquivo}"),
+            'status': 'na fila',
+            'progresso': 0.0,
+            'mensagem': '',
+            'erro': None,
+            'criado_em': time.time(),
+            'concluido_em': None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        self._executor.submit(self._executar, job, tarefa)
+        return job_id
+
+    def _executar(self, job, tarefa):
+        def progresso(fracao: float, mensagem: str = ''):
+            job['progresso'] = min(max(float(fracao), 0.0), 1.0)
+            job['mensagem'] = mensagem
+
+        job['status'] = 'executando'
+        try:
+            tarefa(job['caminho'], progresso)
+            job['progresso'] = 1.0
+            job['status'] = 'concluído'
+        except Exception as e:
+            job['status'] = 'erro'
+            job['erro'] = str(e)
+        finally:
+            job['concluido_em'] = time.time()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def limpar_expirados(self):
+        agora = time.time()
+        with self._lock:
+            expirados = [
+                j for j in self._jobs.values()
+                if j['concluido_em'] is not None and agora - j['concluido_em'] > self.ttl
+            ]
+            for job in expirados:
+                self._jobs.pop(job['id'], None)
+        for job in expirados:
+            try:
+                os.remove(job['caminho'])
+            except OSError:
+                pass
+
+@st.cache_resource
+def get_export_jobs() -> ExportJobManager:
+    """Fila de exportações compartilhada entre sessões."""
+    return ExportJobManager()
+
+EXCEL_MAX_LINHAS = 1_048_576  # linhas por aba no Excel (cabeçalho incluso)
+
+def _tarefa_excel_recorte(df, resumo_consolidado: dict, linhas_por_bloco: int = 5_000,
+                          linhas_por_aba: int = EXCEL_MAX_LINHAS - 1):
+    """
+    Tarefa de exportação: Excel com as linhas do recorte + abas de resumo (openpyxl em modo write-only).
+    Acima do limite de linhas de uma aba, as linhas continuam em Atendimentos_2, Atendimentos_3...
+    """
+    def tarefa(caminho, progresso):
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        total = max(len(df), 1)
+        escritas = 0
+        for numero, inicio_aba in enumerate(range(0, total, linhas_por_aba), start=1):
+            ws = wb.create_sheet('Atendimentos' if numero == 1 else f'Atendimentos_{numero}')
+            ws.append(list(df.columns))
+            fim_aba = min(inicio_aba + linhas_por_aba, len(df))
+            for inicio in range(inicio_aba, fim_aba, linhas_por_bloco):
+                bloco = df.iloc[inicio:min(inicio + linhas_por_bloco, fim_aba)].astype(object)
+                bloco = bloco.where(bloco.notna(), None)
+                for linha in bloco.itertuples(index=False, name=None):
+                    ws.append(linha)
+                escritas += len(bloco)
+                progresso(0.9 * escritas / total, f"{escritas:,} de {len(df):,} linhas")
+
+        for sheet_name, df_sheet in resumo_consolidado.items():
+            ws_resumo = wb.create_sheet(sheet_name)
+            ws_resumo.append(list(df_sheet.columns))
+            df_sheet = df_sheet.astype(object)
+            for linha in df_sheet.where(df_sheet.notna(), None).itertuples(index=False, name=None):
+                ws_resumo.append(linha)
+
+        progresso(0.95, "Gravando arquivo...")
+        wb.save(caminho)
+    return tarefa
+
+def render_painel_exportacoes(chave_sessao: str = 'export_jobs'):
+    """Progresso e downloads das exportações em segundo plano desta sessão."""
+    jobs_ids = st.session_state.get(chave_sessao, [])
+    if not jobs_ids:
+        return
+    gerenciador = get_export_jobs()
+
+    def _pendentes() -> list:
+        jobs = (gerenciador.get(i) for i in jobs_ids)
+        return [j for j in jobs if j is not None and j['status'] in ('na fila', 'executando')]
+
+    # Concluídas e com erro: só na execução completa (o arquivo é lido uma vez, não a cada atualização)
+    for j in (gerenciador.get(i) for i in jobs_ids):
+        if j is None:
+            continue
+        if j['status'] == 'concluído' and os.path.exists(j['caminho']):
+            expira_em = max(0, int((j['concluido_em'] + gerenciador.ttl - time.time()) / 60))
+            with open(j['caminho'], 'rb') as f:
+                st.download_button(
+                    f"📥 {j['descricao']}",
+                    data=f.read(),
+                    file_name=j['nome_arquivo'],
+                    mime=j['mime'],
+                    key=f"job_{j['id']}",
+                )
+            st.caption(f"Disponível por mais {expira_em} min.")
+        elif j['status'] == 'erro':
+            st.error(f"{j['descricao']}: erro na exportação ({j['erro']})")
+
+    ids_pendentes = {j['id'] for j in _pendentes()}
+    if not ids_pendentes:
+        return
+
+    # Enquanto houver exportação pendente, só o progresso é reexecutado periodicamente; quando
+    # alguma termina, uma execução completa mostra o download e encerra a atualização periódica
+    @st.fragment(run_every=2)
+    def _progresso():
+        pendentes = _pendentes()
+        if {j['id'] for j in pendentes} != ids_pendentes:
+            st.rerun()
+        for j in pendentes:
+            st.progress(j['progresso'], text=f"{j['descricao']} — {j['status']} {j['mensagem']}")
+
+    _progresso()
+
 # ============================================================================
 # FUNÇÕES AUXILIARES
 # ============================================================================
@@ -401,7 +1591,7 @@ def plot_heatmap_diag_unidade(df):
 def display_logo():
     """Exibe o logo no topo da sidebar."""
     try:
-        st.sidebar.image("Logo Clinica Pace (1) (1).png", use_container_width=True)
+        st.sidebar.image(LOGO_PATH, use_container_width=True)
         st.sidebar.markdown("---")
     except:
         pass  # Se o logo não for encontrado, continua sem ele
@@ -424,103 +1614,722 @@ def _get_openai_api_key() -> Optional[str]:
         pass
     return os.getenv("OPENAI_API_KEY")
 
-def _build_insights_data_context(df_filtrado: pd.DataFrame, periodo_label: str) -> str:
-    # Mantém o contexto curto para caber no prompt
-    total_atendimentos = len(df_filtrado)
-    pacientes_unicos = int(df_filtrado["paciente_id"].nunique()) if "paciente_id" in df_filtrado.columns else 0
-    diagnosticos_distintos = int(df_filtrado["diagnostico_vigente"].nunique()) if "diagnostico_vigente" in df_filtrado.columns else 0
-    sem_diag_count = int((df_filtrado["diagnostico_vigente"] == "SEM DIAGNÓSTICO").sum()) if "diagnostico_vigente" in df_filtrado.columns else 0
-    pct_sem_diag = (sem_diag_count / total_atendimentos * 100) if total_atendimentos > 0 else 0.0
+INSIGHTS_CONTEXTO_CACHE_MAX_ENTRIES = 32
+INSIGHTS_CONTEXTO_CACHE_TTL = 3600  # segundos
+INSIGHTS_TOP_N = 10
+INSIGHTS_MESES = 12
+INSIGHTS_ORCAMENTO_TOKENS = 1200  # orçamento padrão do contexto de dados
+INSIGHTS_TOKENS_SAIDA_ESTIMADOS = 1500  # tamanho típico do relatório gerado
+
+# Níveis de detalhe do contexto, do mais completo ao mais enxuto; usa-se o primeiro que cabe no orçamento
+NIVEIS_CONTEXTO = [
+    {'top_n': 10, 'meses': 12, 'granularidade': 'mes'},
+    {'top_n': 7, 'meses': 12, 'granularidade': 'mes'},
+    {'top_n': 5, 'meses': 12, 'granularidade': 'trimestre'},
+    {'top_n': 3, 'meses': 12, 'granularidade': 'trimestre'},
+    {'top_n': 3, 'meses': 0, 'granularidade': None},
+]
 
+# Estimativas por modelo: US$ por 1M de tokens (entrada/saída) e vazão de geração.
+# Valores de referência — ajustar conforme a tabela de preços vigente.
+MODELOS_IA = {
+    "gpt-4o-mini": {"entrada": 0.15, "saida": 0.60, "tokens_por_s": 80},
+    "gpt-4o": {"entrada": 2.50, "saida": 10.00, "tokens_por_s": 60},
+    "gpt-4.1-mini": {"entrada": 0.40, "saida": 1.60, "tokens_por_s": 80},
+    "gpt-4.1": {"entrada": 2.00, "saida": 8.00, "tokens_por_s": 50},
+}
+MODELO_REFERENCIA = "gpt-4o-mini"
+LATENCIA_BASE_S = 1.0  # rede + fila até o primeiro token
+PREFILL_TOKENS_POR_S = 5000  # leitura do prompt pelo modelo
+
+def _df_to_md_table(df_in: pd.DataFrame) -> str:
+    """Tabela markdown montada por coluna (operações vetorizadas), sem iterar linhas."""
+    if df_in is None or df_in.empty:
+        return "_Sem dados para este recorte._"
+    cols = list(df_in.columns)
+    header = "| " + " | ".join(cols) + " |"
+    sep = "| " + " | ".join(["---"] * len(cols)) + " |"
+    linhas = "| " + df_in[cols[0]].astype(str)
+    for c in cols[1:]:
+        linhas = linhas + " | " + df_in[c].astype(str)
+    linhas = linhas + " |"
+    return "\n".join([header, sep] + linhas.tolist())
+
+def _top_table(agg: pd.DataFrame, coluna: str, top_n: int = INSIGHTS_TOP_N) -> str:
+    """
+    Top N de um agregado (coluna, n_atendimentos); empates em ordem alfabética.
+    A cauda vira uma linha "outros (k)" para o total continuar batendo.
+    """
+    ordenado = agg.sort_values(['n_atendimentos', coluna], ascending=[False, True], kind='stable')
+    top = ordenado.head(top_n)
+    categorias = top[coluna].astype(str).tolist()
+    qtdes = top['n_atendimentos'].tolist()
+    resto = ordenado.iloc[top_n:]
+    if len(resto):
+        categorias.append(f"outros ({len(resto)})")
+        qtdes.append(int(resto['n_atendimentos'].sum()))
+    return _df_to_md_table(pd.DataFrame({"categoria": categorias, "qtde": qtdes}))
+
+def _serie_temporal(cubo: pd.DataFrame, meses: int, granularidade: str) -> pd.DataFrame:
+    ts = _rollup(cubo, ['mes_key']).tail(meses)
+    if granularidade == 'trimestre':
+        mes_key = ts['mes_key'].astype('int64')
+        trimestre = (mes_key // 100).astype(str) + '-T' + ((mes_key % 100 - 1) // 3 + 1).astype(str)
+        ts = ts.groupby(trimestre.to_numpy(), sort=False)['n_atendimentos'].sum()
+        return pd.DataFrame({"trimestre": ts.index, "n_atendimentos": ts.to_numpy()})
+    return pd.DataFrame({"ano_mes": rotulo_mes(ts["mes_key"]).to_numpy(), "n_atendimentos": ts["n_atendimentos"].to_numpy()})
+
+def _build_insights_data_context(agregados: dict, kpis: dict, colunas: list, periodo_label: str,
+                                 top_n: int = INSIGHTS_TOP_N, meses: int = INSIGHTS_MESES,
+                                 granularidade: Optional[str] = 'mes') -> str:
+    # Mantém o contexto curto para caber no prompt; tudo vem dos agregados do recorte
     ctx = []
     ctx.append(f"### Período / recorte\n{periodo_label}\n")
     ctx.append("### KPIs do recorte")
-    ctx.append(f"- Total de atendimentos: {total_atendimentos}")
-    ctx.append(f"- Pacientes únicos: {pacientes_unicos}")
-    ctx.append(f"- Diagnósticos distintos: {diagnosticos_distintos}")
-    ctx.append(f"- Atendimentos 'SEM DIAGNÓSTICO': {sem_diag_count} ({pct_sem_diag:.2f}%)\n")
+    ctx.append(f"- Total de atendimentos: {kpis['total_atendimentos']}")
+    ctx.append(f"- Pacientes únicos: {kpis['pacientes_unicos']}")
+    ctx.append(f"- Diagnósticos distintos: {kpis['diagnosticos_distintos']}")
+    ctx.append(f"- Atendimentos 'SEM DIAGNÓSTICO': {kpis['sem_diag_count']} ({kpis['pct_sem_diag']:.2f}%)\n")
 
     # Top diagnósticos / unidades / profissionais
-    def _df_to_md_table(df_in: pd.DataFrame) -> str:
-        if df_in is None or df_in.empty:
-            return "_Sem dados para este recorte._"
-        cols = list(df_in.columns)
-        header = "| " + " | ".join(cols) + " |"
-        sep = "| " + " | ".join(["---"] * len(cols)) + " |"
-        rows = []
-        for _, row in df_in.iterrows():
-            rows.append("| " + " | ".join(str(row[c]) for c in cols) + " |")
-        return "\n".join([header, sep] + rows)
-
-    def _top_table(series: pd.Series, top_n: int = 10) -> str:
-        if series is None or series.empty:
-            return "_Sem dados para este recorte._"
-        top = series.value_counts().head(top_n).reset_index()
-        top.columns = ["categoria", "qtde"]
-        return _df_to_md_table(top)
-
-    if "diagnostico_vigente" in df_filtrado.columns:
-        ctx.append("### Top 10 diagnósticos (qtde atendimentos)")
-        ctx.append(_top_table(df_filtrado["diagnostico_vigente"]))
-        ctx.append("")
-    if "unidade" in df_filtrado.columns:
-        ctx.append("### Top 10 unidades (qtde atendimentos)")
-        ctx.append(_top_table(df_filtrado["unidade"]))
-        ctx.append("")
-    if "profissional_atendimento" in df_filtrado.columns:
-        ctx.append("### Top 10 profissionais (qtde atendimentos)")
-        ctx.append(_top_table(df_filtrado["profissional_atendimento"]))
-        ctx.append("")
-
-    # Série temporal mensal (últimos 12 meses do recorte)
-    if "data_atendimento" in df_filtrado.columns and pd.api.types.is_datetime64_any_dtype(df_filtrado["data_atendimento"]):
-        df_ts = df_filtrado.copy()
-        df_ts["ano_mes"] = df_ts["data_atendimento"].dt.to_period("M").astype(str)
-        ts = df_ts.groupby("ano_mes").size().reset_index(name="n_atendimentos").sort_values("ano_mes")
-        ts = ts.tail(12)
+    ctx.append(f"### Top {top_n} diagnósticos (qtde atendimentos)")
+    ctx.append(_top_table(agregados['diag'], 'diagnostico_vigente', top_n))
+    ctx.append("")
+    ctx.append(f"### Top {top_n} unidades (qtde atendimentos)")
+    ctx.append(_top_table(agregados['unidade'], 'unidade', top_n))
+    ctx.append("")
+    ctx.append(f"### Top {top_n} profissionais (qtde atendimentos)")
+    ctx.append(_top_table(agregados['profissional'], 'profissional_atendimento', top_n))
+    ctx.append("")
+
+    # Série temporal (últimos `meses` meses do recorte, por mês ou trimestre)
+    if meses and granularidade:
+        ts = _serie_temporal(agregados['cubo'], meses, granularidade)
         if not ts.empty:
-            ctx.append("### Série temporal mensal (últimos 12 meses no recorte)")
+            nome = "mensal" if granularidade == 'mes' else "trimestral"
+            ctx.append(f"### Série temporal {nome} (últimos {meses} meses no recorte)")
             ctx.append(_df_to_md_table(ts))
             ctx.append("")
 
     # Qualidade mínima
-    cols = [c for c in ["atendimento_id", "paciente_id", "data_atendimento", "profissional_atendimento", "unidade", "diagnostico_vigente", "data_avaliacao_origem", "profissional_avaliacao_origem"] if c in df_filtrado.columns]
+    cols = [c for c in ["atendimento_id", "paciente_id", "data_atendimento", "profissional_atendimento", "unidade", "diagnostico_vigente", "data_avaliacao_origem", "profissional_avaliacao_origem"] if c in colunas]
     ctx.append("### Colunas disponíveis (no recorte)")
     ctx.append(", ".join(cols) if cols else "_Colunas não identificadas._")
 
     return "\n".join(ctx)
 
-def _generate_insights_with_ai(prompt_template: str, data_context_md: str, api_key: str, model: str, temperature: float) -> str:
+# ============================================================================
+# TOKENS, CUSTO E LATÊNCIA
+# ============================================================================
+
+@functools.lru_cache(maxsize=8)
+def _tokenizador(model: str):
+    """Tokenizador local do modelo (tiktoken, opcional); None se indisponível."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None  # ex.: sem rede para baixar o vocabulário na primeira vez
+
+def contar_tokens(texto: str, model: str = MODELO_REFERENCIA) -> int:
+    tokenizador = _tokenizador(model)
+    if tokenizador is None:
+        # Sem tiktoken: ~3,5 caracteres por token em português (estimativa conservadora)
+        return math.ceil(len(texto) / 3.5)
+    return len(tokenizador.encode(texto, disallowed_special=()))
+
+def compactar_prompt(texto: str) -> str:
+    """Remove espaços no fim das linhas e linhas em branco repetidas (tokens sem conteúdo)."""
+    texto = re.sub(r"[ \t]+$", "", texto, flags=re.MULTILINE)
+    return re.sub(r"\n{3,}", "\n\n", texto).strip() + "\n"
+
+def estimar_custo(prompt_template: str, contexto: dict, model: str) -> dict:
+    """Tokens de entrada (prompt + contexto), custo e latência estimados antes do envio."""
+    precos = MODELOS_IA.get(model, MODELOS_IA[MODELO_REFERENCIA])
+    tokens_prompt = contar_tokens(prompt_template, model)
+    tokens_entrada = tokens_prompt + contexto['tokens']
+    tokens_saida = INSIGHTS_TOKENS_SAIDA_ESTIMADOS
+    return {
+        'tokens_prompt': tokens_prompt,
+        'tokens_entrada': tokens_entrada,
+        'tokens_saida': tokens_saida,
+        'custo_usd': (tokens_entrada * precos['entrada'] + tokens_saida * precos['saida']) / 1_000_000,
+        'latencia_s': LATENCIA_BASE_S + tokens_entrada / PREFILL_TOKENS_POR_S + tokens_saida / precos['tokens_por_s'],
+        'preco_de_referencia': model not in MODELOS_IA,
+        'tokenizador': "tiktoken" if _tokenizador(model) is not None else "estimativa por caracteres",
+    }
+
+@st.cache_data(max_entries=INSIGHTS_CONTEXTO_CACHE_MAX_ENTRIES, ttl=INSIGHTS_CONTEXTO_CACHE_TTL)
+def get_insights_context(assinatura: tuple, periodo_label: str, foco: str, _df_filtrado, _kpis: dict,
+                         orcamento_tokens: int = INSIGHTS_ORCAMENTO_TOKENS, model: str = MODELO_REFERENCIA) -> dict:
+    """
+    Contexto de dados enviado à IA, montado só quando pedido e em cache por
+    assinatura dos filtros + rótulo do período + foco + orçamento + modelo.
+    Usa o nível de detalhe mais completo (NIVEIS_CONTEXTO) que cabe em `orcamento_tokens`.
+    Retorna {'texto', 'bytes', 'tokens', 'nivel', 'excede_orcamento', 'tempo_ms'}.
+    """
+    inicio = time.perf_counter()
+    agregados = compute_aggregates(assinatura, _df_filtrado)
+    colunas = list(_df_filtrado.columns)
+    foco_md = f"\n\n### Foco solicitado pelos gestores\n{foco.strip()}\n" if foco.strip() else ""
+
+    for nivel in NIVEIS_CONTEXTO:
+        texto = _build_insights_data_context(agregados, _kpis, colunas, periodo_label, **nivel) + foco_md
+        tokens = contar_tokens(texto, model)
+        if tokens <= orcamento_tokens:
+            break
+    return {
+        'texto': texto,
+        'bytes': len(texto.encode('utf-8')),
+        'tokens': tokens,
+        'nivel': nivel,
+        'excede_orcamento': tokens > orcamento_tokens,
+        'tempo_ms': (time.perf_counter() - inicio) * 1000,
+    }
+
+def _render_metricas_contexto(contexto: dict, tempo_chamada_ms: float, estimativa: Optional[dict] = None):
+    st.caption(
+        f"Contexto: {contexto['bytes'] / 1024:,.1f} KB ({contexto['bytes']:,} bytes) · "
+        f"{contexto['tokens']:,} tokens · montado em {contexto['tempo_ms']:.0f} ms"
+        + (" · reaproveitado do cache" if tempo_chamada_ms < contexto['tempo_ms'] / 2 else "")
+    )
+    nivel = contexto['nivel']
+    serie = {"mes": "mensal", "trimestre": "trimestral"}.get(nivel['granularidade'], "sem série temporal")
+    st.caption(f"Detalhe: top {nivel['top_n']} + outros · série {serie}")
+    if contexto['excede_orcamento']:
+        st.warning("O contexto ficou acima do orçamento de tokens mesmo no nível mais enxuto.")
+    if estimativa is not None:
+        st.caption(
+            f"Estimativa antes do envio: {estimativa['tokens_entrada']:,} tokens de entrada "
+            f"(prompt {estimativa['tokens_prompt']:,}) + ~{estimativa['tokens_saida']:,} de saída · "
+            f"custo ≈ US$ {estimativa['custo_usd']:.4f} · latência ≈ {estimativa['latencia_s']:.0f} s"
+            + (" · preço de referência" if estimativa['preco_de_referencia'] else "")
+            + f" · tokens via {estimativa['tokenizador']}"
+        )
+
+def _insights_messages(prompt_template: str, data_context_md: str) -> list:
+    return [
+        {"role": "system", "content": prompt_template},
+        {"role": "user", "content": f"## DADOS PARA ANÁLISE\n\n{data_context_md}\n\nGere o relatório no formato especificado no prompt. Não invente dados."},
+    ]
+
+def _generate_insights_with_ai(prompt_template: str, data_context_md: str, api_key: str, model: str, temperature: float,
+                               client=None, llm_pool: Optional["LLMClientPool"] = None) -> str:
+    # `client` permite injetar um cliente compatível (ex.: FakeStreamingClient); senão, o do provedor ativo.
+    resp = (llm_pool or get_llm_pool()).completar(
+        api_key,
+        client=client,
+        model=model,
+        temperature=temperature,
+        messages=_insights_messages(prompt_template, data_context_md),
+    )
+    return resp.choices[0].message.content or ""
+
+def _stream_insights_with_ai(prompt_template: str, data_context_md: str, api_key: str, model: str, temperature: float,
+                             client=None, llm_pool: Optional["LLMClientPool"] = None):
+    """Gera o relatório em streaming, produzindo os trechos de texto à medida que chegam."""
+    stream = (llm_pool or get_llm_pool()).transmitir(
+        api_key,
+        client=client,
+        model=model,
+        temperature=temperature,
+        messages=_insights_messages(prompt_template, data_context_md),
+    )
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+def _insights_fake_ativo() -> bool:
+    return os.getenv("INSIGHTS_FAKE_LLM", "").strip().lower() in ("1", "true", "sim")
+
+# ============================================================================
+# CLIENTE DA IA (PROVEDORES, POOL DE CONEXÕES, RETRIES E MÉTRICAS)
+# ============================================================================
+
+IA_TIMEOUT_S = 90.0             # leitura (entre bytes da resposta)
+IA_TIMEOUT_CONEXAO_S = 10.0
+IA_MAX_TENTATIVAS = 4
+IA_BACKOFF_BASE_S = 1.0
+IA_BACKOFF_MAX_S = 30.0
+IA_MAX_CONCORRENCIA = int(os.getenv("INSIGHTS_LLM_MAX_CONCORRENCIA", "8"))  # somando todas as sessões
+IA_JANELA_METRICAS = 200        # últimas chamadas usadas nos percentis
+IA_BASE_URL_LOCAL = "http://127.0.0.1:8001/v1"
+
+def _cliente_openai(api_key: Optional[str], base_url: Optional[str] = None):
     # Import dentro da função para evitar erro local se a lib não estiver instalada ainda.
-    from openai import OpenAI
+    from openai import DefaultHttpxClient, OpenAI, Timeout
+    # Limits da biblioteca HTTP que o próprio SDK usa (httpx ou httpx2, conforme a versão do openai)
+    biblioteca_http = importlib.import_module(DefaultHttpxClient.__mro__[1].__module__.split('.')[0])
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=Timeout(IA_TIMEOUT_S, connect=IA_TIMEOUT_CONEXAO_S),
+        max_retries=0,  # os retries ficam no LLMClientPool (com jitter e métricas)
+        http_client=DefaultHttpxClient(limits=biblioteca_http.Limits(
+            max_connections=IA_MAX_CONCORRENCIA,
+            max_keepalive_connections=IA_MAX_CONCORRENCIA,
+            keepalive_expiry=120,
+        )),
+    )
+
+# Provedores: nome -> fábrica(api_key) de um cliente com a interface `chat.completions.create`
+# do SDK da OpenAI. Escolhido por INSIGHTS_LLM_PROVIDER (INSIGHTS_FAKE_LLM=1 equivale a "simulado").
+PROVEDORES_IA = {}
+
+def registrar_provedor_ia(nome: str, fabrica, requer_chave: bool = True):
+    PROVEDORES_IA[nome] = {'fabrica': fabrica, 'requer_chave': requer_chave}
+
+registrar_provedor_ia("openai", lambda api_key: _cliente_openai(api_key))
+# Servidor local compatível com a API da OpenAI (ex.: servidor_llm_local.py, vLLM, Ollama)
+registrar_provedor_ia(
+    "compativel",
+    lambda api_key: _cliente_openai(api_key or "local", os.getenv("INSIGHTS_LLM_BASE_URL", IA_BASE_URL_LOCAL)),
+    requer_chave=False,
+)
+registrar_provedor_ia("simulado", lambda api_key: FakeStreamingClient(), requer_chave=False)
+
+def provedor_ia_ativo() -> str:
+    if _insights_fake_ativo():
+        return "simulado"
+    nome = os.getenv("INSIGHTS_LLM_PROVIDER", "openai").strip().lower()
+    if nome not in PROVEDORES_IA:
+        raise ValueError(f"INSIGHTS_LLM_PROVIDER desconhecido: {nome!r} (opções: {', '.join(PROVEDORES_IA)})")
+    return nome
+
+def ia_disponivel(api_key: Optional[str]) -> bool:
+    """Há como gerar relatórios: provedor válido e chave configurada (ou provedor que dispensa chave)."""
+    try:
+        provedor = provedor_ia_ativo()
+    except ValueError:
+        return False  # INSIGHTS_LLM_PROVIDER desconhecido: a página de Insights mostra o erro
+    return api_key is not None or not PROVEDORES_IA[provedor]['requer_chave']
+
+def _erro_transitorio(erro: Exception) -> bool:
+    """Rate limit, sobrecarga, 5xx, timeout ou falha de conexão: vale tentar de novo."""
+    status = getattr(erro, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(erro, (TimeoutError, ConnectionError)) or type(erro).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def _retry_after(erro: Exception) -> Optional[float]:
+    headers = getattr(getattr(erro, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class LLMClientPool:
+    """
+    Clientes da IA compartilhados pelo processo, um por provedor + chave, que reaproveitam
+    as conexões HTTP (keep-alive). Cada chamada:
+    - espera um slot do semáforo global (`max_concorrencia` chamadas simultâneas no processo);
+    - é repetida em erros transitórios com backoff exponencial e jitter ("full jitter"),
+      respeitando Retry-After quando a API informa;
+    - tem latência, tempo na fila, tempo até o primeiro trecho e tentativas registrados.
+    """
+
+    def __init__(self, max_concorrencia: int = IA_MAX_CONCORRENCIA, max_tentativas: int = IA_MAX_TENTATIVAS,
+                 backoff_base: float = IA_BACKOFF_BASE_S, backoff_max: float = IA_BACKOFF_MAX_S, dormir=time.sleep):
+        self.max_concorrencia = max(1, max_concorrencia)
+        self._semaforo = threading.BoundedSemaphore(self.max_concorrencia)
+        self._max_tentativas = max(1, max_tentativas)
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._dormir = dormir
+        self._lock = threading.Lock()
+        self._clientes = {}
+        self._chamadas = deque(maxlen=IA_JANELA_METRICAS)
+        self._totais = defaultdict(int)
+        self._em_andamento = 0
+
+    def cliente(self, api_key: Optional[str], provedor: Optional[str] = None):
+        provedor = provedor or provedor_ia_ativo()
+        chave = (provedor, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+        with self._lock:
+            if chave not in self._clientes:
+                self._clientes[chave] = PROVEDORES_IA[provedor]['fabrica'](api_key)
+            return self._clientes[chave]
+
+    def _espera(self, tentativa: int, erro: Exception) -> float:
+        retry_after = _retry_after(erro)
+        if retry_after is not None:
+            return min(retry_after, self._backoff_max)
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** tentativa))
+
+    def _com_retries(self, requisicao, registro: dict):
+        for tentativa in range(self._max_tentativas):
+            registro['tentativas'] = tentativa + 1
+            try:
+                return requisicao()
+            except Exception as erro:
+                if tentativa + 1 >= self._max_tentativas or not _erro_transitorio(erro):
+                    raise
+                with self._lock:
+                    self._totais['retries'] += 1
+                self._dormir(self._espera(tentativa, erro))
+
+    @contextmanager
+    def _chamada(self, tipo: str, model: str):
+        """Slot do semáforo + registro da chamada (inclusive quando termina em erro)."""
+        inicio = time.perf_counter()
+        with self._semaforo:
+            registro = {
+                'tipo': tipo, 'modelo': model, 'quando': time.time(), 'ok': False, 'tentativas': 0,
+                'fila_s': time.perf_counter() - inicio, 'primeiro_trecho_s': None,
+            }
+            with self._lock:
+                self._em_andamento += 1
+            inicio_chamada = time.perf_counter()
+            try:
+                yield registro
+                registro['ok'] = True
+            except GeneratorExit:
+                registro['ok'] = True  # leitura interrompida por quem consome o stream (ex.: rerun)
+                raise
+            finally:
+                registro['latencia_s'] = time.perf_counter() - inicio_chamada
+                with self._lock:
+                    self._em_andamento -= 1
+                    self._chamadas.append(registro)
+                    self._totais['chamadas'] += 1
+                    self._totais['erros'] += not registro['ok']
+
+    def completar(self, api_key: Optional[str], client=None, **kwargs):
+        """`chat.completions.create(**kwargs)` sem streaming."""
+        client = client if client is not None else self.cliente(api_key)
+        with self._chamada('completo', kwargs.get('model')) as registro:
+            return self._com_retries(lambda: client.chat.completions.create(**kwargs), registro)
+
+    def transmitir(self, api_key: Optional[str], client=None, **kwargs):
+        """
+        Gerador dos chunks de `chat.completions.create(stream=True, **kwargs)`. Só repete a
+        chamada antes do primeiro chunk (depois disso o texto já foi entregue).
+        """
+        client = client if client is not None else self.cliente(api_key)
+
+        def _abrir():
+            stream = client.chat.completions.create(stream=True, **kwargs)
+            try:
+                chunks = iter(stream)
+                return stream, chunks, next(chunks, None)
+            except Exception:
+                getattr(stream, "close", lambda: None)()
+                raise
+
+        with self._chamada('stream', kwargs.get('model')) as registro:
+            inicio = time.perf_counter()
+            stream, chunks, chunk = self._com_retries(_abrir, registro)
+            registro['primeiro_trecho_s'] = time.perf_counter() - inicio
+            try:
+                while chunk is not None:
+                    yield chunk
+                    chunk = next(chunks, None)
+            finally:
+                # Devolve a conexão ao pool mesmo se a leitura for interrompida
+                getattr(stream, "close", lambda: None)()
+
+    def stats(self) -> dict:
+        with self._lock:
+            chamadas = list(self._chamadas)
+            totais = dict(self._totais)
+            em_andamento = self._em_andamento
+            clientes = len(self._clientes)
+
+        def _percentil(valores, q):
+            return float(np.percentile(valores, q)) if valores else None
+
+        latencias = [c['latencia_s'] for c in chamadas if c['ok']]
+        primeiros = [c['primeiro_trecho_s'] for c in chamadas if c['primeiro_trecho_s'] is not None]
+        return {
+            'chamadas': totais.get('chamadas', 0),
+            'erros': totais.get('erros', 0),
+            'retries': totais.get('retries', 0),
+            'em_andamento': em_andamento,
+            'clientes': clientes,
+            'latencia_p50_s': _percentil(latencias, 50),
+            'latencia_p95_s': _percentil(latencias, 95),
+            'primeiro_trecho_p50_s': _percentil(primeiros, 50),
+            'fila_p95_s': _percentil([c['fila_s'] for c in chamadas], 95),
+            'ultimas': chamadas[-10:],
+        }
+
+@st.cache_resource
+def get_llm_pool() -> LLMClientPool:
+    """Pool de clientes da IA compartilhado entre sessões."""
+    return LLMClientPool()
+
+# ============================================================================
+# CACHES EM DISCO
+# ============================================================================
+
+class DiskCache:
+    """
+    Base dos caches em disco (por processo, compartilhados entre sessões e reinícios):
+    uma entrada por arquivo `<chave><sufixo>` no diretório.
+    - Entradas sem uso há mais de `ttl` segundos expiram (mtime é atualizado a cada acesso).
+    - Acima de `max_bytes`, as entradas menos usadas recentemente são removidas.
+    """
+
+    sufixo = ".bin"
+
+    def __init__(self, diretorio: str, ttl: int, max_bytes: int):
+        self.diretorio = diretorio
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, f"{chave}{self.sufixo}")
+
+    def _valido(self, caminho: str) -> bool:
+        """Confere existência e TTL e marca o uso; chamar com o lock."""
+        try:
+            if time.time() - os.path.getmtime(caminho) > self.ttl:
+                self._remover(caminho)
+                return False
+            os.utime(caminho)  # marca uso recente (ordem de remoção)
+            return True
+        except OSError:
+            return False
+
+    def _gravar(self, chave: str, conteudo: bytes) -> str:
+        """Grava de forma atômica (arquivo temporário + rename) e aplica os limites."""
+        caminho = self._caminho(chave)
+        temporario = f"{caminho}.{uuid.uuid4().hex}.tmp"
+        with self._lock:
+            with open(temporario, "wb") as f:
+                f.write(conteudo)
+            os.replace(temporario, caminho)
+            self._aplicar_limites()
+        return caminho
+
+    def remover(self, chave: str):
+        with self._lock:
+            self._remover(self._caminho(chave))
+
+    def _remover(self, caminho: str):
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+    def _entradas(self) -> list:
+        entradas = []
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith(self.sufixo):
+                continue
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                st_arq = os.stat(caminho)
+            except OSError:
+                continue
+            entradas.append((st_arq.st_mtime, st_arq.st_size, caminho))
+        return entradas
+
+    def _aplicar_limites(self):
+        agora = time.time()
+        entradas = []
+        for mtime, tamanho, caminho in self._entradas():
+            if agora - mtime > self.ttl:
+                self._remover(caminho)
+                self.evictions += 1
+            else:
+                entradas.append((mtime, tamanho, caminho))
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for mtime, tamanho, caminho in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            self._remover(caminho)
+            total -= tamanho
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entradas = self._entradas()
+            consultas = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entradas': len(entradas),
+                'bytes': sum(tamanho for _, tamanho, _ in entradas),
+                'hit_rate': self.hits / consultas if consultas else 0.0,
+            }
+
+# ============================================================================
+# CACHE DE RESPOSTAS DA IA
+# ============================================================================
+
+AI_CACHE_DIR = os.getenv("INSIGHTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), 'dashboard_insights_cache'))
+AI_CACHE_TTL = 7 * 24 * 3600  # segundos
+AI_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+class AIResponseCache(DiskCache):
+    """
+    Cache em disco das respostas da IA. Cada entrada é um JSON nomeado pelo hash de
+    (provedor, prompt, contexto, modelo, temperature). Uma resposta expira `ttl` segundos
+    depois de gerada, mesmo que continue sendo usada.
+    """
+
+    sufixo = ".json"
+
+    def __init__(self, diretorio: str = AI_CACHE_DIR, ttl: int = AI_CACHE_TTL, max_bytes: int = AI_CACHE_MAX_BYTES):
+        super().__init__(diretorio, ttl, max_bytes)
+
+    @staticmethod
+    def chave(prompt_template: str, data_context_md: str, model: str, temperature: float, provedor: str = "openai") -> str:
+        h = hashlib.sha256()
+        for parte in (provedor, prompt_template, data_context_md, model, f"{float(temperature):.3f}"):
+            h.update(parte.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, chave: str) -> Optional[dict]:
+        caminho = self._caminho(chave)
+        with self._lock:
+            try:
+                with open(caminho, "r", encoding="utf-8") as f:
+                    entrada = json.load(f)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            if time.time() - entrada.get('criado_em', 0) > self.ttl or not self._valido(caminho):
+                self._remover(caminho)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entrada
+
+    def put(self, chave: str, resposta: str, **metadados):
+        entrada = {'resposta': resposta, 'criado_em': time.time(), **metadados}
+        self._gravar(chave, json.dumps(entrada, ensure_ascii=False).encode("utf-8"))
+
+@st.cache_resource
+def get_ai_cache() -> AIResponseCache:
+    """Cache de respostas da IA compartilhado entre sessões."""
+    return AIResponseCache()
+
+def _provedor(client) -> str:
+    return provedor_ia_ativo() if client is None else type(client).__name__
+
+def generate_insights_cached(prompt_template: str, data_context_md: str, api_key: str, model: str, temperature: float,
+                             forcar: bool = False, client=None, cache: Optional[AIResponseCache] = None,
+                             limitador: Optional["RateLimiter"] = None, llm_pool: Optional[LLMClientPool] = None):
+    """
+    Gera o relatório reaproveitando uma resposta idêntica já obtida.
+    Retorna (relatorio_md, entrada_do_cache); `entrada_do_cache` é None quando a IA foi chamada.
+    `forcar=True` ignora o cache e substitui a entrada; `limitador` só é usado na chamada à IA.
+    """
+    cache = cache if cache is not None else get_ai_cache()
+    chave = cache.chave(prompt_template, data_context_md, model, temperature, _provedor(client))
+    if not forcar:
+        entrada = cache.get(chave)
+        if entrada is not None:
+            return entrada['resposta'], entrada
+
+    with (limitador.slot() if limitador is not None else nullcontext()):
+        report_md = _generate_insights_with_ai(
+            prompt_template=prompt_template,
+            data_context_md=data_context_md,
+            api_key=api_key,
+            model=model,
+            temperature=temperature,
+            client=client,
+            llm_pool=llm_pool,
+        )
+    if report_md:
+        cache.put(chave, report_md, model=model, temperature=float(temperature))
+    return report_md, None
 
-    client = OpenAI(api_key=api_key)
-    messages = [
-        {"role": "system", "content": prompt_template},
-        {"role": "user", "content": f"## DADOS PARA ANÁLISE\n\n{data_context_md}\n\nGere o relatório no formato especificado no prompt. Não invente dados."},
-    ]
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=temperature,
-        messages=messages,
-    )
-    return resp.choices[0].message.content or ""
+def stream_insights_cached(prompt_template: str, data_context_md: str, api_key: str, model: str, temperature: float,
+                           forcar: bool = False, client=None, cache: Optional[AIResponseCache] = None,
+                           llm_pool: Optional[LLMClientPool] = None):
+    """
+    Versão em streaming de generate_insights_cached.
+    Retorna (entrada_do_cache, trechos): com acerto no cache, `trechos` produz o relatório
+    inteiro de uma vez; senão, produz os trechos da IA e grava no cache ao terminar.
+    """
+    cache = cache if cache is not None else get_ai_cache()
+    chave = cache.chave(prompt_template, data_context_md, model, temperature, _provedor(client))
+    if not forcar:
+        entrada = cache.get(chave)
+        if entrada is not None:
+            return entrada, iter([entrada['resposta']])
+
+    def _trechos():
+        partes = []
+        for delta in _stream_insights_with_ai(prompt_template, data_context_md, api_key, model, temperature,
+                                              client=client, llm_pool=llm_pool):
+            partes.append(delta)
+            yield delta
+        report_md = "".join(partes)
+        if report_md:
+            cache.put(chave, report_md, model=model, temperature=float(temperature))
+
+    return None, _trechos()
+
+LOGO_PATH = "Logo Clinica Pace (1) (1).png"
+PDF_LOGO_LARGURA_PX = 600  # suficiente para 70 mm na capa
+
+# Expressões compiladas uma vez (usadas a cada linha do relatório)
+_RE_BLOCO_CODIGO = re.compile(r"```[\s\S]*?```")
+_RE_LINK = re.compile(r"\[([^\]]+)\]\([^\)]+\)")
+_RE_TITULO = re.compile(r"^#{1,6}\s*", re.MULTILINE)
+_RE_RESUMO_EXECUTIVO = re.compile(r"(?im)^##\s*RESUMO\s+EXECUTIVO\s*$([\s\S]*?)(^##\s+|\Z)")
+_RE_SEPARADOR = re.compile(r"(?im)^---\s*$")
+
+def _limpar_inline(text: str) -> str:
+    """Remove marcações de uma linha (links, negrito, código inline)."""
+    if "](" in text:
+        text = _RE_LINK.sub(r"\1", text)
+    return text.replace("**", "").replace("__", "").replace("`", "").strip()
 
 def _markdown_to_safe_text(md: str) -> str:
     # Remove blocos de código
-    text = re.sub(r"```[\\s\\S]*?```", "", md)
+    text = _RE_BLOCO_CODIGO.sub("", md)
     # Remove links mantendo o texto
-    text = re.sub(r"\\[([^\\]]+)\\]\\([^\\)]+\\)", r"\\1", text)
+    text = _RE_LINK.sub(r"\1", text)
     # Remove marcações comuns
-    text = re.sub(r"^#{1,6}\\s*", "", text, flags=re.MULTILINE)
+    text = _RE_TITULO.sub("", text)
     text = text.replace("**", "").replace("__", "")
     text = text.replace("`", "")
     # Remove emojis / chars fora do latin-1 (FPDF core fonts)
     text = text.encode("latin-1", "replace").decode("latin-1")
     return text.strip()
 
+@functools.lru_cache(maxsize=1)
+def _logo_pdf() -> Optional[bytes]:
+    """
+    Logo decodificado e reduzido uma única vez por processo (o PNG original tem 4167×4167).
+    lru_cache em vez de st.cache_resource: também é chamado nas threads da fila de exportação.
+    """
+    try:
+        from PIL import Image
+
+        with Image.open(LOGO_PATH) as img:
+            img.thumbnail((PDF_LOGO_LARGURA_PX, PDF_LOGO_LARGURA_PX))
+            buffer = BytesIO()
+            img.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue()
+    except Exception:
+        return None
+
 def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
     from fpdf import FPDF
+    from fpdf.enums import XPos, YPos
 
     def _hex_to_rgb(hex_color: str) -> tuple[int, int, int]:
         s = hex_color.lstrip("#")
@@ -532,26 +2341,27 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
 
     safe_title = _markdown_to_safe_text(title)
     safe_md = report_md.encode("latin-1", "replace").decode("latin-1")
+    gerado_em = datetime.now().strftime('%d/%m/%Y %H:%M')
+    logo = _logo_pdf()
+    # Dentro do documento, o FPDF embute a imagem uma única vez (mesmo objeto em todas as páginas)
+    logo_img = BytesIO(logo) if logo else None
 
     class PDF(FPDF):
         def header(self):  # noqa: N802
             # Logo pequeno + título no topo
-            try:
-                if os.path.exists("Logo Clinica Pace (1) (1).png"):
-                    self.image("Logo Clinica Pace (1) (1).png", x=10, y=8, w=18)
-            except Exception:
-                pass
+            if logo_img is not None:
+                self.image(logo_img, x=10, y=8, w=18)
 
             self.set_draw_color(*border_rgb)
             self.set_text_color(*primary_rgb)
             self.set_font("Helvetica", "B", 11)
             self.set_xy(32, 10)
-            self.cell(0, 6, safe_title, ln=1)
+            self.cell(0, 6, safe_title, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             self.ln(2)
             self.set_text_color(60, 60, 60)
             self.set_font("Helvetica", "", 9)
             self.set_x(32)
-            self.cell(0, 5, f"Gerado em {datetime.now().strftime('%d/%m/%Y %H:%M')}", ln=1)
+            self.cell(0, 5, f"Gerado em {gerado_em}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             self.ln(2)
             self.line(10, 26, 200, 26)
             self.ln(6)
@@ -570,29 +2380,35 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
             if level <= 1:
                 self.set_font("Helvetica", "B", 16)
                 self.ln(2)
-                self.cell(0, 10, text, ln=1)
+                self.cell(0, 10, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             elif level == 2:
                 self.set_font("Helvetica", "B", 13)
                 self.ln(2)
-                self.cell(0, 8, text, ln=1)
+                self.cell(0, 8, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             else:
                 self.set_font("Helvetica", "B", 11)
                 self.ln(1)
-                self.cell(0, 7, text, ln=1)
+                self.cell(0, 7, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             self.set_text_color(40, 40, 40)
 
+        def _texto(self, text: str, recuo: float = 0):
+            # Linhas que cabem na largura dispensam a quebra de linha do multi_cell (bem mais lenta)
+            largura = self.epw - recuo
+            self.set_x(self.l_margin + recuo)
+            if self.get_string_width(text) <= largura - 2 * self.c_margin:
+                self.cell(largura, 6, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            else:
+                self.multi_cell(largura, 6, text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
         def paragraph(self, text: str):
             self.set_font("Helvetica", "", 11)
             self.set_text_color(40, 40, 40)
-            self.multi_cell(0, 6, text)
+            self._texto(text)
 
         def bullet(self, text: str):
             self.set_font("Helvetica", "", 11)
             self.set_text_color(40, 40, 40)
-            x0 = self.get_x()
-            self.set_x(x0 + 4)
-            self.multi_cell(0, 6, f"- {text}")
-            self.set_x(x0)
+            self._texto(f"- {text}", recuo=4)
 
         def hr(self):
             self.ln(2)
@@ -612,10 +2428,10 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
             self.set_xy(x + 4, y + 3)
             self.set_text_color(*primary_rgb)
             self.set_font("Helvetica", "B", 11)
-            self.multi_cell(w - 8, 6, title_)
+            self.multi_cell(w - 8, 6, title_, new_x=XPos.LEFT, new_y=YPos.NEXT)
             self.set_text_color(40, 40, 40)
             self.set_font("Helvetica", "", 11)
-            self.multi_cell(w - 8, 6, body_)
+            self.multi_cell(w - 8, 6, body_, new_x=XPos.LEFT, new_y=YPos.NEXT)
             y2 = self.get_y()
             # redesenha a caixa com altura correta
             self.set_xy(x, y)
@@ -623,10 +2439,10 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
             self.set_xy(x + 4, y + 3)
             self.set_text_color(*primary_rgb)
             self.set_font("Helvetica", "B", 11)
-            self.multi_cell(w - 8, 6, title_)
+            self.multi_cell(w - 8, 6, title_, new_x=XPos.LEFT, new_y=YPos.NEXT)
             self.set_text_color(40, 40, 40)
             self.set_font("Helvetica", "", 11)
-            self.multi_cell(w - 8, 6, body_)
+            self.multi_cell(w - 8, 6, body_, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
             self.ln(2)
 
     pdf = PDF()
@@ -641,24 +2457,21 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
     pdf.rect(0, 0, 210, 297, style="F")
 
     # logo grande central (se existir)
-    try:
-        if os.path.exists("Logo Clinica Pace (1) (1).png"):
-            pdf.image("Logo Clinica Pace (1) (1).png", x=70, y=55, w=70)
-    except Exception:
-        pass
+    if logo_img is not None:
+        pdf.image(logo_img, x=70, y=55, w=70)
 
     pdf.set_text_color(*primary_rgb)
     pdf.set_font("Helvetica", "B", 20)
     pdf.set_y(135)
-    pdf.cell(0, 12, safe_title, align="C", ln=1)
+    pdf.cell(0, 12, safe_title, align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     pdf.set_text_color(60, 60, 60)
     pdf.set_font("Helvetica", "", 12)
     pdf.ln(2)
-    pdf.cell(0, 8, "Relatório executivo gerado por IA", align="C", ln=1)
+    pdf.cell(0, 8, "Relatório executivo gerado por IA", align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(1)
     pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 8, f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}", align="C", ln=1)
+    pdf.cell(0, 8, f"Data: {gerado_em}", align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     # -----------------------
     # Conteúdo
@@ -668,26 +2481,26 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
 
     # Extrair “Resumo executivo” (primeiro bloco de texto após o heading correspondente, se existir)
     resumo = ""
-    m = re.search(r"(?im)^##\\s*RESUMO\\s+EXECUTIVO\\s*$([\\s\\S]*?)(^##\\s+|\\Z)", body)
+    m = _RE_RESUMO_EXECUTIVO.search(body)
     if m:
         resumo = m.group(1).strip()
-        resumo = re.sub(r"(?im)^---\\s*$", "", resumo).strip()
+        resumo = _RE_SEPARADOR.sub("", resumo).strip()
 
     if resumo:
         pdf.callout("Resumo executivo", _markdown_to_safe_text(resumo)[:1200])
         pdf.hr()
 
-    # Render simples de Markdown (títulos, bullets, separadores, parágrafos)
+    # Render simples de Markdown (títulos, bullets, separadores, parágrafos).
+    # O corpo já está em latin-1; por linha só resta limpar as marcações inline.
     in_code = False
     for raw in body.splitlines():
-        line = raw.rstrip()
-        if line.strip().startswith("```"):
+        s = raw.strip()
+        if s.startswith("```"):
             in_code = not in_code
             continue
         if in_code:
             continue
 
-        s = line.strip()
         if not s:
             pdf.ln(2)
             continue
@@ -699,20 +2512,290 @@ def _report_md_to_pdf_bytes(title: str, report_md: str) -> bytes:
         # headings
         if s.startswith("#"):
             level = len(s) - len(s.lstrip("#"))
-            text = s.lstrip("#").strip()
-            pdf.section_title(_markdown_to_safe_text(text), level=level)
+            pdf.section_title(_limpar_inline(s.lstrip("#")), level=level)
             continue
 
         # bullets
         if s.startswith("- "):
-            pdf.bullet(_markdown_to_safe_text(s[2:].strip()))
+            pdf.bullet(_limpar_inline(s[2:]))
             continue
 
         # default paragraph
-        pdf.paragraph(_markdown_to_safe_text(s))
+        pdf.paragraph(_limpar_inline(s))
 
     return bytes(pdf.output(dest="S"))
 
+PDF_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'dashboard_pdfs')
+PDF_CACHE_TTL = 24 * 3600  # segundos sem uso
+PDF_CACHE_MAX_BYTES = 100 * 1024 * 1024
+PDF_LAYOUT_VERSAO = "2"  # mudar ao alterar o layout, para não servir PDFs antigos
+
+class PDFCache(DiskCache):
+    """PDFs prontos em disco, pelo hash de (layout, título, relatório)."""
+
+    sufixo = ".pdf"
+
+    def __init__(self, diretorio: str = PDF_CACHE_DIR, ttl: int = PDF_CACHE_TTL, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        super().__init__(diretorio, ttl, max_bytes)
+
+    @staticmethod
+    def chave(title: str, report_md: str) -> str:
+        h = hashlib.sha256()
+        for parte in (PDF_LAYOUT_VERSAO, title, report_md):
+            h.update(parte.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, chave: str) -> Optional[str]:
+        caminho = self._caminho(chave)
+        with self._lock:
+            if self._valido(caminho):
+                self.hits += 1
+                return caminho
+            self.misses += 1
+            return None
+
+    def put(self, chave: str, pdf_bytes: bytes) -> str:
+        return self._gravar(chave, pdf_bytes)
+
+@st.cache_resource
+def get_pdf_cache() -> PDFCache:
+    """PDFs de relatórios compartilhados entre sessões."""
+    return PDFCache()
+
+def render_pdf_cached(title: str, report_md: str, cache: Optional[PDFCache] = None) -> str:
+    """Caminho do PDF do relatório, montado só se esse relatório ainda não estiver no cache."""
+    cache = cache if cache is not None else get_pdf_cache()
+    chave = cache.chave(title, report_md)
+    caminho = cache.get(chave)
+    if caminho is None:
+        caminho = cache.put(chave, _report_md_to_pdf_bytes(title=title, report_md=report_md))
+    return caminho
+
+def _tarefa_pdf_insights(titulo: str, report_md: str, cache: PDFCache):
+    """Tarefa para a fila de exportações: monta (ou reaproveita) o PDF fora da thread do script."""
+    def tarefa(caminho: str, progresso):
+        progresso(0.1, "montando PDF")
+        shutil.copyfile(render_pdf_cached(titulo, report_md, cache), caminho)
+    return tarefa
+
+def transmitir_com_pdf(trechos, titulo: str, resultado: dict, jobs: Optional[ExportJobManager] = None,
+                      cache: Optional[PDFCache] = None):
+    """
+    Repassa os trechos do relatório (para st.write_stream) e, só depois do último, enfileira
+    o PDF na fila de exportações. Ao terminar, `resultado` tem 'report_md' e, se houver
+    texto, 'job_pdf' (id do job).
+    """
+    partes = []
+    for trecho in trechos:
+        partes.append(trecho)
+        yield trecho
+    resultado['report_md'] = "".join(partes)
+    if resultado['report_md']:
+        resultado['job_pdf'] = (jobs if jobs is not None else get_export_jobs()).submit(
+            "Baixar PDF",
+            f"relatorio_insights_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+            "application/pdf",
+            _tarefa_pdf_insights(titulo, resultado['report_md'], cache if cache is not None else get_pdf_cache()),
+        )
+
+# ============================================================================
+# RELATÓRIOS EM LOTE (POR UNIDADE / DIAGNÓSTICO)
+# ============================================================================
+
+LOTE_MAX_CONCORRENCIA = 4
+LOTE_MAX_POR_MINUTO = 30
+LOTE_PDF_WORKERS = 2
+
+DIMENSOES_LOTE = {
+    'unidade': ('unidades', 'Unidade'),
+    'diagnostico_vigente': ('diagnosticos', 'Diagnóstico'),
+}
+
+class RateLimiter:
+    """
+    Limita as chamadas à IA: no máximo `max_concorrencia` simultâneas e `max_por_minuto`
+    inícios por minuto (intervalo mínimo entre inícios). Uso: `with limitador.slot(): ...`
+    """
+
+    def __init__(self, max_por_minuto: int = LOTE_MAX_POR_MINUTO, max_concorrencia: int = LOTE_MAX_CONCORRENCIA):
+        self._intervalo = 60.0 / max_por_minuto if max_por_minuto else 0.0
+        self._proximo = 0.0
+        self._lock = threading.Lock()
+        self._semaforo = threading.BoundedSemaphore(max(1, max_concorrencia))
+
+    @contextmanager
+    def slot(self):
+        with self._semaforo:
+            with self._lock:
+                agora = time.monotonic()
+                espera = max(0.0, self._proximo - agora)
+                self._proximo = max(agora, self._proximo) + self._intervalo
+            if espera:
+                time.sleep(espera)
+            yield
+
+def _nome_arquivo_seguro(texto: str) -> str:
+    return re.sub(r"[^\w\-]+", "_", str(texto)).strip("_")[:80] or "sem_nome"
+
+def preparar_lote(df, filtros: dict, versao: str, indice_pacientes, dimensao: str,
+                  periodo_label: str, foco: str = "", orcamento_tokens: int = INSIGHTS_ORCAMENTO_TOKENS,
+                  model: str = MODELO_REFERENCIA) -> list:
+    """
+    Um item por valor da dimensão presente no recorte base: filtros da fatia e contexto
+    da IA, montados a partir dos recortes e agregados em cache. Rodar na thread do script.
+    """
+    chave_filtro, rotulo = DIMENSOES_LOTE[dimensao]
+    df_base, _, assinatura_base = get_filtered_slice(df, filtros, versao, indice_pacientes)
+    agregado = compute_aggregates(assinatura_base, df_base)[
+        'unidade' if dimensao == 'unidade' else 'diag'
+    ]
+    valores = sorted(v for v in agregado.loc[agregado['n_atendimentos'] > 0, dimensao] if v != 'SEM DIAGNÓSTICO')
+
+    itens = []
+    for valor in valores:
+        filtros_fatia = {**filtros, chave_filtro: [valor]}
+        df_fatia, kpis, assinatura = get_filtered_slice(df, filtros_fatia, versao, indice_pacientes)
+        label = f"{periodo_label} · {rotulo}: {valor}"
+        contexto = get_insights_context(
+            assinatura, label, foco, df_fatia, kpis, orcamento_tokens=orcamento_tokens, model=model,
+        )
+        itens.append({
+            'valor': valor,
+            'titulo': f"Relatório de Insights - {rotulo} {valor} - {periodo_label}",
+            'arquivo': _nome_arquivo_seguro(f"{rotulo}_{valor}"),
+            'contexto': contexto['texto'],
+            'tokens': contexto['tokens'],
+        })
+    return itens
+
+def gerar_lote_zip(itens: list, destino, prompt_template: str, api_key: Optional[str], model: str, temperature: float,
+                   client=None, forcar: bool = False, max_concorrencia: int = LOTE_MAX_CONCORRENCIA,
+                   max_por_minuto: int = LOTE_MAX_POR_MINUTO, pdf_workers: int = LOTE_PDF_WORKERS,
+                   usar_processos: bool = False, progresso=None, ai_cache: Optional[AIResponseCache] = None,
+                   pdf_cache: Optional[PDFCache] = None, llm_pool: Optional[LLMClientPool] = None) -> dict:
+    """
+    Gera os relatórios dos itens de preparar_lote e grava um zip em `destino` (caminho ou arquivo):
+    - completions concorrentes, limitadas por RateLimiter (respostas em cache não consomem o limite);
+    - PDFs montados em um pool de workers à medida que cada relatório fica pronto
+      (`usar_processos=True` usa processos, útil no CLI; no Streamlit ficam em threads);
+    - um .md e um .pdf por item, mais `erros.txt` se algum item falhar.
+    Retorna {'gerados', 'erros', 'do_cache'}.
+    """
+    ai_cache = ai_cache if ai_cache is not None else get_ai_cache()
+    pdf_cache = pdf_cache if pdf_cache is not None else get_pdf_cache()
+    llm_pool = llm_pool if llm_pool is not None else get_llm_pool()
+    limitador = RateLimiter(max_por_minuto, max_concorrencia)
+    total_etapas = max(1, 2 * len(itens))
+    concluidas = 0
+    do_cache = 0
+    erros = {}
+    progresso = progresso or (lambda fracao, mensagem='': None)
+
+    def _avancar(mensagem: str):
+        nonlocal concluidas
+        concluidas += 1
+        progresso(concluidas / total_etapas, mensagem)
+
+    def _completar(item):
+        return generate_insights_cached(
+            prompt_template, item['contexto'], api_key, model, temperature,
+            forcar=forcar, client=client, cache=ai_cache, limitador=limitador, llm_pool=llm_pool,
+        )
+
+    pool_pdf_cls = ProcessPoolExecutor if usar_processos else ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, max_concorrencia), thread_name_prefix='lote_ia') as pool_ia, \
+            pool_pdf_cls(max_workers=max(1, pdf_workers)) as pool_pdf, \
+            zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        futuros_ia = {pool_ia.submit(_completar, item): item for item in itens}
+        futuros_pdf = {}
+        for futuro in as_completed(futuros_ia):
+            item = futuros_ia[futuro]
+            try:
+                report_md, entrada = futuro.result()
+            except Exception as e:
+                erros[item['valor']] = f"IA: {e}"
+                _avancar(f"{item['valor']}: erro")
+                _avancar("")
+                continue
+            do_cache += entrada is not None
+            zf.writestr(f"{item['arquivo']}.md", report_md)
+            _avancar(f"{item['valor']}: relatório pronto")
+
+            # PDF: reaproveita do cache ou envia ao pool
+            chave_pdf = pdf_cache.chave(item['titulo'], report_md)
+            caminho = pdf_cache.get(chave_pdf)
+            if caminho is not None:
+                zf.write(caminho, f"{item['arquivo']}.pdf")
+                _avancar(f"{item['valor']}: PDF pronto")
+            else:
+                futuros_pdf[pool_pdf.submit(_report_md_to_pdf_bytes, item['titulo'], report_md)] = (item, chave_pdf)
+
+        for futuro in as_completed(futuros_pdf):
+            item, chave_pdf = futuros_pdf[futuro]
+            try:
+                pdf_bytes = futuro.result()
+            except Exception as e:
+                erros[item['valor']] = f"PDF: {e}"
+                _avancar(f"{item['valor']}: erro no PDF")
+                continue
+            pdf_cache.put(chave_pdf, pdf_bytes)
+            zf.writestr(f"{item['arquivo']}.pdf", pdf_bytes)
+            _avancar(f"{item['valor']}: PDF pronto")
+
+        if erros:
+            zf.writestr("erros.txt", "\n".join(f"{valor}: {erro}" for valor, erro in erros.items()))
+
+    return {'gerados': len(itens) - len(erros), 'erros': erros, 'do_cache': do_cache}
+
+def _tarefa_lote_insights(itens: list, **kwargs):
+    """Tarefa para a fila de exportações: relatórios do lote em um zip."""
+    def tarefa(caminho: str, progresso):
+        gerar_lote_zip(itens, caminho, progresso=progresso, **kwargs)
+    return tarefa
+
+# ============================================================================
+# TEMPOS DE EXECUÇÃO (PÁGINA E FRAGMENTOS)
+# ============================================================================
+
+HISTORICO_EXECUCOES = 30
+
+def _registrar_execucao(escopo: str, inicio: float):
+    st.session_state.setdefault('tempos_execucao', deque(maxlen=HISTORICO_EXECUCOES)).append({
+        'Hora': datetime.now().strftime('%H:%M:%S'),
+        'Escopo': escopo,
+        'ms': round((time.perf_counter() - inicio) * 1000, 1),
+    })
+
+def fragmento(nome: str, **opcoes):
+    """
+    `st.fragment` com registro de tempo. Um widget do fragmento reexecuta só a função
+    decorada, com os argumentos da última execução completa (recorte e agregados em cache);
+    essas execuções isoladas entram no histórico do painel de desempenho.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def _executar(*args, **kwargs):
+            # Dentro de uma execução completa ou de outro fragmento, o tempo já é contado lá
+            if st.session_state.get('_execucao_completa') or st.session_state.get('_fragmento_ativo'):
+                return funcao(*args, **kwargs)
+            inicio = time.perf_counter()
+            st.session_state['_fragmento_ativo'] = True
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                st.session_state['_fragmento_ativo'] = False
+                _registrar_execucao(f"fragmento: {nome}", inicio)
+        return st.fragment(_executar, **opcoes)
+    return decorador
+
+def navegacao_visoes(visoes: list, key: str) -> str:
+    """
+    Seletor de visão no lugar de st.tabs: st.tabs executa o conteúdo de todas as abas a cada
+    rerun; aqui só a visão ativa (retornada) é montada.
+    """
+    return st.radio("Visualização", options=visoes, horizontal=True, key=key, label_visibility="collapsed")
+
 # ============================================================================
 # INTERFACE PRINCIPAL
 # ============================================================================
@@ -721,12 +2804,11 @@ def main():
     st.title("📊 Dashboard - Atendimentos por Diagnóstico")
     st.markdown("---")
     
-    # Carregar dados
-    data = load_data()
-    if data is None:
+    # Dimensões de todo o histórico; as linhas são carregadas depois, só para o período escolhido
+    dimensoes = carregar_dimensoes()
+    if dimensoes is None:
         st.stop()
-    
-    df = data['atendimentos']
+    dims = dimensoes['atendimentos']
     
     # ========================================================================
     # SIDEBAR - FILTROS
@@ -734,8 +2816,8 @@ def main():
     st.sidebar.header("🔍 Filtros")
     
     # Datas
-    data_min = df['data_atendimento'].min().date()
-    data_max = df['data_atendimento'].max().date()
+    data_min = dims['data_min']
+    data_max = dims['data_max']
     
     filtros = {}
     filtros['data_min'] = st.sidebar.date_input(
@@ -754,7 +2836,7 @@ def main():
     st.sidebar.markdown("---")
     
     # Diagnósticos
-    diagnosticos_disponiveis = sorted(df['diagnostico_vigente'].unique())
+    diagnosticos_disponiveis = dims['opcoes']['diagnostico_vigente']
     tem_sem_diag = 'SEM DIAGNÓSTICO' in diagnosticos_disponiveis
     
     if tem_sem_diag:
@@ -771,7 +2853,7 @@ def main():
     st.sidebar.markdown("---")
     
     # Unidades
-    unidades_disponiveis = sorted(df['unidade'].dropna().unique())
+    unidades_disponiveis = dims['opcoes']['unidade']
     filtros['unidades'] = st.sidebar.multiselect(
         "Unidade",
         options=unidades_disponiveis,
@@ -779,7 +2861,7 @@ def main():
     )
     
     # Profissionais
-    profissionais_disponiveis = sorted(df['profissional_atendimento'].dropna().unique())
+    profissionais_disponiveis = dims['opcoes']['profissional_atendimento']
     
     # Checkbox para selecionar todos
     selecionar_todos_prof = st.sidebar.checkbox("Selecionar todos os profissionais", value=True)
@@ -798,8 +2880,9 @@ def main():
     st.sidebar.markdown("---")
     
     # Busca por paciente
-    filtros['paciente_busca'] = st.sidebar.text_input("Buscar Paciente (ID)")
+    filtros['paciente_busca'] = st.sidebar.text_input("Buscar Paciente (ID)", help=AJUDA_BUSCA_PACIENTE)
     filtros['paciente_exato'] = st.sidebar.checkbox("Busca exata", value=False)
+    filtros['paciente_prefixo'] = st.sidebar.checkbox("ID começa com o termo", value=False, disabled=filtros['paciente_exato'])
     
     st.sidebar.markdown("---")
     
@@ -810,7 +2893,9 @@ def main():
     # ========================================================================
     # APLICAR FILTROS
     # ========================================================================
-    df_filtrado = apply_filters(df, filtros)
+    recorte = consultar_recorte(filtros)
+    if recorte is None:
+        st.stop()
     
     # Debug: mostrar contagem antes e depois (remover depois)
     # st.write(f"Total antes dos filtros: {len(df)}")
@@ -819,15 +2904,36 @@ def main():
     # ========================================================================
     # KPIs
     # ========================================================================
+    render_kpis(recorte.kpis)
+    
+    st.markdown("---")
+    
+    # ========================================================================
+    # VISUALIZAÇÕES
+    # ========================================================================
+    # Só a visão selecionada é montada; trocar de visão ou mexer em um widget
+    # reexecuta só o fragmento, reaproveitando o recorte e os agregados desta execução.
+    st.header("📊 Visualizações")
+    
+    fragmento_visualizacoes(recorte)
+    
+    st.markdown("---")
+    
+    # ========================================================================
+    # EXPORTAÇÃO
+    # ========================================================================
+    fragmento_exportacao(recorte)
+
+def render_kpis(kpis: dict):
     st.header("📈 Indicadores (KPIs)")
     
     col1, col2, col3, col4 = st.columns(4)
     
-    total_atendimentos = len(df_filtrado)
-    pacientes_unicos = df_filtrado['paciente_id'].nunique()
-    diagnosticos_distintos = df_filtrado['diagnostico_vigente'].nunique()
-    sem_diag_count = len(df_filtrado[df_filtrado['diagnostico_vigente'] == 'SEM DIAGNÓSTICO'])
-    pct_sem_diag = (sem_diag_count / total_atendimentos * 100) if total_atendimentos > 0 else 0
+    total_atendimentos = kpis['total_atendimentos']
+    pacientes_unicos = kpis['pacientes_unicos']
+    diagnosticos_distintos = kpis['diagnosticos_distintos']
+    sem_diag_count = kpis['sem_diag_count']
+    pct_sem_diag = kpis['pct_sem_diag']
     
     # KPIs com containers estilizados
     with col1:
@@ -863,126 +2969,166 @@ def main():
             <p style="color: {COLORS['text_secondary']}; margin: 0.5rem 0 0 0; font-size: 0.8rem;">{sem_diag_count:,} atendimentos</p>
         </div>
         """, unsafe_allow_html=True)
-    
-    st.markdown("---")
-    
-    # ========================================================================
-    # VISUALIZAÇÕES
-    # ========================================================================
-    st.header("📊 Visualizações")
-    
-    # Tabs para organizar visualizações
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "Série Temporal", 
-        "Top Diagnósticos", 
-        "Diagnóstico × Unidade",
-        "Diagnóstico × Profissional",
-        "Tabela Detalhada"
-    ])
-    
-    with tab1:
+
+VISOES_DASHBOARD = [
+    "Série Temporal",
+    "Top Diagnósticos",
+    "Diagnóstico × Unidade",
+    "Diagnóstico × Profissional",
+    "Tabela Detalhada",
+]
+
+@fragmento("Visualizações")
+def fragmento_visualizacoes(recorte: RecorteDashboard):
+    visao = navegacao_visoes(VISOES_DASHBOARD, key='dashboard_visao')
+    if visao == "Série Temporal":
+        fragmento_serie_temporal(recorte.assinatura, recorte.agregados)
+    elif visao == "Top Diagnósticos":
+        fragmento_top_diagnosticos(recorte.agregados)
+    elif visao == "Diagnóstico × Unidade":
+        render_diag_unidade(recorte)
+    elif visao == "Diagnóstico × Profissional":
+        fragmento_diag_profissional(recorte)
+    elif visao == "Tabela Detalhada":
+        fragmento_tabela_detalhada(recorte)
+
+@fragmento("Série temporal")
+def fragmento_serie_temporal(assinatura: tuple, agregados: dict):
+    col_ts1, col_ts2 = st.columns([1, 2])
+    with col_ts1:
         segmentar = st.checkbox("Segmentar por diagnóstico (máx. 10)", value=False)
-        fig_ts = plot_serie_temporal(df_filtrado, segmentar_por_diag=segmentar)
-        st.plotly_chart(fig_ts, use_container_width=True)
-    
-    with tab2:
-        top_n = st.slider("Top N diagnósticos", min_value=5, max_value=30, value=10)
-        fig_top = plot_top_diagnosticos(df_filtrado, top_n=top_n)
-        st.plotly_chart(fig_top, use_container_width=True)
-    
-    with tab3:
-        st.markdown("**Nota:** Mostrando apenas top 10 diagnósticos e top 10 unidades para legibilidade.")
-        fig_heat = plot_heatmap_diag_unidade(df_filtrado)
-        st.plotly_chart(fig_heat, use_container_width=True)
-        
-        # Tabela pivot completa
-        if data['resumo_diag_unidade'] is not None:
-            st.subheader("Tabela Completa: Diagnóstico × Unidade")
-            df_resumo = data['resumo_diag_unidade'].copy()
-            df_resumo_filtrado = df_resumo[
-                df_resumo['diagnostico_vigente'].isin(df_filtrado['diagnostico_vigente'].unique()) &
-                df_resumo['unidade'].isin(df_filtrado['unidade'].unique())
-            ]
-            st.dataframe(df_resumo_filtrado, use_container_width=True, height=400)
-        else:
-            # Computar se não existir
-            resumos = compute_resumos(df_filtrado)
-            st.dataframe(resumos['diag_unidade'], use_container_width=True, height=400)
-    
-    with tab4:
-        top_n_prof = st.slider("Top N profissionais por diagnóstico", min_value=5, max_value=20, value=10)
-        
-        if data['resumo_diag_prof'] is not None:
-            df_resumo_prof = data['resumo_diag_prof'].copy()
-            df_resumo_prof_filtrado = df_resumo_prof[
-                df_resumo_prof['diagnostico_vigente'].isin(df_filtrado['diagnostico_vigente'].unique())
-            ]
-            
-            # Top N por diagnóstico
-            df_top_prof = df_resumo_prof_filtrado.groupby('diagnostico_vigente').apply(
-                lambda x: x.nlargest(top_n_prof, 'n_atendimentos')
-            ).reset_index(drop=True)
-            
-            st.dataframe(df_top_prof, use_container_width=True, height=500)
-        else:
-            resumos = compute_resumos(df_filtrado)
-            df_top_prof = resumos['diag_prof'].groupby('diagnostico_vigente').head(top_n_prof)
-            st.dataframe(df_top_prof, use_container_width=True, height=500)
-    
-    with tab5:
-        st.subheader("Atendimentos Filtrados")
-        st.markdown(f"**Total de registros:** {len(df_filtrado):,}")
-        
-        # Ordenar por data descendente
-        df_tabela = df_filtrado.sort_values('data_atendimento', ascending=False)
-        
-        st.dataframe(
-            df_tabela,
-            use_container_width=True,
-            height=500
+    with col_ts2:
+        granularidade = st.radio(
+            "Granularidade", options=list(GRANULARIDADES_SERIE), index=2,
+            format_func=GRANULARIDADES_SERIE.get, horizontal=True, key="ts_granularidade",
         )
+    serie = compute_serie_temporal(assinatura, granularidade, agregados['dia_diag'])
+    fig_ts = plot_serie_temporal(serie, granularidade, segmentar_por_diag=segmentar)
+    st.plotly_chart(fig_ts, use_container_width=True)
+    exibidos = len(fig_ts.data[0].x) if fig_ts.data else 0
+    if exibidos < len(serie):
+        st.caption(f"{len(serie):,} períodos; exibindo {exibidos:,} pontos selecionados por LTTB (picos e vales preservados).")
+
+@fragmento("Top diagnósticos")
+def fragmento_top_diagnosticos(agregados: dict):
+    top_n = st.slider("Top N diagnósticos", min_value=5, max_value=30, value=10)
+    fig_top = plot_top_diagnosticos(agregados['diag'], top_n=top_n)
+    st.plotly_chart(fig_top, use_container_width=True)
+
+def render_diag_unidade(recorte: RecorteDashboard):
+    assinatura, agregados = recorte.assinatura, recorte.agregados
+    st.markdown("**Nota:** Mostrando apenas top 10 diagnósticos e top 10 unidades para legibilidade.")
+    fig_heat = plot_heatmap_diag_unidade(agregados['diag_unidade'])
+    st.plotly_chart(fig_heat, use_container_width=True)
+    
+    # Tabela pivot completa
+    if recorte.resumos['resumo_diag_unidade'] is not None:
+        st.subheader("Tabela Completa: Diagnóstico × Unidade")
+        df_resumo_filtrado = compute_resumo_diag_unidade(assinatura, recorte.resumos['resumo_diag_unidade'], agregados)
+        st.dataframe(df_resumo_filtrado, use_container_width=True, height=400)
+    else:
+        # Computar se não existir
+        resumos = compute_resumos(assinatura, recorte.linhas())
+        st.dataframe(resumos['diag_unidade'], use_container_width=True, height=400)
+
+@fragmento("Diagnóstico × Profissional")
+def fragmento_diag_profissional(recorte: RecorteDashboard):
+    assinatura, agregados = recorte.assinatura, recorte.agregados
+    top_n_prof = st.slider("Top N profissionais por diagnóstico", min_value=5, max_value=20, value=10)
+    
+    if recorte.resumos['resumo_diag_prof'] is not None:
+        df_top_prof = compute_top_profissionais(assinatura, top_n_prof, recorte.resumos['resumo_diag_prof'], agregados)
+        st.dataframe(df_top_prof, use_container_width=True, height=500)
+    else:
+        resumos = compute_resumos(assinatura, recorte.linhas())
+        df_top_prof = resumos['diag_prof'].groupby('diagnostico_vigente', observed=True).head(top_n_prof)
+        st.dataframe(df_top_prof, use_container_width=True, height=500)
+
+@fragmento("Tabela detalhada")
+def fragmento_tabela_detalhada(recorte: RecorteDashboard):
+    st.subheader("Atendimentos Filtrados")
     
-    st.markdown("---")
-    
-    # ========================================================================
-    # EXPORTAÇÃO
-    # ========================================================================
+    # Paginada no servidor, ordenada por data (mais recente primeiro); as linhas são lidas aqui
+    data = recorte.dados()
+    df = data['atendimentos']
+    colunas_tabela = [c for c in df.columns if c not in COLUNAS_CHAVES_TEMPO]
+    render_tabela_paginada(
+        df, recorte.linhas(), data['ordem_data']['atendimentos'],
+        key='tabela_atendimentos', coluna_data='data_atendimento', colunas_padrao=colunas_tabela
+    )
+
+@fragmento("Exportação")
+def fragmento_exportacao(recorte: RecorteDashboard):
     st.header("💾 Exportação de Dados")
+    assinatura = recorte.assinatura
+
+    def linhas_exportacao() -> pd.DataFrame:
+        # As linhas só são lidas quando uma exportação é pedida
+        df_filtrado = recorte.linhas()
+        return df_filtrado[[c for c in df_filtrado.columns if c not in COLUNAS_CHAVES_TEMPO]]
     
     col_exp1, col_exp2 = st.columns(2)
+    carimbo = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     with col_exp1:
-        # CSV dos atendimentos filtrados
-        csv = df_filtrado.to_csv(index=False, encoding='utf-8-sig')
-        st.download_button(
-            label="📥 Download Atendimentos Filtrados (CSV)",
-            data=csv,
-            file_name=f"atendimentos_filtrados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
+        # Atendimentos filtrados (gerados só quando pedidos)
+        formato = st.radio("Formato", options=_formatos_disponiveis(), horizontal=True, key='export_atend_formato')
+        extensao, mime = FORMATOS_EXPORTACAO[formato]
+        render_botao_exportacao(
+            f"Atendimentos Filtrados ({formato})",
+            key='export_atend',
+            pedido=(assinatura, formato),
+            gerar=lambda: gerar_exportacao_tabela(assinatura, formato, linhas_exportacao()),
+            file_name=f"atendimentos_filtrados_{carimbo}.{extensao}",
+            mime=mime,
         )
     
     with col_exp2:
         # Resumo do recorte
-        resumos = compute_resumos(df_filtrado)
-        resumo_consolidado = {
-            'Por_Diagnostico': resumos['diag'],
-            'Por_Diagnostico_Unidade': resumos['diag_unidade'],
-            'Por_Diagnostico_Profissional': resumos['diag_prof']
-        }
+        def _gerar_resumo():
+            resumos = compute_resumos(assinatura, recorte.linhas())
+            resumo_consolidado = {
+                'Por_Diagnostico': resumos['diag'],
+                'Por_Diagnostico_Unidade': resumos['diag_unidade'],
+                'Por_Diagnostico_Profissional': resumos['diag_prof']
+            }
+            return gerar_exportacao_resumos(assinatura, resumo_consolidado)
         
-        # Criar Excel em memória
-        from io import BytesIO
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for sheet_name, df_sheet in resumo_consolidado.items():
-                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
-        
-        st.download_button(
-            label="📥 Download Resumo do Recorte (Excel)",
-            data=output.getvalue(),
-            file_name=f"resumo_recorte_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        render_botao_exportacao(
+            "Resumo do Recorte (Excel)",
+            key='export_resumo',
+            pedido=assinatura,
+            gerar=_gerar_resumo,
+            file_name=f"resumo_recorte_{carimbo}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+    
+    # Recorte completo em Excel: gerado em segundo plano, sem bloquear a sessão
+    st.subheader("Exportação completa (segundo plano)")
+    st.caption(
+        "Gera um Excel com todas as linhas do recorte e os resumos. Você pode continuar filtrando enquanto o arquivo é gerado. "
+        f"Acima de {EXCEL_MAX_LINHAS - 1:,} linhas (limite de uma aba do Excel), elas continuam em abas seguintes."
+    )
+    if st.button("🧵 Exportar recorte completo (Excel)", key='export_job_excel'):
+        df_exportacao = linhas_exportacao()
+        resumos = compute_resumos(assinatura, recorte.linhas())
+        abas = max(1, math.ceil(len(df_exportacao) / (EXCEL_MAX_LINHAS - 1)))
+        texto_abas = f", em {abas} abas" if abas > 1 else ""
+        job_id = get_export_jobs().submit(
+            descricao=f"Recorte completo ({len(df_exportacao):,} atendimentos{texto_abas})",
+            nome_arquivo=f"recorte_completo_{carimbo}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            tarefa=_tarefa_excel_recorte(
+                df_exportacao,
+                {
+                    'Por_Diagnostico': resumos['diag'],
+                    'Por_Diagnostico_Unidade': resumos['diag_unidade'],
+                    'Por_Diagnostico_Profissional': resumos['diag_prof'],
+                },
+            ),
         )
+        st.session_state.setdefault('export_jobs', []).append(job_id)
+    render_painel_exportacoes()
 
 # ============================================================================
 # PÁGINA QA
@@ -996,57 +3142,50 @@ def page_qa():
     if data is None:
         st.stop()
     
-    df = data['atendimentos']
-    
-    # Exibir QA do Excel se existir
-    if data['qa'] is not None:
-        st.subheader("Relatório de QA (do processamento original)")
-        st.dataframe(data['qa'], use_container_width=True)
-        st.markdown("---")
-    
-    # QA adicional da base atual
-    st.subheader("Análise de Qualidade da Base Atual")
-    
-    qa_items = []
-    
-    # 1. Atendimentos sem diagnóstico
-    sem_diag = len(df[df['diagnostico_vigente'] == 'SEM DIAGNÓSTICO'])
-    qa_items.append({
-        'Métrica': 'Atendimentos sem diagnóstico vigente',
-        'Quantidade': sem_diag,
-        'Percentual': f"{(sem_diag/len(df)*100):.2f}%"
-    })
-    
-    # 2. Duplicatas por chave
-    chave_dup = df.groupby(['paciente_id', 'data_atendimento', 'profissional_atendimento', 'unidade']).size()
-    duplicatas = chave_dup[chave_dup > 1]
-    qa_items.append({
-        'Métrica': 'Atendimentos duplicados (mesma chave)',
-        'Quantidade': len(duplicatas),
-        'Percentual': f"{(len(duplicatas)/len(df)*100):.2f}%"
-    })
-    
-    # 3. Datas
-    data_min = df['data_atendimento'].min()
-    data_max = df['data_atendimento'].max()
-    qa_items.append({
-        'Métrica': 'Período dos dados',
-        'Quantidade': f"{data_min.strftime('%Y-%m-%d')} a {data_max.strftime('%Y-%m-%d')}",
-        'Percentual': f"{(data_max - data_min).days} dias"
-    })
+    # Métricas consolidadas: já vêm prontas do processamento (ou calculadas uma vez na carga)
+    st.subheader("Relatório de QA")
+    st.dataframe(
+        data['qa'],
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'Percentual': st.column_config.NumberColumn('Percentual', format="%.2f%%"),
+            'Tabela': None,
+        },
+    )
     
-    # 4. Pacientes sem avaliação
-    pacientes_atend = set(df['paciente_id'].unique())
-    pacientes_com_diag = set(df[df['diagnostico_vigente'] != 'SEM DIAGNÓSTICO']['paciente_id'].unique())
-    pacientes_sem_avaliacao = pacientes_atend - pacientes_com_diag
-    qa_items.append({
-        'Métrica': 'Pacientes sem avaliação (apenas "SEM DIAGNÓSTICO")',
-        'Quantidade': len(pacientes_sem_avaliacao),
-        'Percentual': f"{(len(pacientes_sem_avaliacao)/len(pacientes_atend)*100):.2f}%"
-    })
+    st.markdown("---")
     
-    df_qa_atual = pd.DataFrame(qa_items)
-    st.dataframe(df_qa_atual, use_container_width=True)
+    # Detalhamento sob demanda: só materializa os registros da verificação escolhida
+    st.subheader("🔎 Registros por Verificação")
+    ocorrencias = data['qa_ocorrencias']
+    categorias = list(ocorrencias['Categoria'].unique())
+    if not categorias:
+        st.info("Nenhuma ocorrência registrada.")
+    else:
+        col_cat, col_btn = st.columns([4, 1])
+        with col_cat:
+            categoria = st.selectbox("Verificação", options=categorias, key="qa_categoria")
+        with col_btn:
+            st.write("")
+            if st.button("Carregar registros", key="qa_carregar"):
+                st.session_state['qa_detalhe'] = categoria
+        
+        categoria_detalhe = st.session_state.get('qa_detalhe')
+        if categoria_detalhe in categorias:
+            selecao = ocorrencias[ocorrencias['Categoria'] == categoria_detalhe]
+            if selecao['Tabela'].iloc[0] == 'avaliacoes' and data.get('avaliacoes') is not None:
+                df_base, coluna_id, coluna_data = data['avaliacoes'], 'avaliacao_id', 'data_avaliacao'
+                ordem = data['ordem_data']['avaliacoes']
+            else:
+                df_base, coluna_id, coluna_data = data['atendimentos'], 'atendimento_id', 'data_atendimento'
+                ordem = data['ordem_data']['atendimentos']
+            df_detalhe = df_base[df_base[coluna_id].isin(selecao['registro_id'])]
+            st.caption(f"Verificação: {categoria_detalhe}")
+            render_tabela_paginada(
+                df_base, df_detalhe, ordem, key='tabela_qa', coluna_data=coluna_data,
+                colunas_padrao=[c for c in df_base.columns if c not in COLUNAS_CHAVES_TEMPO]
+            )
     
     st.markdown("---")
     
@@ -1062,6 +3201,11 @@ def page_qa():
     
     **Tratamento de Empates:**
     - Se houver múltiplas avaliações no mesmo dia para o mesmo paciente, é mantida a última (maior `avaliacao_id`).
+    
+    **Unidade da Avaliação:**
+    - A unidade de uma avaliação é a do atendimento do mesmo paciente com data mais próxima (antes ou depois).
+    - Um atendimento no mesmo dia sempre prevalece; com mais de uma unidade no dia, vale a primeira em ordem alfabética.
+    - Pacientes sem nenhum atendimento ficam sem unidade.
     """)
 
 # ============================================================================
@@ -1076,54 +3220,10 @@ def page_avaliacoes():
     st.title("📋 Análise de Avaliações (Diagnósticos Realizados)")
     st.markdown("---")
     
-    data = load_data()
-    if data is None:
-        st.stop()
-    
-    # Carregar avaliações
-    if data.get('avaliacoes') is None:
-        st.error("❌ Dados de avaliações não encontrados. Verifique se a aba 'Base_Avaliacoes_Limpa' existe no arquivo Excel.")
+    dimensoes = carregar_dimensoes()
+    if dimensoes is None:
         st.stop()
-    
-    df_avaliacoes = data['avaliacoes'].copy()
-    df_atendimentos = data['atendimentos'].copy()
-    
-    # Extrair ano da avaliação
-    df_avaliacoes['ano'] = pd.to_datetime(df_avaliacoes['data_avaliacao']).dt.year
-    
-    # Para obter unidade, vamos cruzar com atendimentos do mesmo paciente na mesma data ou próxima
-    # Criar uma chave de paciente + data (apenas data, sem hora)
-    df_avaliacoes['data_avaliacao_date'] = pd.to_datetime(df_avaliacoes['data_avaliacao']).dt.date
-    df_atendimentos['data_atendimento_date'] = pd.to_datetime(df_atendimentos['data_atendimento']).dt.date
-    
-    # Fazer merge para obter unidade (pegar a unidade do atendimento mais próximo)
-    # Primeiro, tentar match exato por paciente e data
-    df_atend_agg = df_atendimentos.groupby(['paciente_id', 'data_atendimento_date', 'unidade']).size().reset_index(name='count')
-    df_atend_agg = df_atend_agg.sort_values(['paciente_id', 'data_atendimento_date']).drop_duplicates(['paciente_id', 'data_atendimento_date'], keep='first')
-    
-    df_avaliacoes_com_unidade = df_avaliacoes.merge(
-        df_atend_agg[['paciente_id', 'data_atendimento_date', 'unidade']],
-        left_on=['paciente_id', 'data_avaliacao_date'],
-        right_on=['paciente_id', 'data_atendimento_date'],
-        how='left'
-    )
-    
-    # Para avaliações sem unidade, pegar a unidade mais recente do paciente
-    pacientes_sem_unidade = df_avaliacoes_com_unidade[df_avaliacoes_com_unidade['unidade'].isna()]['paciente_id'].unique()
-    if len(pacientes_sem_unidade) > 0:
-        df_atend_paciente = df_atendimentos[df_atendimentos['paciente_id'].isin(pacientes_sem_unidade)]
-        df_atend_paciente = df_atend_paciente.sort_values('data_atendimento').groupby('paciente_id').last()[['unidade']].reset_index()
-        df_atend_paciente.columns = ['paciente_id', 'unidade_mais_recente']
-        
-        df_avaliacoes_com_unidade = df_avaliacoes_com_unidade.merge(
-            df_atend_paciente,
-            on='paciente_id',
-            how='left'
-        )
-        df_avaliacoes_com_unidade['unidade'] = df_avaliacoes_com_unidade['unidade'].fillna(df_avaliacoes_com_unidade['unidade_mais_recente'])
-        df_avaliacoes_com_unidade = df_avaliacoes_com_unidade.drop(columns=['unidade_mais_recente', 'data_atendimento_date'], errors='ignore')
-    
-    df_avaliacoes = df_avaliacoes_com_unidade.drop(columns=['data_atendimento_date'], errors='ignore')
+    dims = dimensoes['avaliacoes']
     
     # ========================================================================
     # FILTROS
@@ -1131,15 +3231,32 @@ def page_avaliacoes():
     st.sidebar.header("🔍 Filtros - Avaliações")
     
     # Filtro de ano
-    anos_disponiveis = sorted(df_avaliacoes['ano'].dropna().unique(), reverse=True)
+    anos_disponiveis = sorted(dims['opcoes']['ano'], reverse=True)
     anos_selecionados = st.sidebar.multiselect(
         "Ano",
         options=anos_disponiveis,
         default=anos_disponiveis[:3] if len(anos_disponiveis) > 3 else anos_disponiveis
     )
     
+    # Com o dataset particionado, só os meses dos anos escolhidos são lidos
+    if anos_selecionados:
+        data = load_data(date(int(min(anos_selecionados)), 1, 1), date(int(max(anos_selecionados)), 12, 31))
+    else:
+        data = load_data()
+    if data is None:
+        st.stop()
+    
+    # Carregar avaliações
+    if data.get('avaliacoes') is None:
+        st.error("❌ Dados de avaliações não encontrados. Verifique se a aba 'Base_Avaliacoes_Limpa' existe no arquivo Excel.")
+        st.stop()
+    
+    # A unidade da avaliação já vem atribuída pelo pipeline (ou na carga, para arquivos antigos);
+    # a página apenas filtra e agrega
+    df_avaliacoes = data['avaliacoes']
+    
     # Filtro de unidade
-    unidades_disponiveis = sorted(df_avaliacoes['unidade'].dropna().unique())
+    unidades_disponiveis = dims['opcoes']['unidade']
     unidades_selecionadas = st.sidebar.multiselect(
         "Unidade",
         options=unidades_disponiveis,
@@ -1147,7 +3264,7 @@ def page_avaliacoes():
     )
     
     # Filtro de diagnóstico
-    diagnosticos_disponiveis = sorted(df_avaliacoes['diagnostico'].dropna().unique())
+    diagnosticos_disponiveis = dims['opcoes']['diagnostico']
     diagnosticos_selecionados = st.sidebar.multiselect(
         "Diagnóstico",
         options=diagnosticos_disponiveis,
@@ -1155,7 +3272,7 @@ def page_avaliacoes():
     )
     
     # Filtro de profissional (para análises específicas)
-    profissionais_disponiveis = sorted(df_avaliacoes['profissional_avaliacao'].dropna().unique())
+    profissionais_disponiveis = dims['opcoes']['profissional_avaliacao']
     profissionais_selecionados = st.sidebar.multiselect(
         "Profissional de Avaliação",
         options=profissionais_disponiveis,
@@ -1163,7 +3280,15 @@ def page_avaliacoes():
     )
     
     # Aplicar filtros
-    df_filtrado = df_avaliacoes.copy()
+    assinatura_aval = (
+        data['versao'],
+        'avaliacoes',
+        _conjunto(anos_selecionados),
+        _conjunto(unidades_selecionadas),
+        _conjunto(diagnosticos_selecionados),
+        _conjunto(profissionais_selecionados),
+    )
+    df_filtrado = df_avaliacoes
     if anos_selecionados:
         df_filtrado = df_filtrado[df_filtrado['ano'].isin(anos_selecionados)]
     if unidades_selecionadas:
@@ -1223,20 +3348,42 @@ def page_avaliacoes():
     # VISUALIZAÇÕES
     # ========================================================================
     st.header("📊 Visualizações")
+    fragmento_visualizacoes_avaliacoes(data, assinatura_aval, df_filtrado)
     
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
-        "Por Diagnóstico",
-        "Por Unidade",
-        "Ano × Unidade",
-        "Diagnóstico × Unidade",
-        "Por Profissional",
-        "Tabela Detalhada"
-    ])
+    st.markdown("---")
+    
+    # Exportação (gerada só quando pedida, em cache pela assinatura dos filtros)
+    st.header("💾 Exportação")
+    formato = st.radio("Formato", options=_formatos_disponiveis(), horizontal=True, key='export_aval_formato')
+    extensao, mime = FORMATOS_EXPORTACAO[formato]
+    colunas_exportacao = [c for c in df_filtrado.columns if c not in COLUNAS_CHAVES_TEMPO or c == 'ano']
+    render_botao_exportacao(
+        f"Avaliações Filtradas ({formato})",
+        key='export_aval',
+        pedido=(assinatura_aval, formato),
+        gerar=lambda: gerar_exportacao_tabela(assinatura_aval, formato, df_filtrado[colunas_exportacao]),
+        file_name=f"avaliacoes_filtradas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}",
+        mime=mime,
+    )
+
+VISOES_AVALIACOES = [
+    "Por Diagnóstico",
+    "Por Unidade",
+    "Ano × Unidade",
+    "Diagnóstico × Unidade",
+    "Por Profissional",
+    "Tabela Detalhada",
+]
+
+@fragmento("Visualizações (avaliações)")
+def fragmento_visualizacoes_avaliacoes(data: dict, assinatura: tuple, df_filtrado):
+    # Só a visão selecionada é montada; as contagens ficam em cache pela assinatura dos filtros
+    visao = navegacao_visoes(VISOES_AVALIACOES, key='avaliacoes_visao')
     
-    with tab1:
+    if visao == "Por Diagnóstico":
         st.subheader("Avaliações por Diagnóstico")
         
-        df_diag = df_filtrado.groupby('diagnostico').size().reset_index(name='n_avaliacoes')
+        df_diag = contar_avaliacoes(assinatura, ('diagnostico',), df_filtrado)
         df_diag = df_diag.sort_values('n_avaliacoes', ascending=True)
         
         # Limitar a top N para melhor visualização
@@ -1267,10 +3414,10 @@ def page_avaliacoes():
         st.subheader("Tabela Completa: Avaliações por Diagnóstico")
         st.dataframe(df_diag.sort_values('n_avaliacoes', ascending=False), use_container_width=True, height=400)
     
-    with tab2:
+    elif visao == "Por Unidade":
         st.subheader("Avaliações por Unidade")
         
-        df_unidade = df_filtrado.groupby('unidade').size().reset_index(name='n_avaliacoes')
+        df_unidade = contar_avaliacoes(assinatura, ('unidade',), df_filtrado)
         df_unidade = df_unidade.sort_values('n_avaliacoes', ascending=True)
         
         fig = px.bar(
@@ -1296,10 +3443,10 @@ def page_avaliacoes():
         # Tabela
         st.dataframe(df_unidade, use_container_width=True, height=200)
     
-    with tab3:
+    elif visao == "Ano × Unidade":
         st.subheader("Avaliações por Ano × Unidade")
         
-        df_ano_unidade = df_filtrado.groupby(['ano', 'unidade']).size().reset_index(name='n_avaliacoes')
+        df_ano_unidade = contar_avaliacoes(assinatura, ('ano', 'unidade'), df_filtrado)
         
         # Heatmap
         pivot_table = df_ano_unidade.pivot(index='unidade', columns='ano', values='n_avaliacoes').fillna(0)
@@ -1329,7 +3476,7 @@ def page_avaliacoes():
         # Tabela
         st.dataframe(df_ano_unidade.sort_values(['ano', 'n_avaliacoes'], ascending=[True, False]), use_container_width=True, height=400)
     
-    with tab4:
+    elif visao == "Diagnóstico × Unidade":
         st.subheader("Avaliações por Diagnóstico × Unidade")
         st.markdown("**Nota:** Use os filtros na sidebar para filtrar por ano e profissional.")
         
@@ -1338,29 +3485,20 @@ def page_avaliacoes():
         with col_filt1:
             ano_filtro_diag_unid = st.selectbox(
                 "Filtrar por Ano (opcional)",
-                options=['Todos'] + [str(a) for a in sorted(df_filtrado['ano'].dropna().unique(), reverse=True)],
+                options=['Todos'] + [str(a) for a in sorted(contar_avaliacoes(assinatura, ('ano',), df_filtrado)['ano'], reverse=True)],
                 key='ano_filtro_diag_unid'
             )
         with col_filt2:
             prof_filtro_diag_unid = st.selectbox(
                 "Filtrar por Profissional (opcional)",
-                options=['Todos'] + sorted(df_filtrado['profissional_avaliacao'].dropna().unique()),
+                options=['Todos'] + sorted(contar_avaliacoes(assinatura, ('profissional_avaliacao',), df_filtrado)['profissional_avaliacao']),
                 key='prof_filtro_diag_unid'
             )
         
-        # Aplicar filtros específicos
-        df_diag_unid = df_filtrado.copy()
-        if ano_filtro_diag_unid != 'Todos':
-            df_diag_unid = df_diag_unid[df_diag_unid['ano'] == int(ano_filtro_diag_unid)]
-        if prof_filtro_diag_unid != 'Todos':
-            df_diag_unid = df_diag_unid[df_diag_unid['profissional_avaliacao'] == prof_filtro_diag_unid]
-        
-        # Agrupar por diagnóstico × unidade
-        df_diag_unidade = df_diag_unid.groupby(['diagnostico', 'unidade']).size().reset_index(name='n_avaliacoes')
-        
-        # Limitar a top diagnósticos e unidades para legibilidade
-        top_diag = df_diag_unid.groupby('diagnostico').size().nlargest(15).index
-        top_unidades = df_diag_unid.groupby('unidade').size().nlargest(10).index
+        # Filtros específicos aplicados e agrupados por diagnóstico × unidade (em cache)
+        df_diag_unidade, top_diag, top_unidades = compute_diag_unidade_avaliacoes(
+            assinatura, ano_filtro_diag_unid, prof_filtro_diag_unid, df_filtrado
+        )
         
         df_diag_unidade_filtrado = df_diag_unidade[
             df_diag_unidade['diagnostico'].isin(top_diag) &
@@ -1400,15 +3538,15 @@ def page_avaliacoes():
             height=400
         )
     
-    with tab5:
+    elif visao == "Por Profissional":
         st.subheader("Avaliações por Profissional (por Ano)")
         
         # Agrupar por profissional e ano
-        df_prof_ano = df_filtrado.groupby(['profissional_avaliacao', 'ano']).size().reset_index(name='n_avaliacoes')
+        df_prof_ano = contar_avaliacoes(assinatura, ('profissional_avaliacao', 'ano'), df_filtrado)
         
         # Limitar a top profissionais
         top_n_prof = st.slider("Top N profissionais", min_value=5, max_value=30, value=10, key='top_prof_avaliacoes')
-        top_profissionais = df_filtrado.groupby('profissional_avaliacao').size().nlargest(top_n_prof).index
+        top_profissionais = contar_avaliacoes(assinatura, ('profissional_avaliacao',), df_filtrado).nlargest(top_n_prof, 'n_avaliacoes')['profissional_avaliacao']
         df_prof_ano_top = df_prof_ano[df_prof_ano['profissional_avaliacao'].isin(top_profissionais)]
         
         # Gráfico de barras agrupadas
@@ -1466,48 +3604,31 @@ def page_avaliacoes():
             height=400
         )
     
-    with tab6:
+    elif visao == "Tabela Detalhada":
         st.subheader("Avaliações Detalhadas")
-        st.markdown(f"**Total de registros:** {len(df_filtrado):,}")
         
-        df_tabela = df_filtrado.sort_values('data_avaliacao', ascending=False)
         colunas_tabela = ['data_avaliacao', 'paciente_id', 'diagnostico', 'profissional_avaliacao', 'unidade', 'ano']
-        colunas_tabela = [c for c in colunas_tabela if c in df_tabela.columns]
-        
-        st.dataframe(
-            df_tabela[colunas_tabela],
-            use_container_width=True,
-            height=500
+        render_tabela_paginada(
+            data['avaliacoes'], df_filtrado, data['ordem_data']['avaliacoes'],
+            key='tabela_avaliacoes', coluna_data='data_avaliacao', colunas_padrao=colunas_tabela
         )
-    
-    st.markdown("---")
-    
-    # Exportação
-    st.header("💾 Exportação")
-    csv = df_filtrado.to_csv(index=False, encoding='utf-8-sig')
-    st.download_button(
-        label="📥 Download Avaliações Filtradas (CSV)",
-        data=csv,
-        file_name=f"avaliacoes_filtradas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-        mime="text/csv"
-    )
 
 def page_insights():
     st.title("🤖 Insights para Sócios e Gestores (IA)")
     st.markdown("---")
 
-    data = load_data()
-    if data is None:
+    dimensoes = carregar_dimensoes()
+    if dimensoes is None:
         st.stop()
-    df = data["atendimentos"]
+    dims = dimensoes["atendimentos"]
 
     # ------------------------------------------------------------------------
     # Filtros (reaproveitando a lógica existente)
     # ------------------------------------------------------------------------
     st.sidebar.header("🔍 Filtros (Insights)")
 
-    data_min = df["data_atendimento"].min().date()
-    data_max = df["data_atendimento"].max().date()
+    data_min = dims["data_min"]
+    data_max = dims["data_max"]
 
     filtros = {}
     filtros["data_min"] = st.sidebar.date_input(
@@ -1525,9 +3646,14 @@ def page_insights():
         key="ins_data_max",
     )
 
+    data = load_data(filtros["data_min"], filtros["data_max"])
+    if data is None:
+        st.stop()
+    df = data["atendimentos"]
+
     st.sidebar.markdown("---")
 
-    diagnosticos_disponiveis = sorted(df["diagnostico_vigente"].dropna().unique())
+    diagnosticos_disponiveis = dims["opcoes"]["diagnostico_vigente"]
     tem_sem_diag = "SEM DIAGNÓSTICO" in diagnosticos_disponiveis
     if tem_sem_diag:
         incluir_sem_diag = st.sidebar.checkbox("Incluir 'SEM DIAGNÓSTICO'", value=True, key="ins_incluir_sem_diag")
@@ -1543,7 +3669,7 @@ def page_insights():
 
     st.sidebar.markdown("---")
 
-    unidades_disponiveis = sorted(df["unidade"].dropna().unique())
+    unidades_disponiveis = dims["opcoes"]["unidade"]
     filtros["unidades"] = st.sidebar.multiselect(
         "Unidade",
         options=unidades_disponiveis,
@@ -1551,7 +3677,7 @@ def page_insights():
         key="ins_unid",
     )
 
-    profissionais_disponiveis = sorted(df["profissional_atendimento"].dropna().unique())
+    profissionais_disponiveis = dims["opcoes"]["profissional_atendimento"]
     filtros["profissionais"] = st.sidebar.multiselect(
         "Profissional do Atendimento",
         options=profissionais_disponiveis,
@@ -1560,19 +3686,22 @@ def page_insights():
     )
 
     st.sidebar.markdown("---")
-    filtros["paciente_busca"] = st.sidebar.text_input("Buscar Paciente (ID)", key="ins_paciente")
+    filtros["paciente_busca"] = st.sidebar.text_input("Buscar Paciente (ID)", key="ins_paciente", help=AJUDA_BUSCA_PACIENTE)
     filtros["paciente_exato"] = st.sidebar.checkbox("Busca exata", value=False, key="ins_paciente_exato")
+    filtros["paciente_prefixo"] = st.sidebar.checkbox(
+        "ID começa com o termo", value=False, key="ins_paciente_prefixo", disabled=filtros["paciente_exato"],
+    )
 
-    df_filtrado = apply_filters(df, filtros)
+    indice_pacientes = get_patient_index(data["versao"], df["paciente_id"])
+    df_filtrado, kpis, assinatura = get_filtered_slice(df, filtros, data["versao"], indice_pacientes)
 
     # ------------------------------------------------------------------------
     # Prévia do recorte
     # ------------------------------------------------------------------------
     col1, col2, col3, col4 = st.columns(4)
-    total_atendimentos = len(df_filtrado)
-    pacientes_unicos = df_filtrado["paciente_id"].nunique() if "paciente_id" in df_filtrado.columns else 0
-    diagnosticos_distintos = df_filtrado["diagnostico_vigente"].nunique() if "diagnostico_vigente" in df_filtrado.columns else 0
-    sem_diag_count = (df_filtrado["diagnostico_vigente"] == "SEM DIAGNÓSTICO").sum() if "diagnostico_vigente" in df_filtrado.columns else 0
+    total_atendimentos = kpis["total_atendimentos"]
+    pacientes_unicos = kpis["pacientes_unicos"]
+    diagnosticos_distintos = kpis["diagnosticos_distintos"]
     with col1:
         st.metric("Atendimentos", f"{total_atendimentos:,}")
     with col2:
@@ -1580,8 +3709,7 @@ def page_insights():
     with col3:
         st.metric("Diagnósticos", f"{int(diagnosticos_distintos):,}")
     with col4:
-        pct_sem_diag = (sem_diag_count / total_atendimentos * 100) if total_atendimentos > 0 else 0.0
-        st.metric("% sem diagnóstico", f"{pct_sem_diag:.1f}%")
+        st.metric("% sem diagnóstico", f"{kpis['pct_sem_diag']:.1f}%")
 
     st.markdown("---")
 
@@ -1601,50 +3729,106 @@ def page_insights():
 
     with st.expander("Configurações da IA", expanded=False):
         model = st.text_input("Modelo", value="gpt-4o-mini", key="ins_model")
+        orcamento_tokens = st.number_input(
+            "Orçamento de tokens do contexto de dados", min_value=200, max_value=20000,
+            value=INSIGHTS_ORCAMENTO_TOKENS, step=100, key="ins_orcamento",
+            help="Acima do orçamento, o contexto reduz o top N, agrupa a série por trimestre e junta a cauda em \"outros\".",
+        )
         temperature = st.slider("Criatividade (temperature)", min_value=0.0, max_value=1.0, value=0.2, step=0.1, key="ins_temp")
+        forcar = st.checkbox(
+            "Gerar novamente (ignorar relatório em cache)", value=False, key="ins_forcar",
+            help="Relatórios com o mesmo prompt, contexto, modelo e temperature são reaproveitados do cache.",
+        )
         st.caption("No Streamlit Cloud, configure a chave em `st.secrets[\"OPENAI_API_KEY\"]` (ou env `OPENAI_API_KEY`).")
 
-    prompt_template = _read_text_file("prompt_insights.md")
-    data_context = _build_insights_data_context(df_filtrado, periodo_label=periodo_label)
-    if foco.strip():
-        data_context = f"{data_context}\n\n### Foco solicitado pelos gestores\n{foco.strip()}\n"
+    prompt_template = compactar_prompt(_read_text_file("prompt_insights.md"))
+
+    def _contexto():
+        # Montado só quando necessário (gerar/pré-visualizar) e em cache por recorte + foco + orçamento
+        inicio = time.perf_counter()
+        contexto = get_insights_context(
+            assinatura, periodo_label, foco, df_filtrado, kpis, orcamento_tokens=int(orcamento_tokens), model=model,
+        )
+        return contexto, (time.perf_counter() - inicio) * 1000
 
     api_key = _get_openai_api_key()
-    gerar = st.button("Gerar relatório com IA", type="primary", disabled=(api_key is None))
-    if api_key is None:
+    try:
+        provedor, erro_provedor = provedor_ia_ativo(), None
+    except ValueError as e:
+        provedor, erro_provedor = None, e
+    col_gerar, col_previa = st.columns([1, 1])
+    with col_gerar:
+        gerar = st.button("Gerar relatório com IA", type="primary", disabled=not ia_disponivel(api_key))
+    with col_previa:
+        previa = st.button("🧩 Pré-visualizar contexto", key="ins_previa_contexto")
+    if erro_provedor is not None:
+        st.error(f"Geração com IA desativada: {erro_provedor}")
+    elif provedor == "simulado":
+        st.caption("Modo simulado (INSIGHTS_FAKE_LLM): o relatório é gerado localmente, sem chamar a IA.")
+    elif provedor != "openai":
+        st.caption(f"Provedor da IA: {provedor} (INSIGHTS_LLM_PROVIDER).")
+    elif api_key is None:
         st.warning("Para gerar com IA, configure `OPENAI_API_KEY` nas Secrets do Streamlit Cloud ou como variável de ambiente.")
 
+    if previa:
+        contexto, tempo_chamada = _contexto()
+        _render_metricas_contexto(contexto, tempo_chamada, estimar_custo(prompt_template, contexto, model))
+        with st.expander("Contexto que será enviado para a IA", expanded=True):
+            st.markdown(contexto['texto'])
+
+    transmitido = False
     if gerar:
-        with st.spinner("Gerando relatório com IA..."):
-            try:
-                report_md = _generate_insights_with_ai(
-                    prompt_template=prompt_template,
-                    data_context_md=data_context,
-                    api_key=api_key,
-                    model=model,
-                    temperature=float(temperature),
-                )
-                st.session_state["insights_report_md"] = report_md
-                st.session_state["insights_pdf_bytes"] = _report_md_to_pdf_bytes(
-                    title=f"Relatório de Insights - {periodo_label}",
-                    report_md=report_md,
+        contexto, tempo_chamada = _contexto()
+        _render_metricas_contexto(contexto, tempo_chamada, estimar_custo(prompt_template, contexto, model))
+        st.session_state["insights_contexto"] = contexto['texto']
+        st.session_state.pop("insights_report_md", None)
+        st.session_state.pop("insights_pdf_jobs", None)
+        try:
+            entrada_cache, trechos = stream_insights_cached(
+                prompt_template=prompt_template,
+                data_context_md=contexto['texto'],
+                api_key=api_key,
+                model=model,
+                temperature=float(temperature),
+                forcar=forcar,
+            )
+            if entrada_cache is not None:
+                gerado_em = datetime.fromtimestamp(entrada_cache['criado_em']).strftime('%d/%m/%Y %H:%M')
+                st.info(f"Relatório reaproveitado do cache (gerado em {gerado_em}). Marque \"Gerar novamente\" nas configurações da IA para refazer.")
+
+            # O relatório aparece na prévia à medida que os trechos chegam; o PDF é montado
+            # em segundo plano, só depois do fim do streaming
+            inicio = time.perf_counter()
+            primeiro_trecho, resultado = {}, {}
+
+            def _cronometrado():
+                for trecho in transmitir_com_pdf(trechos, f"Relatório de Insights - {periodo_label}", resultado):
+                    primeiro_trecho.setdefault('s', time.perf_counter() - inicio)
+                    yield trecho
+
+            st.subheader("Relatório (prévia)")
+            st.write_stream(_cronometrado())
+            transmitido = True
+            if 's' in primeiro_trecho:
+                st.caption(
+                    f"Primeiro trecho em {primeiro_trecho['s']:.1f} s · "
+                    f"relatório completo em {time.perf_counter() - inicio:.1f} s"
                 )
-            except Exception as e:
-                st.error(f"Erro ao gerar relatório: {e}")
+            if resultado.get('report_md'):
+                st.session_state["insights_report_md"] = resultado['report_md']
+                st.session_state["insights_pdf_jobs"] = [resultado['job_pdf']]
+        except Exception as e:
+            st.error(f"Erro ao gerar relatório: {e}")
 
     report_md = st.session_state.get("insights_report_md")
     if report_md:
-        st.subheader("Relatório (prévia)")
-        st.markdown(report_md)
+        if not transmitido:
+            st.subheader("Relatório (prévia)")
+            st.markdown(report_md)
 
         col_a, col_b, col_c = st.columns(3)
         with col_a:
-            st.download_button(
-                "📄 Baixar PDF",
-                data=st.session_state.get("insights_pdf_bytes", b""),
-                file_name=f"relatorio_insights_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                mime="application/pdf",
-            )
+            render_painel_exportacoes("insights_pdf_jobs")
         with col_b:
             st.download_button(
                 "📝 Baixar Markdown",
@@ -1655,11 +3839,214 @@ def page_insights():
         with col_c:
             st.download_button(
                 "🧩 Baixar contexto enviado para IA",
-                data=data_context,
+                data=st.session_state.get("insights_contexto", ""),
                 file_name=f"contexto_insights_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md",
                 mime="text/markdown",
             )
 
+    # ------------------------------------------------------------------------
+    # Relatórios em lote (um por unidade ou diagnóstico do recorte)
+    # ------------------------------------------------------------------------
+    st.markdown("---")
+    with st.expander("📦 Relatórios em lote (um PDF por unidade ou diagnóstico)", expanded=False):
+        st.caption(
+            "Usa os filtros e o período acima como base e gera um relatório para cada valor "
+            "presente no recorte. O zip é montado em segundo plano."
+        )
+        col_l1, col_l2, col_l3 = st.columns(3)
+        with col_l1:
+            dimensao_lote = st.radio(
+                "Um relatório por", options=list(DIMENSOES_LOTE),
+                format_func=lambda d: DIMENSOES_LOTE[d][1], key="ins_lote_dimensao",
+            )
+        with col_l2:
+            max_concorrencia = st.number_input(
+                "Chamadas simultâneas", min_value=1, max_value=16, value=LOTE_MAX_CONCORRENCIA, key="ins_lote_concorrencia",
+            )
+        with col_l3:
+            max_por_minuto = st.number_input(
+                "Chamadas por minuto", min_value=1, max_value=600, value=LOTE_MAX_POR_MINUTO, key="ins_lote_por_minuto",
+            )
+        if st.button("📦 Gerar lote (zip)", key="ins_lote_gerar", disabled=not ia_disponivel(api_key)):
+            with st.spinner("Preparando contextos do lote..."):
+                itens = preparar_lote(
+                    df, filtros, data["versao"], indice_pacientes, dimensao_lote, periodo_label, foco,
+                    orcamento_tokens=int(orcamento_tokens), model=model,
+                )
+            if not itens:
+                st.info("Nenhum valor no recorte para gerar relatórios.")
+            else:
+                job_id = get_export_jobs().submit(
+                    f"Relatórios por {DIMENSOES_LOTE[dimensao_lote][1].lower()} ({len(itens)} arquivos)",
+                    f"relatorios_insights_{dimensao_lote}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                    "application/zip",
+                    _tarefa_lote_insights(
+                        itens,
+                        prompt_template=prompt_template,
+                        api_key=api_key,
+                        model=model,
+                        temperature=float(temperature),
+                        forcar=forcar,
+                        max_concorrencia=int(max_concorrencia),
+                        max_por_minuto=int(max_por_minuto),
+                        ai_cache=get_ai_cache(),
+                        pdf_cache=get_pdf_cache(),
+                        llm_pool=get_llm_pool(),
+                    ),
+                )
+                st.session_state.setdefault("insights_lote_jobs", []).append(job_id)
+        render_painel_exportacoes("insights_lote_jobs")
+
+# ============================================================================
+# RELATÓRIO DE MEMÓRIA
+# ============================================================================
+
+def _bytes_tabelas(data: dict) -> pd.DataFrame:
+    """Memória (deep) de cada tabela carregada; antes/depois da compactação de tipos quando houve."""
+    memoria = data.get('memoria', {})
+    linhas = []
+    for nome, df in data.items():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        comparacao = memoria.get(nome)
+        bytes_atual = int(memoria_colunas(df).sum())
+        linhas.append({
+            'tabela': nome,
+            'linhas': len(df),
+            'MB': bytes_atual / 2**20,
+            'MB antes da compactação': (int(comparacao['bytes_antes'].sum()) if comparacao is not None else bytes_atual) / 2**20,
+        })
+    ordens = [o for o in (data.get('ordem_data') or {}).values() if o is not None]
+    if ordens:
+        bytes_ordens = sum(o.nbytes for o in ordens)
+        linhas.append({'tabela': 'ordem_data (índices)', 'linhas': sum(len(o) for o in ordens),
+                       'MB': bytes_ordens / 2**20, 'MB antes da compactação': bytes_ordens / 2**20})
+    return pd.DataFrame(linhas).sort_values('MB', ascending=False, ignore_index=True)
+
+def _resumo_memoria(data: dict) -> dict:
+    """
+    O que o relatório de memória precisa, calculado uma vez por carga (dentro do cache): bytes e
+    linhas por tabela e a comparação por coluna. A sessão guarda só isso, não as tabelas.
+    """
+    return {'tabelas': _bytes_tabelas(data), 'colunas': data.get('memoria', {})}
+
+def _bytes_caches() -> pd.DataFrame:
+    """
+    Memória de cada cache do processo: funções com st.cache_data (tamanho serializado das
+    entradas, pelo provedor de estatísticas do Streamlit) e o cache de recortes filtrados.
+    """
+    linhas = []
+    try:
+        from streamlit.runtime.caching import get_data_cache_stats_provider
+        for familia in get_data_cache_stats_provider().get_stats().values():
+            for stat in familia:
+                linhas.append({'cache': stat.cache_name.rsplit('.', 1)[-1], 'MB': stat.byte_length / 2**20})
+    except Exception:
+        pass  # API interna do Streamlit: sem ela, só os caches próprios
+    linhas.append({'cache': 'recortes filtrados (FilteredSliceCache)', 'MB': get_slice_cache().stats()['bytes'] / 2**20})
+    return pd.DataFrame(linhas).groupby('cache', as_index=False)['MB'].sum().sort_values('MB', ascending=False, ignore_index=True)
+
+def _pico_memoria_processo() -> Optional[int]:
+    """Pico de memória residente do processo, em bytes (indisponível no Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == 'darwin' else pico * 1024  # macOS em bytes, Linux em KB
+
+def render_relatorio_memoria():
+    """Memória por tabela, por coluna (tipos antes/depois da compactação) e por cache."""
+    resumo = st.session_state.get('_resumo_memoria')
+    if resumo is None:
+        st.caption("Nenhum dado carregado nesta sessão.")
+        return
+    tabelas = resumo['tabelas']
+    economia = tabelas['MB antes da compactação'].sum() - tabelas['MB'].sum()
+    st.caption(
+        f"Dados da página: {tabelas['MB'].sum():,.1f} MB ({economia:,.1f} MB economizados pela compactação de tipos"
+        f"{'' if OTIMIZAR_TIPOS else ', desligada por DASHBOARD_OTIMIZAR_TIPOS=0'})"
+    )
+    st.dataframe(tabelas, hide_index=True, use_container_width=True,
+                 column_config={c: st.column_config.NumberColumn(format="%.2f") for c in ('MB', 'MB antes da compactação')})
+
+    comparacoes = resumo['colunas']
+    if comparacoes:
+        tabela = st.selectbox("Colunas da tabela", options=list(comparacoes), key='memoria_tabela')
+        colunas = comparacoes[tabela].assign(
+            KB_antes=lambda d: d['bytes_antes'] / 1024, KB_depois=lambda d: d['bytes_depois'] / 1024,
+        ).drop(columns=['bytes_antes', 'bytes_depois']).sort_values('KB_antes', ascending=False)
+        st.dataframe(colunas, hide_index=True, use_container_width=True,
+                     column_config={c: st.column_config.NumberColumn(format="%.1f") for c in ('KB_antes', 'KB_depois')})
+
+    caches = _bytes_caches()
+    pico = _pico_memoria_processo()
+    st.caption(f"Caches do processo: {caches['MB'].sum():,.1f} MB"
+               + (f" · pico de memória do processo: {pico / 2**20:,.0f} MB" if pico else ""))
+    st.dataframe(caches, hide_index=True, use_container_width=True,
+                 column_config={'MB': st.column_config.NumberColumn(format="%.2f")})
+
+def _segundos(valor: Optional[float]) -> str:
+    return "–" if valor is None else f"{valor:.1f} s"
+
+def _milissegundos(valor: Optional[float]) -> str:
+    return "–" if valor is None else f"{valor * 1000:.0f} ms"
+
+def render_painel_desempenho():
+    """Indicadores dos caches do processo e tempos das últimas execuções da sessão (sidebar)."""
+    with st.sidebar.expander("⚙️ Desempenho", expanded=False):
+        execucoes = st.session_state.get('tempos_execucao')
+        if execucoes:
+            st.caption("Últimas execuções (mais recente primeiro): \"página\" reexecuta o script inteiro; "
+                       "\"fragmento\" só o trecho do widget alterado.")
+            st.dataframe(pd.DataFrame(list(execucoes)[::-1]), hide_index=True, use_container_width=True, height=210)
+        stats = get_slice_cache().stats()
+        st.caption(
+            f"Cache de recortes: {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}) · {stats['entradas']} entradas · "
+            f"{stats['bytes'] / 1024:,.0f} KB · {stats['evictions']} remoções"
+        )
+        stats_ia = get_ai_cache().stats()
+        st.caption(
+            f"Cache de relatórios da IA: {stats_ia['hits']} hits / {stats_ia['misses']} misses · "
+            f"{stats_ia['entradas']} entradas · {stats_ia['bytes'] / 1024:,.0f} KB · "
+            f"{stats_ia['evictions']} remoções"
+        )
+        stats_pdf = get_pdf_cache().stats()
+        st.caption(
+            f"Cache de PDFs: {stats_pdf['hits']} hits / {stats_pdf['misses']} misses · "
+            f"{stats_pdf['entradas']} arquivos · {stats_pdf['bytes'] / 1024:,.0f} KB · "
+            f"{stats_pdf['evictions']} remoções"
+        )
+        stats_llm = get_llm_pool().stats()
+        if stats_llm['chamadas']:
+            st.caption(
+                f"Chamadas à IA: {stats_llm['chamadas']} ({stats_llm['erros']} erros, "
+                f"{stats_llm['retries']} retries) · {stats_llm['em_andamento']} em andamento "
+                f"de {get_llm_pool().max_concorrencia} · latência p50 {_segundos(stats_llm['latencia_p50_s'])} / "
+                f"p95 {_segundos(stats_llm['latencia_p95_s'])} · primeiro trecho p50 "
+                f"{_segundos(stats_llm['primeiro_trecho_p50_s'])} · fila p95 {_segundos(stats_llm['fila_p95_s'])}"
+            )
+        if duckdb_disponivel():
+            if 'motor_consulta' not in st.session_state:
+                st.session_state['motor_consulta'] = (
+                    MOTOR_CONSULTA_PADRAO if MOTOR_CONSULTA_PADRAO in MOTORES_CONSULTA else 'pandas'
+                )
+            st.selectbox(
+                "Motor de consulta (Dashboard)", options=list(MOTORES_CONSULTA), key='motor_consulta',
+                help="'comparar' executa pandas e DuckDB e avisa se os KPIs ou agregados divergirem.",
+            )
+            stats_db = get_duckdb_engine().stats()
+            if stats_db['consultas']:
+                st.caption(
+                    f"DuckDB: {stats_db['consultas']} consultas · p50 {_milissegundos(stats_db['latencia_p50_s'])} / "
+                    f"p95 {_milissegundos(stats_db['latencia_p95_s'])} · {stats_db['divergencias']} divergências "
+                    f"em {stats_db['comparacoes']} comparações"
+                )
+        if st.toggle("Relatório de memória", key='relatorio_memoria',
+                     help="Bytes por tabela, por coluna (tipos antes/depois da compactação) e por cache."):
+            render_relatorio_memoria()
+
 def main_app():
     # Logo no topo da sidebar (aparece em todas as páginas)
     display_logo()
@@ -1670,14 +4057,23 @@ def main_app():
         ["Dashboard Principal", "Avaliações", "QA - Qualidade", "Insights"]
     )
     
-    if page == "Dashboard Principal":
-        main()
-    elif page == "Avaliações":
-        page_avaliacoes()
-    elif page == "QA - Qualidade":
-        page_qa()
-    elif page == "Insights":
-        page_insights()
+    # Execução completa do script; reexecuções de fragmentos não passam por aqui
+    inicio = time.perf_counter()
+    st.session_state['_execucao_completa'] = True
+    try:
+        if page == "Dashboard Principal":
+            main()
+        elif page == "Avaliações":
+            page_avaliacoes()
+        elif page == "QA - Qualidade":
+            page_qa()
+        elif page == "Insights":
+            page_insights()
+    finally:
+        st.session_state['_execucao_completa'] = False
+    _registrar_execucao(f"página: {page}", inicio)
+
+    render_painel_desempenho()
 
 if __name__ == "__main__":
     main_app()
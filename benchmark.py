@@ -0,0 +1,192 @@
+"""
+Benchmarks das rotinas mais pesadas do dashboard (executar fora do Streamlit).
+
+Uso:
+    python benchmark.py pdf [--secoes 200] [--repeticoes 5]
+    python benchmark.py consultas [--repeticoes 5]
+    python benchmark.py pipeline [--arquivo avaliacoes-atendimentos.xlsx] [--repeticoes 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+import app
+import etapas_pipeline
+
+
+def _cronometrar(funcao, repeticoes: int) -> float:
+    """Mediana, em ms, de `repeticoes` execuções."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+
+def _relatorio_longo(secoes: int) -> str:
+    """Relatório sintético no formato do prompt de insights (títulos, bullets, links, ênfases)."""
+    partes = [
+        "# Relatório de Insights",
+        "",
+        "## RESUMO EXECUTIVO",
+        "Atendimentos **cresceram** no período, com concentração em poucas unidades. 📈",
+        "",
+        "---",
+    ]
+    for i in range(secoes):
+        partes += [
+            f"## {i + 1}. Análise da seção {i + 1}",
+            "",
+            f"Parágrafo com **negrito**, `código` e [link](https://exemplo.com/{i}) que ocupa "
+            "mais de uma linha no PDF para exercitar a quebra de linha do renderizador de texto.",
+            *[f"- Item {j}: diagnóstico __relevante__ com variação de {j * 3}% no mês" for j in range(8)],
+            "",
+            "---",
+        ]
+    return "\n".join(partes)
+
+
+def benchmark_pdf(secoes: int, repeticoes: int):
+    report_md = _relatorio_longo(secoes)
+    titulo = "Relatório de Insights - benchmark"
+    print(f"Relatório: {secoes} seções, {len(report_md.encode('utf-8')) / 1024:,.0f} KB de markdown")
+
+    def _sem_ativos_em_memoria():
+        app._logo_pdf.cache_clear()  # simula decodificar o logo a cada relatório
+        app._report_md_to_pdf_bytes(titulo, report_md)
+
+    def _com_ativos_em_memoria():
+        app._report_md_to_pdf_bytes(titulo, report_md)
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        cache = app.PDFCache(diretorio=diretorio)
+        app.render_pdf_cached(titulo, report_md, cache)
+
+        resultados = [
+            ("logo decodificado a cada PDF", _cronometrar(_sem_ativos_em_memoria, repeticoes)),
+            ("logo decodificado uma vez", _cronometrar(_com_ativos_em_memoria, repeticoes)),
+            ("PDF já em cache (disco)", _cronometrar(lambda: app.render_pdf_cached(titulo, report_md, cache), repeticoes)),
+        ]
+        tamanho = os.path.getsize(app.render_pdf_cached(titulo, report_md, cache))
+
+    print(f"PDF: {tamanho / 1024:,.0f} KB")
+    for nome, ms in resultados:
+        print(f"  {nome:<32} {ms:>9.1f} ms (mediana de {repeticoes})")
+
+
+def _casos_consulta(dims: dict, df) -> dict:
+    """Recortes típicos da sidebar: tudo, último mês, uma unidade, busca por paciente (trecho, prefixo, exata)."""
+    base = {
+        "data_min": dims["data_min"],
+        "data_max": dims["data_max"],
+        "diagnosticos": dims["opcoes"]["diagnostico_vigente"],
+        "unidades": dims["opcoes"]["unidade"],
+        "profissionais": dims["opcoes"]["profissional_atendimento"],
+        "paciente_busca": "",
+        "paciente_exato": False,
+    }
+    return {
+        "todo o período": base,
+        "últimos 30 dias": {**base, "data_min": dims["data_max"] - timedelta(days=29)},
+        "uma unidade": {**base, "unidades": dims["opcoes"]["unidade"][:1]},
+        "3 diagnósticos": {**base, "diagnosticos": dims["opcoes"]["diagnostico_vigente"][:3]},
+        "busca 'ana'": {**base, "paciente_busca": "ana"},
+        "prefixo do ID": {**base, "paciente_busca": str(df["paciente_id"].iloc[0])[:2], "paciente_prefixo": True},
+        "paciente exato": {**base, "paciente_busca": str(df["paciente_id"].iloc[0]), "paciente_exato": True},
+    }
+
+
+def benchmark_consultas(repeticoes: int) -> bool:
+    """Retorna False se algum recorte divergir entre pandas e DuckDB."""
+    if not app.duckdb_disponivel():
+        print("DuckDB indisponível: instale `duckdb` e gere o dataset particionado (python processar_dados.py).")
+        return True
+    data = app.load_data()
+    df = data["atendimentos"]
+    indice = app.PatientSearchIndex(df["paciente_id"])
+    motor = app.DuckDBQueryEngine()
+    print(f"Atendimentos: {len(df):,} linhas · {repeticoes} repetições (mediana)")
+    print(f"  {'recorte':<18} {'linhas':>7} {'pandas':>10} {'duckdb':>10}  resultado")
+    identicos = True
+
+    for nome, filtros in _casos_consulta(data["dimensoes"]["atendimentos"], df).items():
+        def _pandas():
+            df_filtrado = app.apply_filters(df, filtros, indice)
+            # sem o cache do Streamlit: mede o groupby de cada execução
+            return app._compute_kpis(df_filtrado), app.compute_aggregates.__wrapped__(None, df_filtrado)
+
+        kpis, agregados = _pandas()
+        kpis_duckdb, agregados_duckdb = motor.kpis_e_agregados(filtros)
+        diferencas = app.comparar_motores(kpis, agregados, kpis_duckdb, agregados_duckdb)
+        ms_pandas = _cronometrar(_pandas, repeticoes)
+        ms_duckdb = _cronometrar(lambda: motor.kpis_e_agregados(filtros), repeticoes)
+        identicos = identicos and not diferencas
+        print(f"  {nome:<18} {kpis['total_atendimentos']:>7,} {ms_pandas:>7.1f} ms {ms_duckdb:>7.1f} ms  "
+              f"{'idênticos' if not diferencas else 'DIVERGEM: ' + '; '.join(diferencas[:2])}")
+    return identicos
+
+
+def benchmark_pipeline(arquivo: str, repeticoes: int) -> bool:
+    """
+    Etapas 2 a 6 do processar_dados.py em cada motor disponível: saídas idênticas e tempo.
+    Retorna False se os motores divergirem (os casos de borda ficam em test_etapas_pipeline.py).
+    """
+    excel = pd.ExcelFile(arquivo)
+    df_avaliacoes_raw = pd.read_excel(excel, sheet_name="Avaliação")
+    df_atendimentos_raw = pd.read_excel(excel, sheet_name="Atendimentos")
+    motores = [m for m in etapas_pipeline.MOTORES_PIPELINE if etapas_pipeline.motor_disponivel(m)]
+    print(f"Entrada: {len(df_avaliacoes_raw):,} avaliações, {len(df_atendimentos_raw):,} atendimentos · "
+          f"motores: {', '.join(motores)}")
+
+    comparacao = etapas_pipeline.comparar_motores_pipeline(df_avaliacoes_raw, df_atendimentos_raw, motores)
+    if len(motores) > 1:
+        if comparacao["diferencas"]:
+            for tabela, diferenca in comparacao["diferencas"].items():
+                print(f"  DIVERGEM em {tabela}: {diferenca}")
+        else:
+            print(f"  Tabelas idênticas entre os motores: {', '.join(etapas_pipeline.TABELAS_ETAPAS)}")
+
+    for motor in motores:
+        ms = _cronometrar(
+            lambda: etapas_pipeline.executar_etapas(df_avaliacoes_raw, df_atendimentos_raw, motor), repeticoes
+        )
+        print(f"  {motor:<8} {ms:>9.1f} ms (mediana de {repeticoes})")
+    return not comparacao["diferencas"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_pdf = sub.add_parser("pdf", help="Renderização do PDF de insights para relatórios longos")
+    p_pdf.add_argument("--secoes", type=int, default=200)
+    p_pdf.add_argument("--repeticoes", type=int, default=5)
+
+    p_consultas = sub.add_parser("consultas", help="KPIs e agregados do Dashboard: pandas × DuckDB (tempo e igualdade)")
+    p_consultas.add_argument("--repeticoes", type=int, default=5)
+
+    p_pipeline = sub.add_parser("pipeline", help="Etapas do processar_dados.py: pandas × Polars (tempo e igualdade)")
+    p_pipeline.add_argument("--arquivo", default="avaliacoes-atendimentos.xlsx")
+    p_pipeline.add_argument("--repeticoes", type=int, default=3)
+
+    args = parser.parse_args()
+    identicos = True
+    if args.comando == "pdf":
+        benchmark_pdf(args.secoes, args.repeticoes)
+    elif args.comando == "consultas":
+        identicos = benchmark_consultas(args.repeticoes)
+    elif args.comando == "pipeline":
+        identicos = benchmark_pipeline(args.arquivo, args.repeticoes)
+    if not identicos:
+        sys.exit(1)  # divergência entre motores: falha para scripts e CI
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+"""
+Transformações compartilhadas entre o pipeline (processar_dados.py) e o dashboard (app.py).
+"""
+import json
+import os
+import shutil
+from datetime import date, datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# ============================================================================
+# CHAVES DE TEMPO
+# ============================================================================
+
+COLUNAS_CHAVES_TEMPO = ['dia_key', 'semana_key', 'mes_key', 'ano']
+
+def _inteiro_compacto(serie: pd.Series) -> pd.Series:
+    """int32 quando não há nulos; Int32 (nullable) caso contrário."""
+    if serie.isna().any():
+        return serie.astype('Int32')
+    return serie.astype('int32')
+
+def adicionar_chaves_tempo(df: pd.DataFrame, coluna_data: str) -> pd.DataFrame:
+    """
+    Materializa chaves inteiras de tempo a partir de uma coluna de data:
+    - dia_key: AAAAMMDD
+    - semana_key: AAAASS (ano e semana ISO)
+    - mes_key: AAAAMM
+    - ano: AAAA
+    Agrupar e filtrar por essas chaves evita recriar períodos em string a cada uso.
+    """
+    datas = pd.to_datetime(df[coluna_data], errors='coerce')
+    ano = datas.dt.year
+    mes = datas.dt.month
+    iso = datas.dt.isocalendar()
+
+    df['dia_key'] = _inteiro_compacto(ano * 10000 + mes * 100 + datas.dt.day)
+    df['semana_key'] = _inteiro_compacto(iso['year'].astype('Int64') * 100 + iso['week'].astype('Int64'))
+    df['mes_key'] = _inteiro_compacto(ano * 100 + mes)
+    df['ano'] = _inteiro_compacto(ano)
+    return df
+
+def dia_key(data) -> int:
+    """Chave AAAAMMDD de uma data (date, datetime ou Timestamp)."""
+    return data.year * 10000 + data.month * 100 + data.day
+
+def rotulo_mes(mes_key: pd.Series) -> pd.Series:
+    """Converte chaves AAAAMM no rótulo 'AAAA-MM'."""
+    mes_key = mes_key.astype('int64')
+    return (mes_key // 100).astype(str) + '-' + (mes_key % 100).astype(str).str.zfill(2)
+
+# ============================================================================
+# UNIDADE DAS AVALIAÇÕES
+# ============================================================================
+
+def atribuir_unidade_avaliacoes(df_avaliacoes: pd.DataFrame, df_atendimentos: pd.DataFrame) -> pd.DataFrame:
+    """
+    Atribui a cada avaliação a unidade do atendimento do mesmo paciente com data mais
+    próxima (join as-of 'nearest' por paciente). Um atendimento no mesmo dia é sempre
+    o mais próximo; com mais de uma unidade no mesmo dia, vale a primeira em ordem alfabética.
+
+    Adiciona as colunas:
+    - unidade
+    - unidade_atribuicao: 'mesmo dia', 'atendimento mais próximo' ou 'sem atendimento'
+    """
+    atend_dia = pd.DataFrame({
+        'paciente_id': df_atendimentos['paciente_id'].astype(str),
+        'data_ref': pd.to_datetime(df_atendimentos['data_atendimento'], errors='coerce').dt.normalize().astype('datetime64[ns]'),
+        'unidade': df_atendimentos['unidade'],
+    }).dropna(subset=['data_ref', 'unidade'])
+    atend_dia = (
+        atend_dia.sort_values(['paciente_id', 'data_ref', 'unidade'])
+        .drop_duplicates(['paciente_id', 'data_ref'], keep='first')
+        .rename(columns={'data_ref': 'data_atendimento_ref'})
+        .sort_values('data_atendimento_ref', kind='stable')
+    )
+
+    aval = pd.DataFrame({
+        'paciente_id': df_avaliacoes['paciente_id'].astype(str).to_numpy(),
+        'data_ref': pd.to_datetime(df_avaliacoes['data_avaliacao'], errors='coerce').dt.normalize().astype('datetime64[ns]').to_numpy(),
+        '_pos': np.arange(len(df_avaliacoes)),
+    })
+    com_data = aval.dropna(subset=['data_ref']).sort_values('data_ref', kind='stable')
+
+    atribuido = pd.merge_asof(
+        com_data,
+        atend_dia,
+        left_on='data_ref',
+        right_on='data_atendimento_ref',
+        by='paciente_id',
+        direction='nearest',
+    ).set_index('_pos').reindex(range(len(df_avaliacoes)))
+
+    unidade = atribuido['unidade'].to_numpy()
+    mesmo_dia = (atribuido['data_ref'] == atribuido['data_atendimento_ref']).to_numpy()
+    df_avaliacoes['unidade'] = unidade
+    df_avaliacoes['unidade_atribuicao'] = np.where(
+        pd.isna(unidade), 'sem atendimento',
+        np.where(mesmo_dia, 'mesmo dia', 'atendimento mais próximo')
+    )
+    return df_avaliacoes
+
+# ============================================================================
+# MÉTRICAS DE QA
+# ============================================================================
+
+COLUNAS_QA_METRICAS = ['Categoria', 'Quantidade', 'Base', 'Percentual', 'Detalhes', 'Tabela']
+COLUNAS_QA_OCORRENCIAS = ['Categoria', 'Tabela', 'registro_id']
+
+def calcular_metricas_qa(df_atendimentos: pd.DataFrame, df_avaliacoes: pd.DataFrame = None,
+                         avaliacoes_mesmo_dia: int = None, faltantes: dict = None):
+    """
+    Tabela consolidada de QA (uma linha por verificação) e ocorrências para drill-down
+    (uma linha por registro envolvido: atendimento_id ou avaliacao_id).
+
+    - df_atendimentos: atendimentos já cruzados com o diagnóstico vigente
+    - df_avaliacoes: base limpa de avaliações (opcional)
+    - avaliacoes_mesmo_dia: combinações paciente+data com mais de uma avaliação (tratadas no pipeline)
+    - faltantes: contagens de registros descartados na limpeza, ex.: {'Sem paciente': 3, 'Sem data': 1}
+
+    Retorna (df_metricas, df_ocorrencias).
+    """
+    metricas = []
+    ocorrencias = []
+    total_atend = len(df_atendimentos)
+    ids_atend = df_atendimentos['atendimento_id']
+
+    def _metrica(categoria, quantidade, base, detalhes, tabela=None, ids=None):
+        metricas.append({
+            'Categoria': categoria,
+            'Quantidade': int(quantidade),
+            'Base': int(base) if base else None,
+            'Percentual': round(quantidade / base * 100, 2) if base else None,
+            'Detalhes': detalhes,
+            'Tabela': tabela,
+        })
+        if ids is not None and len(ids) > 0:
+            ocorrencias.append(pd.DataFrame({'Categoria': categoria, 'Tabela': tabela, 'registro_id': np.asarray(ids)}))
+
+    sem_diag = (df_atendimentos['diagnostico_vigente'] == 'SEM DIAGNÓSTICO').to_numpy()
+    pacientes_atend = df_atendimentos['paciente_id'].unique()
+    datas_atend = pd.to_datetime(df_atendimentos['data_atendimento'], errors='coerce')
+
+    # 1. Pacientes sem nenhuma avaliação
+    if df_avaliacoes is not None:
+        orfao = ~df_atendimentos['paciente_id'].isin(df_avaliacoes['paciente_id']).to_numpy()
+        n_pacientes = df_atendimentos.loc[orfao, 'paciente_id'].nunique()
+        _metrica('Pacientes sem avaliação', n_pacientes, len(pacientes_atend),
+                 f"Pacientes que têm atendimentos mas não têm avaliações: {n_pacientes} ({orfao.sum()} atendimentos)",
+                 'atendimentos', ids_atend[orfao])
+
+    # 2. Dados faltando (antes da limpeza)
+    if faltantes is not None:
+        _metrica('Atendimentos com dados faltando (antes da limpeza)', sum(faltantes.values()), None,
+                 ", ".join(f"{k}: {v}" for k, v in faltantes.items()))
+
+    # 3. Duplicatas de atendimentos (mesma chave)
+    chave = ['paciente_id', 'data_atendimento', 'profissional_atendimento', 'unidade']
+    em_duplicata = df_atendimentos.duplicated(subset=chave, keep=False).to_numpy()
+    n_grupos = len(df_atendimentos.loc[em_duplicata, chave].drop_duplicates())
+    _metrica('Atendimentos duplicados (mesma chave)', n_grupos, total_atend,
+             f"Combinações paciente+data+profissional+unidade duplicadas: {n_grupos} ({em_duplicata.sum()} atendimentos)",
+             'atendimentos', ids_atend[em_duplicata])
+
+    # 4. Avaliações duplicadas no mesmo dia (já tratadas)
+    if avaliacoes_mesmo_dia is not None:
+        _metrica('Avaliações no mesmo dia (tratadas)', avaliacoes_mesmo_dia, None,
+                 "Regra aplicada: manter última avaliação do dia (maior avaliacao_id)")
+
+    # 5. Atendimentos sem diagnóstico vigente
+    _metrica('Atendimentos sem diagnóstico vigente', sem_diag.sum(), total_atend,
+             "Atendimentos que ocorreram antes da primeira avaliação do paciente",
+             'atendimentos', ids_atend[sem_diag])
+
+    # 6. Verificação de datas
+    if df_avaliacoes is not None and len(df_avaliacoes) > 0:
+        datas_aval = pd.to_datetime(df_avaliacoes['data_avaliacao'], errors='coerce')
+        antes = (datas_atend < datas_aval.min()).to_numpy()
+        depois = (datas_atend > datas_aval.max() + pd.Timedelta(days=365)).to_numpy()
+        _metrica('Verificação de datas', antes.sum() + depois.sum(), total_atend,
+                 f"Atendimentos antes da primeira avaliação: {antes.sum()}. Atendimentos muito posteriores (>1 ano): {depois.sum()}",
+                 'atendimentos', ids_atend[antes | depois])
+
+    # 7. Pacientes apenas com "SEM DIAGNÓSTICO"
+    com_diag = df_atendimentos.loc[~sem_diag, 'paciente_id'].unique()
+    so_sem_diag = ~df_atendimentos['paciente_id'].isin(com_diag).to_numpy()
+    n_so_sem_diag = df_atendimentos.loc[so_sem_diag, 'paciente_id'].nunique()
+    _metrica('Pacientes apenas com "SEM DIAGNÓSTICO"', n_so_sem_diag, len(pacientes_atend),
+             "Pacientes cujos atendimentos são todos anteriores à primeira avaliação (ou sem avaliação)",
+             'atendimentos', ids_atend[so_sem_diag])
+
+    # 8. Avaliações sem unidade atribuída
+    if df_avaliacoes is not None and 'unidade_atribuicao' in df_avaliacoes.columns:
+        sem_unidade = (df_avaliacoes['unidade_atribuicao'] == 'sem atendimento').to_numpy()
+        _metrica('Avaliações sem unidade atribuída', sem_unidade.sum(), len(df_avaliacoes),
+                 "Avaliações de pacientes sem nenhum atendimento",
+                 'avaliacoes', df_avaliacoes['avaliacao_id'][sem_unidade])
+
+    # 9. Período dos dados
+    if datas_atend.notna().any():
+        data_min, data_max = datas_atend.min(), datas_atend.max()
+        _metrica('Período dos atendimentos (dias)', (data_max - data_min).days, None,
+                 f"{data_min.strftime('%Y-%m-%d')} a {data_max.strftime('%Y-%m-%d')}")
+
+    df_metricas = pd.DataFrame(metricas, columns=COLUNAS_QA_METRICAS)
+    df_ocorrencias = (
+        pd.concat(ocorrencias, ignore_index=True) if ocorrencias
+        else pd.DataFrame(columns=COLUNAS_QA_OCORRENCIAS)
+    )
+    return df_metricas, df_ocorrencias
+
+# ============================================================================
+# DIMENSÕES (OPÇÕES DOS FILTROS)
+# ============================================================================
+
+DIMENSOES_ATENDIMENTOS = ['diagnostico_vigente', 'unidade', 'profissional_atendimento']
+DIMENSOES_AVALIACOES = ['diagnostico', 'unidade', 'profissional_avaliacao', 'ano']
+
+def construir_dimensoes(df, colunas, coluna_data) -> dict:
+    """
+    Dicionários de dimensões de uma tabela: opções ordenadas, contagens por valor
+    e limites de data. Calculados uma vez por versão do dataset.
+    """
+    dims = {'opcoes': {}, 'contagens': {}, 'data_min': None, 'data_max': None}
+    if df is None:
+        return dims
+
+    datas = pd.to_datetime(df[coluna_data], errors='coerce')
+    for col in colunas:
+        if col == 'ano' and col not in df.columns:
+            serie = datas.dt.year.astype('Int64')
+        elif col in df.columns:
+            serie = df[col]
+        else:
+            continue
+        contagens = serie.value_counts(dropna=True).sort_index()
+        contagens = contagens[contagens > 0]  # categóricas: só os valores presentes
+        dims['opcoes'][col] = [v.item() if hasattr(v, 'item') else v for v in contagens.index]
+        dims['contagens'][col] = dict(zip(dims['opcoes'][col], contagens.astype(int).tolist()))
+
+    if datas.notna().any():
+        dims['data_min'] = datas.min().date()
+        dims['data_max'] = datas.max().date()
+    return dims
+
+# ============================================================================
+# DATASET PARTICIONADO (PARQUET POR ANO/MÊS)
+# ============================================================================
+
+DIRETORIO_PARTICIONADO = 'dados_particionados'
+ARQUIVO_MANIFESTO = 'manifest.json'
+VERSAO_MANIFESTO = 1
+
+def _valor_json(valor):
+    return valor.item() if hasattr(valor, 'item') else valor  # escalares numpy -> Python
+
+def _dimensoes_para_json(dims: dict) -> dict:
+    return {
+        'opcoes': {col: [_valor_json(v) for v in valores] for col, valores in dims['opcoes'].items()},
+        'contagens': {
+            col: [[_valor_json(v), _valor_json(n)] for v, n in valores.items()]
+            for col, valores in dims['contagens'].items()
+        },
+        'data_min': dims['data_min'].isoformat() if dims['data_min'] else None,
+        'data_max': dims['data_max'].isoformat() if dims['data_max'] else None,
+    }
+
+def dimensoes_do_manifesto(entrada: dict) -> dict:
+    """Dimensões de todo o histórico de uma tabela, gravadas no manifesto (sem ler as partições)."""
+    dims = entrada['dimensoes']
+    return {
+        'opcoes': dims['opcoes'],
+        'contagens': {col: dict(map(tuple, pares)) for col, pares in dims['contagens'].items()},
+        'data_min': date.fromisoformat(dims['data_min']) if dims['data_min'] else None,
+        'data_max': date.fromisoformat(dims['data_max']) if dims['data_max'] else None,
+    }
+
+def _nome_particao(texto: str) -> str:
+    return "".join(c if c.isalnum() or c in '-_' else '_' for c in str(texto)) or 'sem_nome'
+
+def _gravar_particoes(df: pd.DataFrame, diretorio: str, tabela: str, coluna_data: str, por_unidade: bool) -> list:
+    """Um Parquet por ano/mês (e unidade); linhas sem data ficam na partição 'sem_data'."""
+    datas = pd.to_datetime(df[coluna_data], errors='coerce')
+    chaves = {
+        'ano': datas.dt.year.fillna(0).astype(int),
+        'mes': datas.dt.month.fillna(0).astype(int),
+    }
+    if por_unidade:
+        chaves['unidade'] = df['unidade'].fillna('sem_unidade').astype(str)
+
+    particoes = []
+    for valores, posicoes in df.groupby(list(chaves.values()), sort=True, observed=True).indices.items():
+        valores = dict(zip(chaves, map(_valor_json, valores if isinstance(valores, tuple) else (valores,))))
+        partes = ['sem_data'] if valores['ano'] == 0 else [f"ano={valores['ano']}", f"mes={valores['mes']:02d}"]
+        if por_unidade:
+            partes.append(f"unidade={_nome_particao(valores['unidade'])}")
+        relativo = os.path.join(tabela, *partes, 'parte-0.parquet')
+        caminho = os.path.join(diretorio, relativo)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        bloco = df.iloc[posicoes]
+        bloco.to_parquet(caminho, index=False)
+        datas_bloco = datas.iloc[posicoes]
+        particoes.append({
+            'arquivo': relativo.replace(os.sep, '/'),
+            'ano': valores['ano'] or None,
+            'mes': valores['mes'] or None,
+            'unidade': valores.get('unidade'),
+            'linhas': int(len(bloco)),
+            'bytes': os.path.getsize(caminho),
+            'data_min': datas_bloco.min().date().isoformat() if datas_bloco.notna().any() else None,
+            'data_max': datas_bloco.max().date().isoformat() if datas_bloco.notna().any() else None,
+        })
+    return particoes
+
+def gravar_dataset_particionado(tabelas: dict, inteiras: dict, diretorio: str = DIRETORIO_PARTICIONADO,
+                                por_unidade: bool = False) -> dict:
+    """
+    Grava o dataset colunar com manifesto:
+    - tabelas: {nome: (df, coluna_data, colunas_dimensao)}, particionadas por ano/mês (e unidade);
+    - inteiras: {nome: df} pequenas (resumos, QA), um Parquet cada.
+    O manifesto lista cada partição com linhas, bytes e intervalo de datas, além das
+    dimensões de todo o histórico. O diretório é substituído de uma vez ao final.
+    Retorna o manifesto.
+    """
+    temporario = f"{diretorio}.tmp"
+    shutil.rmtree(temporario, ignore_errors=True)
+    os.makedirs(temporario)
+
+    manifesto = {
+        'versao': VERSAO_MANIFESTO,
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'particionado_por': ['ano', 'mes'] + (['unidade'] if por_unidade else []),
+        'tabelas': {},
+        'inteiras': {},
+    }
+    for nome, (df, coluna_data, colunas_dimensao) in tabelas.items():
+        manifesto['tabelas'][nome] = {
+            'coluna_data': coluna_data,
+            'linhas': int(len(df)),
+            'particoes': _gravar_particoes(df, temporario, nome, coluna_data, por_unidade),
+            'dimensoes': _dimensoes_para_json(construir_dimensoes(df, colunas_dimensao, coluna_data)),
+        }
+    for nome, df in inteiras.items():
+        if df is None:
+            continue
+        df.to_parquet(os.path.join(temporario, f"{nome}.parquet"), index=False)
+        manifesto['inteiras'][nome] = f"{nome}.parquet"
+
+    with open(os.path.join(temporario, ARQUIVO_MANIFESTO), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+
+    shutil.rmtree(diretorio, ignore_errors=True)
+    os.replace(temporario, diretorio)
+    return manifesto
+
+def ler_manifesto(diretorio: str = DIRETORIO_PARTICIONADO):
+    """Manifesto do dataset particionado, ou None se não houver (ou for de versão desconhecida)."""
+    try:
+        with open(os.path.join(diretorio, ARQUIVO_MANIFESTO), encoding='utf-8') as f:
+            manifesto = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return manifesto if manifesto.get('versao') == VERSAO_MANIFESTO else None
+
+def particoes_no_periodo(entrada: dict, data_min=None, data_max=None, unidades=None) -> list:
+    """
+    Partições de uma tabela do manifesto que intersectam [data_min, data_max] (datas inclusivas;
+    None = sem limite). Linhas sem data só entram sem nenhum limite. `unidades` poda
+    também por unidade quando o dataset foi particionado por ela.
+    """
+    data_min = pd.Timestamp(data_min).date().isoformat() if data_min is not None else None
+    data_max = pd.Timestamp(data_max).date().isoformat() if data_max is not None else None
+    selecionadas = []
+    for particao in entrada['particoes']:
+        if particao['data_min'] is None:
+            if data_min is None and data_max is None:
+                selecionadas.append(particao)
+            continue
+        if data_min is not None and particao['data_max'] < data_min:
+            continue
+        if data_max is not None and particao['data_min'] > data_max:
+            continue
+        if unidades is not None and particao['unidade'] is not None and particao['unidade'] not in unidades:
+            continue
+        selecionadas.append(particao)
+    return selecionadas
+
+def ler_particoes(diretorio: str, entrada: dict, particoes: list) -> pd.DataFrame:
+    """Concatena as partições selecionadas (na ordem do manifesto: ano, mês); sem partições, tabela vazia."""
+    if not particoes:
+        if not entrada['particoes']:
+            return pd.DataFrame()
+        return pd.read_parquet(os.path.join(diretorio, entrada['particoes'][0]['arquivo'])).iloc[:0]
+    partes = [pd.read_parquet(os.path.join(diretorio, p['arquivo'])) for p in particoes]
+    return pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+
+# ============================================================================
+# MEMÓRIA E TIPOS COMPACTOS
+# ============================================================================
+
+LIMITE_CATEGORIA = 0.5  # texto vira categórica quando valores distintos / linhas <= limite
+
+def memoria_colunas(df: pd.DataFrame) -> pd.Series:
+    """Bytes ocupados por coluna (deep: inclui o conteúdo dos textos), sem o índice."""
+    return df.memory_usage(deep=True, index=False)
+
+def _datas_ou_none(serie: pd.Series) -> Optional[pd.Series]:
+    """Coluna de data guardada como texto/objeto: datetime64 se todos os valores não nulos forem datas."""
+    datas = pd.to_datetime(serie, errors='coerce')
+    return datas if datas.count() == serie.count() else None
+
+def _tipo_compacto(serie: pd.Series, limite_categoria: float) -> pd.Series:
+    if isinstance(serie.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(serie):
+        return serie
+    if pd.api.types.is_integer_dtype(serie):
+        return pd.to_numeric(serie, downcast='integer')
+    if not (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)):
+        return serie  # datas e floats ficam como estão (float32 perderia precisão)
+    if serie.count() == 0:
+        return serie
+    if pd.api.types.is_object_dtype(serie) and pd.api.types.infer_dtype(serie, skipna=True) == 'integer':
+        return pd.to_numeric(serie, downcast='integer')  # IDs lidos como objeto no fallback
+    if str(serie.name).startswith('data_'):
+        datas = _datas_ou_none(serie)
+        if datas is not None:
+            return datas
+    if serie.nunique() <= limite_categoria * len(serie):
+        return serie.astype('category')
+    return serie
+
+def otimizar_tipos(df: pd.DataFrame, limite_categoria: float = LIMITE_CATEGORIA) -> tuple:
+    """
+    Reduz a memória de uma tabela carregada, sem alterar valores:
+    - inteiros na menor largura que comporta os valores (int8/16/32; nullable continua nullable);
+    - IDs guardados como objeto com valores inteiros viram inteiros;
+    - colunas `data_*` em texto/objeto viram datetime64;
+    - textos com poucos valores distintos (diagnóstico, unidade, profissional) viram categóricas.
+    Retorna (df_otimizado, comparação por coluna: tipos e bytes antes/depois).
+    """
+    otimizado = pd.DataFrame(
+        {col: _tipo_compacto(df[col], limite_categoria) for col in df.columns}, index=df.index
+    )
+    return otimizado, comparar_memoria(df, otimizado)
+
+def comparar_memoria(antes: pd.DataFrame, depois: pd.DataFrame) -> pd.DataFrame:
+    """Tipos e bytes por coluna de duas versões da mesma tabela (mesmas colunas)."""
+    return pd.DataFrame({
+        'coluna': list(antes.columns),
+        'tipo_antes': [str(t) for t in antes.dtypes],
+        'tipo_depois': [str(t) for t in depois.dtypes],
+        'bytes_antes': memoria_colunas(antes).to_numpy(),
+        'bytes_depois': memoria_colunas(depois).to_numpy(),
+    })
+
+# ============================================================================
+# COMPARAÇÃO DE RESULTADOS (ENTRE MOTORES DE CONSULTA)
+# ============================================================================
+
+def _valores_comparaveis(serie: pd.Series) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.to_numpy(dtype='float64', na_value=np.nan)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype('datetime64[ns]').to_numpy()
+    return serie.astype(object).to_numpy()
+
+def diferenca_tabelas(a: pd.DataFrame, b: pd.DataFrame, ordenar: bool = True):
+    """
+    Primeira diferença entre duas tabelas de resultado, ou None se forem iguais.
+    Compara colunas, número de linhas e valores (nulos iguais entre si), ignorando o
+    índice, os tipos (int32 × int64, object × string) e, com `ordenar`, a ordem das linhas.
+    """
+    if list(a.columns) != list(b.columns):
+        return f"colunas diferentes: {list(a.columns)} × {list(b.columns)}"
+    if len(a) != len(b):
+        return f"número de linhas diferente: {len(a)} × {len(b)}"
+    if ordenar and len(a.columns):
+        colunas = list(a.columns)
+        a = a.sort_values(colunas, na_position='last', kind='stable')
+        b = b.sort_values(colunas, na_position='last', kind='stable')
+    for coluna in a.columns:
+        va, vb = _valores_comparaveis(a[coluna]), _valores_comparaveis(b[coluna])
+        if va.dtype.kind == 'f' and vb.dtype.kind == 'f':
+            iguais = np.isclose(va, vb, rtol=1e-9, atol=0, equal_nan=True)
+        else:
+            iguais = np.array([
+                pd.isna(x) and pd.isna(y) if pd.isna(x) or pd.isna(y) else bool(x == y)
+                for x, y in zip(va, vb)
+            ], dtype=bool)
+        if not iguais.all():
+            linha = int(np.flatnonzero(~iguais)[0])
+            return f"coluna '{coluna}', linha {linha}: {_valor_json(va[linha])!r} × {_valor_json(vb[linha])!r}"
+    return None
@@ -0,0 +1,419 @@
+"""
+Etapas 2 a 6 do processamento (padronização, empates, vigência dos diagnósticos, cruzamento
+com os atendimentos e unidade das avaliações), em dois motores intercambiáveis:
+
+- pandas: o padrão;
+- polars: as mesmas etapas em LazyFrames (multithread), com join_asof por paciente.
+
+Os dois produzem as mesmas tabelas; `python benchmark.py pipeline` confere e mede.
+"""
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from dados_comuns import atribuir_unidade_avaliacoes, diferenca_tabelas
+
+MOTORES_PIPELINE = ('pandas', 'polars')
+
+RENOMEAR_AVALIACOES = {
+    'Data': 'data_avaliacao',
+    'Profissional': 'profissional_avaliacao',
+    'Paciente': 'paciente_id',
+    'Diagnóstico': 'diagnostico',
+}
+RENOMEAR_ATENDIMENTOS = {
+    'Data': 'data_atendimento',
+    'Paciente': 'paciente_id',
+    'Profissional': 'profissional_atendimento',  # 'Profissional ' (com espaço) após o strip dos nomes
+    'Unidade': 'unidade',
+}
+COLUNAS_ATENDIMENTOS_COM_DIAG = [
+    'atendimento_id', 'paciente_id', 'data_atendimento', 'profissional_atendimento', 'unidade',
+    'diagnostico_vigente', 'data_avaliacao_origem', 'profissional_avaliacao_origem',
+]
+TABELAS_ETAPAS = ['avaliacoes', 'atendimentos', 'vigencia', 'atendimentos_com_diag']
+
+# Datas em texto: formatos aceitos, na ordem (dia/mês/ano da planilha antes do ISO ambíguo);
+# texto fora deles vira nulo. Valores já em data/hora (células de data do Excel) ficam como estão.
+FORMATOS_DATA = ('%d/%m/%Y', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+
+def motor_disponivel(motor: str) -> bool:
+    if motor == 'polars':
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            return False
+    return motor in MOTORES_PIPELINE
+
+def executar_etapas(df_avaliacoes_raw: pd.DataFrame, df_atendimentos_raw: pd.DataFrame, motor: str = 'pandas') -> dict:
+    """
+    Executa as etapas 2 a 6 com o motor escolhido. Retorna (sempre em pandas):
+    - avaliacoes: limpas, sem empates, ordenadas por paciente/data, com unidade atribuída
+    - atendimentos: limpos, na ordem original
+    - vigencia: um intervalo [inicio_diag, fim_diag) por avaliação
+    - atendimentos_com_diag: cada atendimento com o diagnóstico vigente na data
+    - avaliacoes_validas, combinacoes_empate, empates_removidos: contagens para o log
+    - tempo_s
+    """
+    inicio = time.perf_counter()
+    etapas = _etapas_polars if motor == 'polars' else _etapas_pandas
+    resultado = etapas(_normalizar_bruto(df_avaliacoes_raw), _normalizar_bruto(df_atendimentos_raw))
+    resultado['tempo_s'] = time.perf_counter() - inicio
+    return resultado
+
+def comparar_motores_pipeline(df_avaliacoes_raw: pd.DataFrame, df_atendimentos_raw: pd.DataFrame,
+                              motores=MOTORES_PIPELINE) -> dict:
+    """
+    Executa cada motor sobre a mesma entrada e compara as tabelas com as do primeiro
+    (linha a linha, na ordem produzida). Retorna {'resultados': {motor: etapas},
+    'diferencas': {tabela: descrição}} — diferencas vazio = saídas idênticas.
+    """
+    resultados = {motor: executar_etapas(df_avaliacoes_raw, df_atendimentos_raw, motor) for motor in motores}
+    referencia, *outros = motores
+    diferencas = {}
+    for motor in outros:
+        for tabela in TABELAS_ETAPAS:
+            diferenca = diferenca_tabelas(resultados[referencia][tabela], resultados[motor][tabela], ordenar=False)
+            if diferenca:
+                diferencas[f"{tabela} ({motor})"] = diferenca
+        for contagem in ('avaliacoes_validas', 'combinacoes_empate', 'empates_removidos'):
+            if resultados[referencia][contagem] != resultados[motor][contagem]:
+                diferencas[f"{contagem} ({motor})"] = (
+                    f"{resultados[referencia][contagem]} × {resultados[motor][contagem]}"
+                )
+    return {'resultados': resultados, 'diferencas': diferencas}
+
+def _normalizar_bruto(df_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Entrada comum aos dois motores: colunas objeto só com datas viram datetime64 e colunas
+    com tipos misturados (ex.: paciente ora número, ora texto; datas do Excel e datas em
+    texto) viram texto, preservando os nulos. Colunas de um tipo só ficam intactas.
+    """
+    colunas = {}
+    for coluna in df_raw.columns:
+        serie = df_raw[coluna]
+        if pd.api.types.is_object_dtype(serie):
+            tipo = pd.api.types.infer_dtype(serie, skipna=True)
+            if tipo in ('datetime', 'datetime64', 'date'):
+                serie = pd.to_datetime(serie)
+            elif tipo.startswith('mixed'):
+                serie = serie.map(str, na_action='ignore').astype(object)
+        colunas[coluna] = serie
+    return pd.DataFrame(colunas, index=df_raw.index)
+
+def _datas(serie: pd.Series) -> pd.Series:
+    """Regra única de datas (FORMATOS_DATA); o motor Polars aplica a mesma em _etapas_polars."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype('datetime64[us]')
+    texto = serie.map(str, na_action='ignore').astype(object).str.strip()
+    datas = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[us]')
+    for formato in FORMATOS_DATA:
+        datas = datas.fillna(pd.to_datetime(texto, format=formato, errors='coerce'))
+    return datas
+
+def _texto(serie: pd.Series) -> pd.Series:
+    """Texto sem espaços nas pontas; nulos continuam nulos (em qualquer versão do pandas)."""
+    return serie.map(str, na_action='ignore').astype(object).str.strip()
+
+# ============================================================================
+# MOTOR PANDAS
+# ============================================================================
+
+def _padronizar_avaliacoes(df_avaliacoes_raw: pd.DataFrame) -> pd.DataFrame:
+    df_avaliacoes = df_avaliacoes_raw.copy()
+
+    # Padronizar nomes de colunas
+    df_avaliacoes.columns = df_avaliacoes.columns.str.strip()
+    df_avaliacoes = df_avaliacoes.rename(columns=RENOMEAR_AVALIACOES)
+
+    # Tratar datas
+    df_avaliacoes['data_avaliacao'] = _datas(df_avaliacoes['data_avaliacao'])
+    df_avaliacoes['data_avaliacao_raw'] = df_avaliacoes_raw['Data'].copy()
+
+    # Normalizar diagnóstico (trim, case, etc)
+    df_avaliacoes['diagnostico'] = _texto(df_avaliacoes['diagnostico'])
+    df_avaliacoes['diagnostico'] = df_avaliacoes['diagnostico'].str.title()  # Primeira letra maiúscula
+    df_avaliacoes['diagnostico_raw'] = df_avaliacoes_raw['Diagnóstico'].copy()
+
+    # Normalizar profissional
+    df_avaliacoes['profissional_avaliacao'] = _texto(df_avaliacoes['profissional_avaliacao'])
+    df_avaliacoes['profissional_avaliacao_raw'] = df_avaliacoes_raw['Profissional'].copy()
+
+    # Normalizar paciente
+    df_avaliacoes['paciente_id'] = _texto(df_avaliacoes['paciente_id'])
+    df_avaliacoes['paciente_id_raw'] = df_avaliacoes_raw['Paciente'].copy()
+
+    # Criar ID de avaliação (se não existir)
+    if 'avaliacao_id' not in df_avaliacoes.columns:
+        df_avaliacoes['avaliacao_id'] = range(1, len(df_avaliacoes) + 1)
+
+    # Remover linhas com dados essenciais faltando
+    df_avaliacoes = df_avaliacoes.dropna(subset=['paciente_id', 'data_avaliacao', 'diagnostico'])
+    df_avaliacoes = df_avaliacoes[df_avaliacoes['paciente_id'] != 'nan']
+    df_avaliacoes = df_avaliacoes[df_avaliacoes['diagnostico'] != 'nan']
+    return df_avaliacoes
+
+def _padronizar_atendimentos(df_atendimentos_raw: pd.DataFrame) -> pd.DataFrame:
+    df_atendimentos = df_atendimentos_raw.copy()
+
+    # Padronizar nomes de colunas
+    df_atendimentos.columns = df_atendimentos.columns.str.strip()
+    df_atendimentos = df_atendimentos.rename(columns=RENOMEAR_ATENDIMENTOS)
+
+    # Tratar datas
+    df_atendimentos['data_atendimento'] = _datas(df_atendimentos['data_atendimento'])
+    df_atendimentos['data_atendimento_raw'] = df_atendimentos_raw['Data'].copy()
+
+    # Normalizar profissional
+    df_atendimentos['profissional_atendimento'] = _texto(df_atendimentos['profissional_atendimento'])
+    if 'Profissional ' in df_atendimentos_raw.columns:
+        df_atendimentos['profissional_atendimento_raw'] = df_atendimentos_raw['Profissional '].copy()
+    else:
+        df_atendimentos['profissional_atendimento_raw'] = df_atendimentos_raw['Profissional'].copy()
+
+    # Normalizar unidade
+    df_atendimentos['unidade'] = _texto(df_atendimentos['unidade'])
+    df_atendimentos['unidade_raw'] = df_atendimentos_raw['Unidade'].copy()
+
+    # Normalizar paciente
+    df_atendimentos['paciente_id'] = _texto(df_atendimentos['paciente_id'])
+    df_atendimentos['paciente_id_raw'] = df_atendimentos_raw['Paciente'].copy()
+
+    # Criar ID de atendimento (se não existir)
+    if 'atendimento_id' not in df_atendimentos.columns:
+        df_atendimentos['atendimento_id'] = range(1, len(df_atendimentos) + 1)
+
+    # Remover linhas com dados essenciais faltando
+    df_atendimentos = df_atendimentos.dropna(subset=['paciente_id', 'data_atendimento'])
+    df_atendimentos = df_atendimentos[df_atendimentos['paciente_id'] != 'nan']
+    return df_atendimentos
+
+def _etapas_pandas(df_avaliacoes_raw: pd.DataFrame, df_atendimentos_raw: pd.DataFrame) -> dict:
+    df_avaliacoes = _padronizar_avaliacoes(df_avaliacoes_raw)
+    df_atendimentos = _padronizar_atendimentos(df_atendimentos_raw)
+    avaliacoes_validas = len(df_avaliacoes)
+
+    # Empates: várias avaliações do paciente na mesma data -> mantém a última (maior avaliacao_id)
+    df_avaliacoes = df_avaliacoes.sort_values(['paciente_id', 'data_avaliacao', 'avaliacao_id'])
+    duplicatas = df_avaliacoes.groupby(['paciente_id', 'data_avaliacao']).size()
+    duplicatas = duplicatas[duplicatas > 1]
+    df_avaliacoes = df_avaliacoes.drop_duplicates(subset=['paciente_id', 'data_avaliacao'], keep='last')
+
+    # Vigência: de cada avaliação até a próxima do mesmo paciente (sem próxima = aberta).
+    # Sem empates, a próxima avaliação é a linha seguinte do paciente.
+    df_vigencia = pd.DataFrame({
+        'paciente_id': df_avaliacoes['paciente_id'],
+        'inicio_diag': df_avaliacoes['data_avaliacao'],
+        'fim_diag': df_avaliacoes.groupby('paciente_id', sort=False)['data_avaliacao'].shift(-1),
+        'diagnostico': df_avaliacoes['diagnostico'],
+        'profissional_avaliacao': df_avaliacoes['profissional_avaliacao'],
+        'avaliacao_id': df_avaliacoes['avaliacao_id'],
+    }).reset_index(drop=True)
+
+    # Cruzamento: vale a vigência com o maior início <= data do atendimento (inicio <= data < fim),
+    # isto é, um join as-of 'backward' por paciente
+    atendimentos = df_atendimentos[COLUNAS_ATENDIMENTOS_COM_DIAG[:5]].assign(_pos=np.arange(len(df_atendimentos)))
+    cruzado = pd.merge_asof(
+        atendimentos.sort_values('data_atendimento', kind='stable'),
+        df_vigencia[['paciente_id', 'inicio_diag', 'diagnostico', 'profissional_avaliacao']].sort_values('inicio_diag', kind='stable'),
+        left_on='data_atendimento',
+        right_on='inicio_diag',
+        by='paciente_id',
+        direction='backward',
+    ).sort_values('_pos')
+    diagnostico = cruzado['diagnostico']
+    df_atendimentos_com_diag = pd.DataFrame({
+        **{coluna: cruzado[coluna].to_numpy() for coluna in COLUNAS_ATENDIMENTOS_COM_DIAG[:5]},
+        'diagnostico_vigente': diagnostico.where(diagnostico.notna() & (diagnostico != ''), 'SEM DIAGNÓSTICO').to_numpy(),
+        'data_avaliacao_origem': cruzado['inicio_diag'].to_numpy(),
+        'profissional_avaliacao_origem': cruzado['profissional_avaliacao'].to_numpy(),
+    })
+
+    df_avaliacoes = atribuir_unidade_avaliacoes(df_avaliacoes, df_atendimentos)
+    return {
+        'avaliacoes': df_avaliacoes,
+        'atendimentos': df_atendimentos,
+        'vigencia': df_vigencia,
+        'atendimentos_com_diag': df_atendimentos_com_diag,
+        'avaliacoes_validas': avaliacoes_validas,
+        'combinacoes_empate': int(len(duplicatas)),
+        'empates_removidos': int(duplicatas.sum() - len(duplicatas)),
+    }
+
+# ============================================================================
+# MOTOR POLARS (LAZY)
+# ============================================================================
+
+def _etapas_polars(df_avaliacoes_raw: pd.DataFrame, df_atendimentos_raw: pd.DataFrame) -> dict:
+    import polars as pl
+
+    def _texto(coluna: str) -> pl.Expr:
+        return pl.col(coluna).cast(pl.Utf8).str.strip_chars()
+
+    def _data(coluna: str, esquema) -> pl.Expr:
+        # Mesma regra de _datas: data/hora fica; texto só nos FORMATOS_DATA, o primeiro que casar
+        if esquema[coluna].is_temporal():
+            return pl.col(coluna).cast(pl.Datetime('us'))
+        texto = _texto(coluna)
+        return pl.coalesce([
+            texto.str.strptime(pl.Datetime('us'), formato, strict=False) for formato in FORMATOS_DATA
+        ])
+
+    def _entrada(df_raw: pd.DataFrame, coluna_id: str) -> pl.LazyFrame:
+        bruto = pl.from_pandas(df_raw).rename(lambda c: c.strip())
+        if coluna_id not in bruto.columns:
+            bruto = bruto.with_row_index(coluna_id, offset=1).with_columns(pl.col(coluna_id).cast(pl.Int64))
+        return bruto.lazy()
+
+    def _colunas_saida(df_raw: pd.DataFrame, renomear: dict, extras: list, coluna_id: str) -> list:
+        # Mesma ordem de colunas do motor pandas: as da planilha (renomeadas) e depois as criadas
+        colunas = [renomear.get(c.strip(), c.strip()) for c in df_raw.columns]
+        return colunas + [c for c in extras + [coluna_id] if c not in colunas]
+
+    # Padronização
+    aval_raw = _entrada(df_avaliacoes_raw, 'avaliacao_id')
+    esquema_aval = aval_raw.collect_schema()
+    avaliacoes = (
+        aval_raw
+        .with_columns(
+            data_avaliacao=_data('Data', esquema_aval),
+            data_avaliacao_raw=pl.col('Data'),
+            diagnostico=_texto('Diagnóstico').str.to_titlecase(),
+            diagnostico_raw=pl.col('Diagnóstico'),
+            profissional_avaliacao=_texto('Profissional'),
+            profissional_avaliacao_raw=pl.col('Profissional'),
+            paciente_id=_texto('Paciente'),
+            paciente_id_raw=pl.col('Paciente'),
+        )
+        .drop([c for c in RENOMEAR_AVALIACOES if c in esquema_aval])
+        .filter(
+            pl.col('paciente_id').is_not_null() & pl.col('data_avaliacao').is_not_null()
+            & pl.col('diagnostico').is_not_null()
+            & (pl.col('paciente_id') != 'nan') & (pl.col('diagnostico') != 'nan')
+        )
+        .select(_colunas_saida(
+            df_avaliacoes_raw, RENOMEAR_AVALIACOES,
+            ['data_avaliacao_raw', 'diagnostico_raw', 'profissional_avaliacao_raw', 'paciente_id_raw'], 'avaliacao_id',
+        ))
+    )
+    atend_raw = _entrada(df_atendimentos_raw, 'atendimento_id')
+    esquema_atend = atend_raw.collect_schema()
+    atendimentos = (
+        atend_raw
+        .with_columns(
+            data_atendimento=_data('Data', esquema_atend),
+            data_atendimento_raw=pl.col('Data'),
+            profissional_atendimento=_texto('Profissional'),
+            profissional_atendimento_raw=pl.col('Profissional'),
+            unidade=_texto('Unidade'),
+            unidade_raw=pl.col('Unidade'),
+            paciente_id=_texto('Paciente'),
+            paciente_id_raw=pl.col('Paciente'),
+        )
+        .drop([c for c in RENOMEAR_ATENDIMENTOS if c in esquema_atend])
+        .filter(
+            pl.col('paciente_id').is_not_null() & pl.col('data_atendimento').is_not_null()
+            & (pl.col('paciente_id') != 'nan')
+        )
+        .select(_colunas_saida(
+            df_atendimentos_raw, RENOMEAR_ATENDIMENTOS,
+            ['data_atendimento_raw', 'profissional_atendimento_raw', 'unidade_raw', 'paciente_id_raw'], 'atendimento_id',
+        ))
+    )
+
+    # Empates
+    avaliacoes = avaliacoes.sort(['paciente_id', 'data_avaliacao', 'avaliacao_id'])
+    empates = (
+        avaliacoes.group_by(['paciente_id', 'data_avaliacao']).len()
+        .filter(pl.col('len') > 1)
+        .select(combinacoes_empate=pl.len(), empates_removidos=(pl.col('len') - 1).sum())
+    )
+    avaliacoes_validas = avaliacoes.select(avaliacoes_validas=pl.len())
+    sem_empates = (
+        avaliacoes.unique(subset=['paciente_id', 'data_avaliacao'], keep='last', maintain_order=True)
+        .sort(['paciente_id', 'data_avaliacao', 'avaliacao_id'])
+    )
+
+    # Vigência
+    vigencia = sem_empates.select(
+        'paciente_id',
+        inicio_diag=pl.col('data_avaliacao'),
+        fim_diag=pl.col('data_avaliacao').shift(-1).over('paciente_id'),
+        diagnostico='diagnostico',
+        profissional_avaliacao='profissional_avaliacao',
+        avaliacao_id='avaliacao_id',
+    )
+
+    # Cruzamento (join_asof 'backward' por paciente)
+    atendimentos_com_diag = (
+        atendimentos.select(COLUNAS_ATENDIMENTOS_COM_DIAG[:5]).with_row_index('_pos')
+        .sort('data_atendimento')
+        .join_asof(
+            vigencia.select('paciente_id', 'inicio_diag', 'diagnostico', 'profissional_avaliacao').sort('inicio_diag'),
+            left_on='data_atendimento', right_on='inicio_diag', by='paciente_id', strategy='backward',
+        )
+        .sort('_pos')
+        .select(
+            *COLUNAS_ATENDIMENTOS_COM_DIAG[:5],
+            diagnostico_vigente=pl.when(pl.col('diagnostico').is_null() | (pl.col('diagnostico') == ''))
+            .then(pl.lit('SEM DIAGNÓSTICO')).otherwise(pl.col('diagnostico')),
+            data_avaliacao_origem=pl.col('inicio_diag'),
+            profissional_avaliacao_origem=pl.col('profissional_avaliacao'),
+        )
+    )
+
+    # Unidade das avaliações: atendimento do mesmo paciente com data mais próxima; no mesmo dia com
+    # mais de uma unidade, a primeira em ordem alfabética. No empate de distância o merge_asof
+    # 'nearest' do pandas fica com o anterior e o join_asof 'nearest' com o posterior, por isso
+    # a escolha é feita aqui a partir dos joins 'backward' e 'forward'.
+    atend_dia = (
+        atendimentos.select('paciente_id', _data=pl.col('data_atendimento').dt.truncate('1d'), _unidade='unidade')
+        .drop_nulls(['_data', '_unidade'])
+        .group_by(['paciente_id', '_data']).agg(pl.col('_unidade').min())
+        .sort('_data')
+    )
+
+    def _vizinho(sufixo: str) -> pl.LazyFrame:
+        return atend_dia.rename({'_data': f'_data{sufixo}', '_unidade': f'_unidade{sufixo}'})
+
+    data_ref = pl.col('_data_ref')
+    usar_posterior = pl.col('_data_ant').is_null() | (
+        pl.col('_data_post').is_not_null() & ((pl.col('_data_post') - data_ref) < (data_ref - pl.col('_data_ant')))
+    )
+    avaliacoes_final = (
+        sem_empates.with_row_index('_pos')
+        .with_columns(_data_ref=pl.col('data_avaliacao').dt.truncate('1d'))
+        .sort('_data_ref')
+        .join_asof(_vizinho('_ant'), left_on='_data_ref', right_on='_data_ant', by='paciente_id', strategy='backward')
+        .join_asof(_vizinho('_post'), left_on='_data_ref', right_on='_data_post', by='paciente_id', strategy='forward')
+        .sort('_pos')
+        .with_columns(
+            unidade=pl.when(usar_posterior).then(pl.col('_unidade_post')).otherwise(pl.col('_unidade_ant')),
+            _data_atendimento=pl.when(usar_posterior).then(pl.col('_data_post')).otherwise(pl.col('_data_ant')),
+        )
+        .with_columns(unidade_atribuicao=(
+            pl.when(pl.col('unidade').is_null()).then(pl.lit('sem atendimento'))
+            .when(data_ref == pl.col('_data_atendimento')).then(pl.lit('mesmo dia'))
+            .otherwise(pl.lit('atendimento mais próximo'))
+        ))
+        .drop('_pos', '_data_ref', '_data_ant', '_unidade_ant', '_data_post', '_unidade_post', '_data_atendimento')
+    )
+
+    # Um único collect: os planos compartilham as leituras e rodam em paralelo. Os lados dos
+    # join_asof já estão ordenados pela data (o Polars só não consegue conferir isso por grupo).
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='Sortedness of columns cannot be checked')
+        aval_df, atend_df, vig_df, cruzado_df, empates_df, validas_df = pl.collect_all(
+            [avaliacoes_final, atendimentos, vigencia, atendimentos_com_diag, empates, avaliacoes_validas]
+        )
+    return {
+        'avaliacoes': aval_df.to_pandas(),
+        'atendimentos': atend_df.to_pandas(),
+        'vigencia': vig_df.to_pandas(),
+        'atendimentos_com_diag': cruzado_df.to_pandas(),
+        'avaliacoes_validas': int(validas_df.item()),
+        'combinacoes_empate': int(empates_df['combinacoes_empate'].item()),
+        'empates_removidos': int(empates_df['empates_removidos'].item() or 0),
+    }
@@ -0,0 +1,126 @@
+"""
+Geração em lote dos relatórios de insights, sem interface (ex.: rotina mensal).
+
+Gera um relatório (markdown + PDF) por unidade ou por diagnóstico do período e
+grava tudo em um zip. Usa os mesmos arquivos de dados, caches e prompt do dashboard.
+
+Uso:
+    python gerar_relatorios.py --por unidade --mes 2025-11
+    python gerar_relatorios.py --por diagnostico_vigente --inicio 2025-01-01 --fim 2025-06-30 --saida semestre.zip
+    INSIGHTS_FAKE_LLM=1 python gerar_relatorios.py --por unidade --mes 2025-11   # sem chamar a IA
+    INSIGHTS_LLM_PROVIDER=compativel INSIGHTS_LLM_BASE_URL=http://127.0.0.1:8001/v1 python gerar_relatorios.py --por unidade
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+import app
+
+
+def _periodo(args, dims) -> tuple:
+    if args.mes:
+        inicio = datetime.strptime(args.mes, "%Y-%m").date()
+        fim = (pd.Timestamp(inicio) + pd.offsets.MonthEnd(0)).date()
+        return inicio, fim, inicio.strftime("%m/%Y")
+    inicio = date.fromisoformat(args.inicio) if args.inicio else dims["data_min"]
+    fim = date.fromisoformat(args.fim) if args.fim else dims["data_max"]
+    return inicio, fim, f"{inicio} até {fim}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--por", choices=list(app.DIMENSOES_LOTE), default="unidade", help="Um relatório por valor desta coluna")
+    parser.add_argument("--mes", help="Mês do relatório (AAAA-MM); tem prioridade sobre --inicio/--fim")
+    parser.add_argument("--inicio", help="Data inicial (AAAA-MM-DD); padrão: início dos dados")
+    parser.add_argument("--fim", help="Data final (AAAA-MM-DD); padrão: fim dos dados")
+    parser.add_argument("--foco", default="", help="Foco / perguntas dos gestores, incluído em todos os relatórios")
+    parser.add_argument("--modelo", default="gpt-4o-mini")
+    parser.add_argument("--temperature", type=float, default=0.2)
+    parser.add_argument("--orcamento-tokens", type=int, default=app.INSIGHTS_ORCAMENTO_TOKENS,
+                        help="Orçamento de tokens do contexto de dados de cada relatório")
+    parser.add_argument("--max-concorrencia", type=int, default=app.LOTE_MAX_CONCORRENCIA)
+    parser.add_argument("--max-por-minuto", type=int, default=app.LOTE_MAX_POR_MINUTO)
+    parser.add_argument("--pdf-workers", type=int, default=app.LOTE_PDF_WORKERS)
+    parser.add_argument("--forcar", action="store_true", help="Ignora relatórios já em cache")
+    parser.add_argument("--saida", help="Arquivo zip de saída; padrão: relatorios_<dimensao>_<periodo>.zip")
+    args = parser.parse_args()
+
+    dimensoes = app.carregar_dimensoes()
+    if dimensoes is None:
+        print("Não foi possível carregar os dados (veja a seção 'Estrutura de Arquivos' do README).", file=sys.stderr)
+        return 1
+
+    api_key = app._get_openai_api_key()
+    if not app.ia_disponivel(api_key):
+        print("Configure OPENAI_API_KEY (ou INSIGHTS_FAKE_LLM=1 para um teste local).", file=sys.stderr)
+        return 1
+
+    dims = dimensoes["atendimentos"]
+    inicio, fim, periodo_label = _periodo(args, dims)
+    # Com o dataset particionado, só os meses do período são lidos
+    data = app.load_data(inicio, fim)
+    df = data["atendimentos"]
+    filtros = {
+        "data_min": inicio,
+        "data_max": fim,
+        "diagnosticos": dims["opcoes"]["diagnostico_vigente"],
+        "unidades": dims["opcoes"]["unidade"],
+        "profissionais": dims["opcoes"]["profissional_atendimento"],
+        "paciente_busca": "",
+        "paciente_exato": False,
+    }
+
+    t0 = time.perf_counter()
+    itens = app.preparar_lote(
+        df, filtros, data["versao"], None, args.por, periodo_label, args.foco,
+        orcamento_tokens=args.orcamento_tokens, model=args.modelo,
+    )
+    if not itens:
+        print("Nenhum dado no período informado.")
+        return 0
+    print(f"{len(itens)} relatórios por {app.DIMENSOES_LOTE[args.por][1].lower()} ({periodo_label}); "
+          f"contextos em {time.perf_counter() - t0:.1f} s")
+
+    prompt_template = app.compactar_prompt(app._read_text_file("prompt_insights.md"))
+    custo = sum(
+        app.estimar_custo(prompt_template, item, args.modelo)['custo_usd'] for item in itens
+    )
+    print(f"Estimativa: {sum(item['tokens'] for item in itens):,} tokens de contexto · custo ≈ US$ {custo:.4f}")
+
+    saida = args.saida or f"relatorios_{args.por}_{inicio:%Y%m%d}_{fim:%Y%m%d}.zip"
+
+    def progresso(fracao: float, mensagem: str = ""):
+        print(f"  [{fracao:>4.0%}] {mensagem}")
+
+    t1 = time.perf_counter()
+    resultado = app.gerar_lote_zip(
+        itens,
+        saida,
+        prompt_template=prompt_template,
+        api_key=api_key,
+        model=args.modelo,
+        temperature=args.temperature,
+        forcar=args.forcar,
+        max_concorrencia=args.max_concorrencia,
+        max_por_minuto=args.max_por_minuto,
+        pdf_workers=args.pdf_workers,
+        usar_processos=True,
+        progresso=progresso,
+    )
+    print(f"{saida}: {resultado['gerados']} relatórios ({resultado['do_cache']} do cache) "
+          f"em {time.perf_counter() - t1:.1f} s")
+    stats = app.get_llm_pool().stats()
+    if stats["chamadas"]:
+        print(f"IA ({app.provedor_ia_ativo()}): {stats['chamadas']} chamadas, {stats['retries']} retries, "
+              f"{stats['erros']} erros · latência p50 {stats['latencia_p50_s'] or 0:.1f} s / "
+              f"p95 {stats['latencia_p95_s'] or 0:.1f} s")
+    for valor, erro in resultado["erros"].items():
+        print(f"  erro em {valor}: {erro}", file=sys.stderr)
+    return 1 if resultado["erros"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
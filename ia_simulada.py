@@ -0,0 +1,49 @@
+"""
+Cliente simulado da IA, com a mesma interface de `client.chat.completions.create` do SDK da
+OpenAI, para usar sem rede: provedor "simulado" do dashboard (INSIGHTS_FAKE_LLM=1), respostas
+do servidor_llm_local.py e testes.
+"""
+import time
+from types import SimpleNamespace
+
+
+class ErroSimulado(Exception):
+    """Erro transitório do FakeStreamingClient (mesmo `status_code` de um rate limit da API)."""
+    status_code = 429
+
+
+class FakeStreamingClient:
+    """
+    Cliente local com a mesma interface de `client.chat.completions.create` (com e sem
+    `stream=True`), sem rede. Devolve um relatório sintético a partir do contexto recebido,
+    em pedaços com atraso configurável. Ativado com INSIGHTS_FAKE_LLM=1.
+    """
+
+    def __init__(self, atraso: float = 0.02, tamanho_pedaco: int = 24, falhas: int = 0):
+        self.atraso = atraso
+        self.tamanho_pedaco = tamanho_pedaco
+        self.falhas = falhas  # as primeiras `falhas` chamadas respondem com rate limit (429)
+        self.chamadas = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def _relatorio(self, messages: list) -> str:
+        contexto = messages[-1]["content"]
+        kpis = [linha for linha in contexto.splitlines() if linha.startswith("- ")]
+        return "\n".join(
+            ["# Relatório de Insights (simulado)", "", "## Resumo dos dados recebidos", *kpis, "",
+             "## Observações", "- Relatório gerado localmente, sem chamada à IA."]
+        )
+
+    def create(self, model: str, temperature: float, messages: list, stream: bool = False, **kwargs):
+        self.chamadas += 1
+        if self.chamadas <= self.falhas:
+            raise ErroSimulado("Rate limit simulado")
+        texto = self._relatorio(messages)
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=texto))])
+
+        def _chunks():
+            for i in range(0, len(texto), self.tamanho_pedaco):
+                time.sleep(self.atraso)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=texto[i:i + self.tamanho_pedaco]))])
+        return _chunks()
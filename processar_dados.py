@@ -1,9 +1,22 @@
+import argparse
+import os
+import shutil
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import warnings
+from dados_comuns import (
+    COLUNAS_CHAVES_TEMPO, DIMENSOES_ATENDIMENTOS, DIMENSOES_AVALIACOES, DIRETORIO_PARTICIONADO,
+    adicionar_chaves_tempo, calcular_metricas_qa, gravar_dataset_particionado,
+)
+from etapas_pipeline import MOTORES_PIPELINE, executar_etapas, motor_disponivel
 warnings.filterwarnings('ignore')
 
+parser = argparse.ArgumentParser(description="Processa avaliacoes-atendimentos.xlsx e gera os arquivos do dashboard.")
+parser.add_argument('--motor', choices=MOTORES_PIPELINE, default='pandas',
+                    help="Motor das etapas de padronização, vigência e cruzamento (padrão: pandas)")
+MOTOR = parser.parse_args().motor
+
 print("=" * 80)
 print("PROCESSAMENTO DE DADOS - ATENDIMENTOS POR DIAGNÓSTICO")
 print("=" * 80)
@@ -22,213 +35,60 @@ print(f"  - Avaliações: {len(df_avaliacoes_raw)} registros")
 print(f"  - Atendimentos: {len(df_atendimentos_raw)} registros")
 
 # ============================================================================
-# 2. PADRONIZAÇÃO - AVALIAÇÕES
+# 2 A 6. PADRONIZAÇÃO, EMPATES, VIGÊNCIA E CRUZAMENTO (MOTOR PANDAS OU POLARS)
 # ============================================================================
-print("\n[2/8] Padronizando dados de avaliações...")
-
-df_avaliacoes = df_avaliacoes_raw.copy()
-
-# Padronizar nomes de colunas
-df_avaliacoes.columns = df_avaliacoes.columns.str.strip()
-df_avaliacoes = df_avaliacoes.rename(columns={
-    'Data': 'data_avaliacao',
-    'Profissional': 'profissional_avaliacao',
-    'Paciente': 'paciente_id',
-    'Diagnóstico': 'diagnostico'
-})
-
-# Tratar datas
-df_avaliacoes['data_avaliacao'] = pd.to_datetime(df_avaliacoes['data_avaliacao'], errors='coerce')
-df_avaliacoes['data_avaliacao_raw'] = df_avaliacoes_raw['Data'].copy()
-
-# Normalizar diagnóstico (trim, case, etc)
-df_avaliacoes['diagnostico'] = df_avaliacoes['diagnostico'].astype(str).str.strip()
-df_avaliacoes['diagnostico'] = df_avaliacoes['diagnostico'].str.title()  # Primeira letra maiúscula
-df_avaliacoes['diagnostico_raw'] = df_avaliacoes_raw['Diagnóstico'].copy()
+# Regras (iguais nos dois motores, ver etapas_pipeline.py):
+# - nomes de colunas, datas, textos (trim; diagnóstico em Title Case) e ids padronizados;
+#   linhas sem paciente/data (ou sem diagnóstico, nas avaliações) descartadas
+# - empates (várias avaliações do paciente no mesmo dia): mantém a última (maior avaliacao_id)
+# - vigência: de cada avaliação até a próxima do mesmo paciente (a última fica aberta)
+# - cruzamento: vale o diagnóstico da vigência com inicio <= data do atendimento < fim
+# - unidade da avaliação: atendimento do mesmo paciente com data mais próxima
+if MOTOR == 'polars' and not motor_disponivel('polars'):
+    print("\n  [AVISO] polars não instalado; usando o motor pandas")
+    MOTOR = 'pandas'
 
-# Normalizar profissional
-df_avaliacoes['profissional_avaliacao'] = df_avaliacoes['profissional_avaliacao'].astype(str).str.strip()
-df_avaliacoes['profissional_avaliacao_raw'] = df_avaliacoes_raw['Profissional'].copy()
+etapas = executar_etapas(df_avaliacoes_raw, df_atendimentos_raw, motor=MOTOR)
+df_avaliacoes = etapas['avaliacoes']
+df_atendimentos = etapas['atendimentos']
+df_vigencia = etapas['vigencia']
+df_atendimentos_com_diag = etapas['atendimentos_com_diag']
 
-# Normalizar paciente
-df_avaliacoes['paciente_id'] = df_avaliacoes['paciente_id'].astype(str).str.strip()
-df_avaliacoes['paciente_id_raw'] = df_avaliacoes_raw['Paciente'].copy()
-
-# Criar ID de avaliação (se não existir)
-if 'avaliacao_id' not in df_avaliacoes.columns:
-    df_avaliacoes['avaliacao_id'] = range(1, len(df_avaliacoes) + 1)
-
-# Remover linhas com dados essenciais faltando
-df_avaliacoes = df_avaliacoes.dropna(subset=['paciente_id', 'data_avaliacao', 'diagnostico'])
-df_avaliacoes = df_avaliacoes[df_avaliacoes['paciente_id'] != 'nan']
-df_avaliacoes = df_avaliacoes[df_avaliacoes['diagnostico'] != 'nan']
-
-print(f"  - Avaliações válidas após limpeza: {len(df_avaliacoes)}")
+print("\n[2/8] Padronizando dados de avaliações...")
+print(f"  - Avaliações válidas após limpeza: {etapas['avaliacoes_validas']}")
 
-# ============================================================================
-# 3. PADRONIZAÇÃO - ATENDIMENTOS
-# ============================================================================
 print("\n[3/8] Padronizando dados de atendimentos...")
-
-df_atendimentos = df_atendimentos_raw.copy()
-
-# Padronizar nomes de colunas
-df_atendimentos.columns = df_atendimentos.columns.str.strip()
-df_atendimentos = df_atendimentos.rename(columns={
-    'Data': 'data_atendimento',
-    'Paciente': 'paciente_id',
-    'Profissional ': 'profissional_atendimento',
-    'Profissional': 'profissional_atendimento',  # Caso não tenha espaço
-    'Unidade': 'unidade'
-})
-
-# Tratar datas
-df_atendimentos['data_atendimento'] = pd.to_datetime(df_atendimentos['data_atendimento'], errors='coerce')
-df_atendimentos['data_atendimento_raw'] = df_atendimentos_raw['Data'].copy()
-
-# Normalizar profissional
-df_atendimentos['profissional_atendimento'] = df_atendimentos['profissional_atendimento'].astype(str).str.strip()
-if 'Profissional ' in df_atendimentos_raw.columns:
-    df_atendimentos['profissional_atendimento_raw'] = df_atendimentos_raw['Profissional '].copy()
-else:
-    df_atendimentos['profissional_atendimento_raw'] = df_atendimentos_raw['Profissional'].copy()
-
-# Normalizar unidade
-df_atendimentos['unidade'] = df_atendimentos['unidade'].astype(str).str.strip()
-df_atendimentos['unidade_raw'] = df_atendimentos_raw['Unidade'].copy()
-
-# Normalizar paciente
-df_atendimentos['paciente_id'] = df_atendimentos['paciente_id'].astype(str).str.strip()
-df_atendimentos['paciente_id_raw'] = df_atendimentos_raw['Paciente'].copy()
-
-# Criar ID de atendimento (se não existir)
-if 'atendimento_id' not in df_atendimentos.columns:
-    df_atendimentos['atendimento_id'] = range(1, len(df_atendimentos) + 1)
-
-# Remover linhas com dados essenciais faltando
-df_atendimentos = df_atendimentos.dropna(subset=['paciente_id', 'data_atendimento'])
-df_atendimentos = df_atendimentos[df_atendimentos['paciente_id'] != 'nan']
-
 print(f"  - Atendimentos válidos após limpeza: {len(df_atendimentos)}")
 
-# ============================================================================
-# 4. TRATAR EMPATES - MÚLTIPLAS AVALIAÇÕES NO MESMO DIA
-# ============================================================================
 print("\n[4/8] Tratando empates (múltiplas avaliações no mesmo dia)...")
-
-# Ordenar avaliações por paciente, data e avaliacao_id
-df_avaliacoes = df_avaliacoes.sort_values(['paciente_id', 'data_avaliacao', 'avaliacao_id'])
-
-# Identificar duplicatas no mesmo dia
-duplicatas = df_avaliacoes.groupby(['paciente_id', 'data_avaliacao']).size()
-duplicatas = duplicatas[duplicatas > 1]
-
-if len(duplicatas) > 0:
-    print(f"  - Encontradas {len(duplicatas)} combinações paciente+data com múltiplas avaliações")
-    print(f"  - Total de avaliações duplicadas: {duplicatas.sum() - len(duplicatas)}")
+if etapas['combinacoes_empate'] > 0:
+    print(f"  - Encontradas {etapas['combinacoes_empate']} combinações paciente+data com múltiplas avaliações")
+    print(f"  - Total de avaliações duplicadas: {etapas['empates_removidos']}")
     print("  - Regra aplicada: manter a última avaliação do dia (maior avaliacao_id)")
-    
-    # Manter apenas a última avaliação do dia (maior avaliacao_id)
-    df_avaliacoes = df_avaliacoes.drop_duplicates(
-        subset=['paciente_id', 'data_avaliacao'],
-        keep='last'
-    )
     print(f"  - Avaliações após remoção de duplicatas: {len(df_avaliacoes)}")
 else:
     print("  - Nenhuma duplicata encontrada")
 
-# ============================================================================
-# 5. CRIAR INTERVALOS DE VIGÊNCIA
-# ============================================================================
 print("\n[5/8] Criando intervalos de vigência dos diagnósticos...")
-
-# Ordenar avaliações por paciente e data
-df_avaliacoes = df_avaliacoes.sort_values(['paciente_id', 'data_avaliacao', 'avaliacao_id'])
-
-vigencia_list = []
-
-for paciente in df_avaliacoes['paciente_id'].unique():
-    aval_paciente = df_avaliacoes[df_avaliacoes['paciente_id'] == paciente].copy()
-    aval_paciente = aval_paciente.sort_values(['data_avaliacao', 'avaliacao_id'])
-    
-    for idx, row in aval_paciente.iterrows():
-        inicio_diag = row['data_avaliacao']
-        
-        # Fim é a próxima avaliação do mesmo paciente
-        proxima_aval = aval_paciente[aval_paciente['data_avaliacao'] > inicio_diag]
-        if len(proxima_aval) > 0:
-            fim_diag = proxima_aval.iloc[0]['data_avaliacao']
-        else:
-            fim_diag = None  # Última avaliação - vigência aberta
-        
-        vigencia_list.append({
-            'paciente_id': paciente,
-            'inicio_diag': inicio_diag,
-            'fim_diag': fim_diag,
-            'diagnostico': row['diagnostico'],
-            'profissional_avaliacao': row['profissional_avaliacao'],
-            'avaliacao_id': row['avaliacao_id']
-        })
-
-df_vigencia = pd.DataFrame(vigencia_list)
 print(f"  - Intervalos de vigência criados: {len(df_vigencia)}")
 
-# ============================================================================
-# 6. CRUZAR ATENDIMENTOS COM DIAGNÓSTICOS VIGENTES
-# ============================================================================
 print("\n[6/8] Cruzando atendimentos com diagnósticos vigentes...")
 
-atendimentos_com_diag = []
-
-for idx, atend in df_atendimentos.iterrows():
-    paciente = atend['paciente_id']
-    data_atend = atend['data_atendimento']
-    
-    # Buscar vigências do paciente
-    vig_paciente = df_vigencia[df_vigencia['paciente_id'] == paciente].copy()
-    
-    diagnostico_vigente = None
-    data_avaliacao_origem = None
-    profissional_avaliacao_origem = None
-    
-    # Encontrar diagnóstico vigente
-    for idx_vig, vig in vig_paciente.iterrows():
-        inicio = vig['inicio_diag']
-        fim = vig['fim_diag']
-        
-        # Regra: inicio <= data_atendimento < fim (ou fim é None para última avaliação)
-        if pd.isna(fim):
-            # Última avaliação - vigência aberta
-            if data_atend >= inicio:
-                diagnostico_vigente = vig['diagnostico']
-                data_avaliacao_origem = vig['inicio_diag']
-                profissional_avaliacao_origem = vig['profissional_avaliacao']
-                break
-        else:
-            # Avaliação intermediária
-            if inicio <= data_atend < fim:
-                diagnostico_vigente = vig['diagnostico']
-                data_avaliacao_origem = vig['inicio_diag']
-                profissional_avaliacao_origem = vig['profissional_avaliacao']
-                break
-    
-    atendimentos_com_diag.append({
-        'atendimento_id': atend['atendimento_id'],
-        'paciente_id': paciente,
-        'data_atendimento': data_atend,
-        'profissional_atendimento': atend['profissional_atendimento'],
-        'unidade': atend['unidade'],
-        'diagnostico_vigente': diagnostico_vigente if diagnostico_vigente else 'SEM DIAGNÓSTICO',
-        'data_avaliacao_origem': data_avaliacao_origem,
-        'profissional_avaliacao_origem': profissional_avaliacao_origem
-    })
-
-df_atendimentos_com_diag = pd.DataFrame(atendimentos_com_diag)
+# Chaves inteiras de tempo (dia, semana, mês, ano) materializadas uma única vez
+df_atendimentos_com_diag = adicionar_chaves_tempo(df_atendimentos_com_diag, 'data_atendimento')
+df_avaliacoes = adicionar_chaves_tempo(df_avaliacoes, 'data_avaliacao')
 
 sem_diag = len(df_atendimentos_com_diag[df_atendimentos_com_diag['diagnostico_vigente'] == 'SEM DIAGNÓSTICO'])
 print(f"  - Atendimentos com diagnóstico: {len(df_atendimentos_com_diag) - sem_diag}")
 print(f"  - Atendimentos sem diagnóstico: {sem_diag}")
 
+# Unidade da avaliação: atendimento do mesmo paciente com data mais próxima (as-of join)
+contagem_atribuicao = df_avaliacoes['unidade_atribuicao'].value_counts()
+print(f"  - Unidade das avaliações: {contagem_atribuicao.get('mesmo dia', 0)} no mesmo dia, "
+      f"{contagem_atribuicao.get('atendimento mais próximo', 0)} pelo atendimento mais próximo, "
+      f"{contagem_atribuicao.get('sem atendimento', 0)} sem atendimento")
+print(f"  - Etapas 2 a 6 em {etapas['tempo_s']:.2f} s (motor {MOTOR})")
+
 # ============================================================================
 # 7. GERAR RESUMOS
 # ============================================================================
@@ -268,66 +128,20 @@ print(f"  - Resumo por diagnóstico × unidade × profissional: {len(df_resumo_d
 # ============================================================================
 print("\n[8/8] Gerando relatório de QA...")
 
-qa_items = []
-
-# 1. Pacientes sem nenhuma avaliação
-pacientes_atendimentos = set(df_atendimentos['paciente_id'].unique())
-pacientes_avaliacoes = set(df_avaliacoes['paciente_id'].unique())
-pacientes_sem_avaliacao = pacientes_atendimentos - pacientes_avaliacoes
-qa_items.append({
-    'Categoria': 'Pacientes sem avaliação',
-    'Quantidade': len(pacientes_sem_avaliacao),
-    'Detalhes': f"Pacientes que têm atendimentos mas não têm avaliações: {len(pacientes_sem_avaliacao)}"
-})
-
-# 2. Atendimentos sem paciente_id ou data
-atend_sem_paciente = len(df_atendimentos_raw[df_atendimentos_raw['Paciente'].isna()])
-atend_sem_data = len(df_atendimentos_raw[df_atendimentos_raw['Data'].isna()])
-qa_items.append({
-    'Categoria': 'Atendimentos com dados faltando (antes da limpeza)',
-    'Quantidade': atend_sem_paciente + atend_sem_data,
-    'Detalhes': f"Sem paciente: {atend_sem_paciente}, Sem data: {atend_sem_data}"
-})
-
-# 3. Duplicatas de atendimentos
-chave_atend = df_atendimentos.groupby(['paciente_id', 'data_atendimento', 'profissional_atendimento', 'unidade']).size()
-duplicatas_atend = chave_atend[chave_atend > 1]
-qa_items.append({
-    'Categoria': 'Atendimentos duplicados (mesma chave)',
-    'Quantidade': len(duplicatas_atend),
-    'Detalhes': f"Combinações paciente+data+profissional+unidade duplicadas: {len(duplicatas_atend)}"
-})
-
-# 4. Avaliações duplicadas no mesmo dia (já tratadas)
-qa_items.append({
-    'Categoria': 'Avaliações no mesmo dia (tratadas)',
-    'Quantidade': len(duplicatas) if len(duplicatas) > 0 else 0,
-    'Detalhes': f"Regra aplicada: manter última avaliação do dia (maior avaliacao_id)"
-})
-
-# 5. Atendimentos sem diagnóstico
-qa_items.append({
-    'Categoria': 'Atendimentos sem diagnóstico vigente',
-    'Quantidade': sem_diag,
-    'Detalhes': f"Atendimentos que ocorreram antes da primeira avaliação do paciente"
-})
-
-# 6. Verificação de datas
-data_min_aval = df_avaliacoes['data_avaliacao'].min()
-data_max_aval = df_avaliacoes['data_avaliacao'].max()
-data_min_atend = df_atendimentos['data_atendimento'].min()
-data_max_atend = df_atendimentos['data_atendimento'].max()
-
-atend_antes_primeira_aval = len(df_atendimentos[df_atendimentos['data_atendimento'] < data_min_aval])
-atend_muito_posterior = len(df_atendimentos[df_atendimentos['data_atendimento'] > data_max_aval + pd.Timedelta(days=365)])
-
-qa_items.append({
-    'Categoria': 'Verificação de datas',
-    'Quantidade': atend_antes_primeira_aval + atend_muito_posterior,
-    'Detalhes': f"Atendimentos antes da primeira avaliação: {atend_antes_primeira_aval}. Atendimentos muito posteriores (>1 ano): {atend_muito_posterior}"
-})
-
-df_qa = pd.DataFrame(qa_items)
+# Métricas consolidadas (aba QA) e registros envolvidos em cada verificação
+# (aba QA_Ocorrencias), usados pelo dashboard para detalhar sob demanda
+atend_sem_paciente = int(df_atendimentos_raw['Paciente'].isna().sum())
+atend_sem_data = int(df_atendimentos_raw['Data'].isna().sum())
+
+df_qa, df_qa_ocorrencias = calcular_metricas_qa(
+    df_atendimentos_com_diag,
+    df_avaliacoes,
+    avaliacoes_mesmo_dia=etapas['combinacoes_empate'],
+    faltantes={'Sem paciente': atend_sem_paciente, 'Sem data': atend_sem_data},
+)
+for _, item in df_qa.iterrows():
+    print(f"  - {item['Categoria']}: {item['Quantidade']}")
+print(f"  - Ocorrências registradas para detalhamento: {len(df_qa_ocorrencias)}")
 
 # ============================================================================
 # 9. EXPORTAR PARA EXCEL
@@ -340,7 +154,8 @@ with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
     # Aba 1: Base_Avaliacoes_Limpa
     cols_aval = ['avaliacao_id', 'paciente_id', 'data_avaliacao', 'diagnostico', 
                  'profissional_avaliacao', 'paciente_id_raw', 'data_avaliacao_raw', 
-                 'diagnostico_raw', 'profissional_avaliacao_raw']
+                 'diagnostico_raw', 'profissional_avaliacao_raw', 'unidade',
+                 'unidade_atribuicao'] + COLUNAS_CHAVES_TEMPO
     df_avaliacoes[cols_aval].to_excel(writer, sheet_name='Base_Avaliacoes_Limpa', index=False)
     
     # Aba 2: Base_Atendimentos_Limpa
@@ -369,6 +184,9 @@ with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
     
     # Aba 9: QA
     df_qa.to_excel(writer, sheet_name='QA', index=False)
+    
+    # Aba 10: QA_Ocorrencias (ids dos registros de cada verificação)
+    df_qa_ocorrencias.to_excel(writer, sheet_name='QA_Ocorrencias', index=False)
 
 print(f"  [OK] Arquivo gerado: {output_file}")
 
@@ -389,6 +207,43 @@ with pd.ExcelWriter('Resumos.xlsx', engine='openpyxl') as writer:
 
 print("  [OK] Resumos.xlsx")
 
+# ============================================================================
+# 11. DATASET PARTICIONADO (PARQUET POR ANO/MÊS + MANIFESTO)
+# ============================================================================
+# O dashboard lê só as partições do período filtrado. Particionar também por unidade
+# ajuda quando há muitas unidades e os recortes costumam ser de uma só.
+PARTICIONAR_POR_UNIDADE = False
+
+print("\n[11/11] Exportando dataset particionado (Parquet)...")
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+    print("  [AVISO] pyarrow não instalado; dataset particionado não gerado (o dashboard usa o Excel)")
+    if os.path.isdir(DIRETORIO_PARTICIONADO):
+        # Um dataset de execução anterior teria prioridade sobre o Excel recém-gerado no dashboard
+        shutil.rmtree(DIRETORIO_PARTICIONADO)
+        print(f"  [AVISO] {DIRETORIO_PARTICIONADO}/ anterior removido (desatualizado)")
+
+if pyarrow is not None:
+    manifesto = gravar_dataset_particionado(
+        tabelas={
+            'atendimentos': (df_atendimentos_com_diag, 'data_atendimento', DIMENSOES_ATENDIMENTOS),
+            'avaliacoes': (df_avaliacoes[cols_aval], 'data_avaliacao', DIMENSOES_AVALIACOES),
+        },
+        inteiras={
+            'resumo_diag': df_resumo_diag,
+            'resumo_diag_unidade': df_resumo_diag_unidade,
+            'resumo_diag_prof': df_resumo_diag_prof,
+            'qa': df_qa,
+            'qa_ocorrencias': df_qa_ocorrencias,
+        },
+        diretorio=DIRETORIO_PARTICIONADO,
+        por_unidade=PARTICIONAR_POR_UNIDADE,
+    )
+    for nome, entrada in manifesto['tabelas'].items():
+        print(f"  [OK] {nome}: {len(entrada['particoes'])} partições, {entrada['linhas']} linhas")
+
 print("\n" + "=" * 80)
 print("PROCESSAMENTO CONCLUÍDO COM SUCESSO!")
 print("=" * 80)
@@ -396,3 +251,5 @@ print(f"\nArquivos gerados:")
 print(f"  - {output_file}")
 print(f"  - Atendimentos_Com_Diagnostico.csv")
 print(f"  - Resumos.xlsx")
+if pyarrow is not None:
+    print(f"  - {DIRETORIO_PARTICIONADO}/ (manifest.json + Parquet por ano/mês)")
@@ -0,0 +1,96 @@
+"""
+Servidor local compatível com a API de chat da OpenAI (POST /v1/chat/completions), para
+testar o dashboard e o gerar_relatorios.py sem rede: timeouts, retries, streaming e
+reaproveitamento de conexões. As respostas são as do FakeStreamingClient.
+
+Uso:
+    python servidor_llm_local.py --porta 8001 [--atraso 0.02] [--taxa-429 0.2]
+    INSIGHTS_LLM_PROVIDER=compativel INSIGHTS_LLM_BASE_URL=http://127.0.0.1:8001/v1 streamlit run app.py
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ia_simulada import FakeStreamingClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # mantém a conexão aberta entre requisições (keep-alive)
+    gerador = FakeStreamingClient(atraso=0)
+    atraso = 0.02
+    taxa_429 = 0.0
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _json(self, status: int, corpo: dict, headers: dict = None):
+        dados = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _trecho(self, dados: bytes):
+        # Transfer-Encoding: chunked, para o streaming não fechar a conexão
+        self.wfile.write(f"{len(dados):x}\r\n".encode("ascii") + dados + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._json(404, {"error": {"message": f"rota desconhecida: {self.path}"}})
+            return
+        if random.random() < self.taxa_429:
+            self._json(429, {"error": {"message": "Rate limit simulado", "type": "rate_limit"}}, {"Retry-After": "1"})
+            return
+
+        texto = self.gerador._relatorio(corpo.get("messages", []))
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": corpo.get("model", "local")}
+        if not corpo.get("stream"):
+            self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tamanho = self.gerador.tamanho_pedaco
+        for i in range(0, len(texto), tamanho):
+            time.sleep(self.atraso)
+            evento = {**base, "object": "chat.completion.chunk",
+                      "choices": [{"index": 0, "delta": {"content": texto[i:i + tamanho]}, "finish_reason": None}]}
+            self._trecho(f"data: {json.dumps(evento)}\n\n".encode("utf-8"))
+        self._trecho(b"data: [DONE]\n\n")
+        self._trecho(b"")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8001)
+    parser.add_argument("--atraso", type=float, default=0.02, help="Segundos entre os trechos do streaming")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="Fração das requisições respondidas com rate limit")
+    args = parser.parse_args()
+
+    _Handler.atraso = args.atraso
+    _Handler.taxa_429 = args.taxa_429
+    servidor = ThreadingHTTPServer((args.host, args.porta), _Handler)
+    print(f"Servidor local em http://{args.host}:{args.porta}/v1 (Ctrl+C para parar)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
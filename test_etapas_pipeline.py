@@ -0,0 +1,104 @@
+"""
+Os dois motores do processar_dados.py (pandas e Polars) devem gerar as mesmas tabelas e
+contagens. Fixtures pequenas cobrem os casos em que eles já divergiram: nulos, empates no
+mesmo dia, atendimentos equidistantes, IDs com tipos misturados e datas em texto.
+
+    python -m pytest -q test_etapas_pipeline.py
+"""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from etapas_pipeline import MOTORES_PIPELINE, comparar_motores_pipeline, executar_etapas, motor_disponivel
+
+MOTORES = [m for m in MOTORES_PIPELINE if motor_disponivel(m)]
+
+
+def _planilhas(avaliacoes: list, atendimentos: list):
+    """Listas de tuplas -> DataFrames no formato das abas do Excel (colunas como na planilha)."""
+    df_aval = pd.DataFrame(avaliacoes, columns=['Data', 'Profissional', 'Paciente', 'Diagnóstico'], dtype=object)
+    df_atend = pd.DataFrame(atendimentos, columns=['Data', 'Paciente', 'Profissional ', 'Unidade'], dtype=object)
+    return df_aval, df_atend
+
+
+CENARIOS = {
+    'nulos em profissional e unidade': _planilhas(
+        [(datetime(2024, 1, 10), None, 'Ana', 'tea'), (datetime(2024, 2, 1), 'Dra. B', 'Ana', None)],
+        [(datetime(2024, 1, 11), 'Ana', None, 'Jardins'), (datetime(2024, 1, 12), 'Ana', 'Dr. C', None),
+         (datetime(2024, 1, 9), 'Bruno', 'Dr. C', 'Centro')],
+    ),
+    'empates no mesmo dia': _planilhas(
+        [(datetime(2024, 3, 1), 'Dra. A', 'Ana', 'tea'), (datetime(2024, 3, 1), 'Dra. B', 'Ana', 'tdah'),
+         (datetime(2024, 3, 1), 'Dra. C', 'Ana', 'tod'), (datetime(2024, 4, 1), 'Dra. A', 'Ana', 'tea')],
+        [(datetime(2024, 3, 2), 'Ana', 'Dr. X', 'Centro'), (datetime(2024, 4, 2), 'Ana', 'Dr. X', 'Centro')],
+    ),
+    'atendimentos equidistantes': _planilhas(
+        [(datetime(2024, 5, 28), 'Dra. A', 'Ana', 'tea')],
+        [(datetime(2024, 5, 26), 'Ana', 'Dr. X', 'Vila Mariana'), (datetime(2024, 5, 30), 'Ana', 'Dr. X', 'Jardins'),
+         (datetime(2024, 5, 30), 'Ana', 'Dr. Y', 'Centro')],
+    ),
+    'IDs com tipos misturados': _planilhas(
+        [(datetime(2024, 1, 5), 'Dra. A', 123, 'tea'), (datetime(2024, 2, 5), 'Dra. A', '123', 'tdah'),
+         (datetime(2024, 1, 5), 'Dra. A', ' Ana ', 'tea')],
+        [(datetime(2024, 1, 20), 123, 'Dr. X', 'Centro'), (datetime(2024, 2, 20), '123 ', 'Dr. X', 'Centro'),
+         (datetime(2024, 1, 20), 'Ana', 'Dr. X', 'Centro')],
+    ),
+    'datas em texto': _planilhas(
+        [('13/02/2024', 'Dra. A', 'Ana', 'tea'), ('2024-03-01', 'Dra. A', 'Ana', 'tdah'),
+         (datetime(2024, 4, 1), 'Dra. A', 'Ana', 'tod'), ('data inválida', 'Dra. A', 'Ana', 'tea')],
+        [('14/02/2024', 'Ana', 'Dr. X', 'Centro'), (datetime(2024, 3, 2), 'Ana', 'Dr. X', 'Centro'),
+         (' 02/04/2024 10:30:00 ', 'Ana', 'Dr. X', 'Centro'), (None, 'Ana', 'Dr. X', 'Centro')],
+    ),
+}
+
+
+@pytest.mark.skipif(len(MOTORES) < 2, reason="Polars não instalado")
+@pytest.mark.parametrize('cenario', list(CENARIOS))
+def test_motores_geram_tabelas_e_contagens_identicas(cenario):
+    df_aval, df_atend = CENARIOS[cenario]
+    comparacao = comparar_motores_pipeline(df_aval, df_atend, MOTORES)
+    assert comparacao['diferencas'] == {}
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_empate_no_mesmo_dia_mantem_a_ultima_avaliacao(motor):
+    etapas = executar_etapas(*CENARIOS['empates no mesmo dia'], motor)
+    assert (etapas['avaliacoes_validas'], etapas['combinacoes_empate'], etapas['empates_removidos']) == (4, 1, 2)
+    assert etapas['avaliacoes']['diagnostico'].tolist() == ['Tod', 'Tea']
+    assert etapas['atendimentos_com_diag']['diagnostico_vigente'].tolist() == ['Tod', 'Tea']
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_atendimentos_equidistantes_ficam_com_o_anterior(motor):
+    avaliacoes = executar_etapas(*CENARIOS['atendimentos equidistantes'], motor)['avaliacoes']
+    assert avaliacoes[['unidade', 'unidade_atribuicao']].values.tolist() == [['Vila Mariana', 'atendimento mais próximo']]
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_nulos_em_profissional_e_unidade(motor):
+    etapas = executar_etapas(*CENARIOS['nulos em profissional e unidade'], motor)
+    assert etapas['avaliacoes_validas'] == 1  # a avaliação sem diagnóstico é descartada
+    assert etapas['atendimentos']['profissional_atendimento'].isna().tolist() == [True, False, False]
+    # o atendimento sem unidade não conta para a unidade da avaliação
+    assert etapas['avaliacoes']['unidade'].tolist() == ['Jardins']
+    assert etapas['atendimentos_com_diag']['diagnostico_vigente'].tolist() == ['Tea', 'Tea', 'SEM DIAGNÓSTICO']
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_ids_com_tipos_misturados_sao_o_mesmo_paciente(motor):
+    etapas = executar_etapas(*CENARIOS['IDs com tipos misturados'], motor)
+    assert sorted(etapas['avaliacoes']['paciente_id']) == ['123', '123', 'Ana']
+    assert etapas['atendimentos_com_diag']['diagnostico_vigente'].tolist() == ['Tea', 'Tdah', 'Tea']
+
+
+@pytest.mark.parametrize('motor', MOTORES)
+def test_datas_em_texto_dia_mes_ano(motor):
+    etapas = executar_etapas(*CENARIOS['datas em texto'], motor)
+    assert etapas['avaliacoes']['data_avaliacao'].tolist() == [
+        pd.Timestamp(2024, 2, 13), pd.Timestamp(2024, 3, 1), pd.Timestamp(2024, 4, 1),
+    ]
+    assert etapas['atendimentos']['data_atendimento'].tolist() == [
+        pd.Timestamp(2024, 2, 14), pd.Timestamp(2024, 3, 2), pd.Timestamp(2024, 4, 2, 10, 30),
+    ]
+    assert etapas['atendimentos_com_diag']['diagnostico_vigente'].tolist() == ['Tea', 'Tdah', 'Tod']
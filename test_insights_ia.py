@@ -0,0 +1,257 @@
+"""
+Geração dos relatórios de Insights sem rede, com o cliente simulado (ia_simulada.py) e o
+servidor local compatível com a API da OpenAI (servidor_llm_local.py): pool de clientes
+(concorrência, retries, métricas), cache de respostas em disco, streaming e montagem do PDF
+em segundo plano.
+
+    python -m pytest -q test_insights_ia.py
+"""
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import app
+import servidor_llm_local
+from ia_simulada import ErroSimulado, FakeStreamingClient
+
+PROMPT = "Você é um analista."
+CONTEXTO = "## KPIs\n- Total de atendimentos: 1.234\n- Pacientes únicos: 321"
+
+
+def _pedido(**kwargs) -> dict:
+    return {'model': "modelo-teste", 'temperature': 0.2, 'messages': app._insights_messages(PROMPT, CONTEXTO), **kwargs}
+
+
+@pytest.fixture
+def servidor_local():
+    """Servidor compatível com a API da OpenAI numa porta livre; devolve (base_url, handler)."""
+    class _Handler(servidor_llm_local._Handler):
+        atraso = 0.0
+        taxa_429 = 0.0
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{servidor.server_address[1]}/v1", _Handler
+    servidor.shutdown()
+    servidor.server_close()
+
+
+class _ClienteLento(FakeStreamingClient):
+    """Cliente simulado que registra o maior número de chamadas simultâneas."""
+
+    def __init__(self, duracao: float):
+        super().__init__(atraso=0)
+        self.duracao = duracao
+        self.simultaneas = 0
+        self.pico = 0
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.simultaneas += 1
+            self.pico = max(self.pico, self.simultaneas)
+        try:
+            time.sleep(self.duracao)
+            return super().create(**kwargs)
+        finally:
+            with self._lock:
+                self.simultaneas -= 1
+
+
+def test_pool_reaproveita_o_cliente_do_provedor():
+    pool = app.LLMClientPool()
+    cliente = pool.cliente(None, provedor="simulado")
+    assert isinstance(cliente, FakeStreamingClient)
+    assert pool.cliente(None, provedor="simulado") is cliente
+    assert pool.stats()['clientes'] == 1
+
+
+def test_pool_limita_as_chamadas_simultaneas():
+    pool = app.LLMClientPool(max_concorrencia=2)
+    cliente = _ClienteLento(duracao=0.05)
+    threads = [threading.Thread(target=pool.completar, args=(None,), kwargs={'client': cliente, **_pedido()}) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = pool.stats()
+    assert cliente.pico == 2
+    assert (stats['chamadas'], stats['erros'], stats['em_andamento']) == (6, 0, 0)
+    assert stats['fila_p95_s'] >= cliente.duracao * 0.8  # parte das chamadas esperou um slot
+
+
+def test_pool_repete_rate_limit_com_espera_aleatoria_limitada():
+    esperas = []
+    pool = app.LLMClientPool(max_tentativas=4, backoff_base=1.0, backoff_max=30.0, dormir=esperas.append)
+    resposta = pool.completar(None, client=FakeStreamingClient(atraso=0, falhas=3), **_pedido())
+    assert resposta.choices[0].message.content.startswith("# Relatório de Insights (simulado)")
+    assert len(esperas) == 3
+    assert all(0 <= espera <= 2 ** tentativa for tentativa, espera in enumerate(esperas))
+    assert esperas != [1.0, 2.0, 4.0]  # "full jitter": não é o backoff exponencial fixo
+    stats = pool.stats()
+    assert (stats['retries'], stats['ultimas'][-1]['tentativas']) == (3, 4)
+
+
+def test_pool_desiste_depois_das_tentativas_e_conta_o_erro():
+    pool = app.LLMClientPool(max_tentativas=2, dormir=lambda s: None)
+    with pytest.raises(ErroSimulado):
+        pool.completar(None, client=FakeStreamingClient(atraso=0, falhas=5), **_pedido())
+    stats = pool.stats()
+    assert (stats['chamadas'], stats['erros'], stats['retries']) == (1, 1, 1)
+    assert stats['latencia_p50_s'] is None  # só chamadas bem-sucedidas entram nos percentis
+
+
+def test_pool_respeita_retry_after_do_servidor_local(servidor_local):
+    pytest.importorskip("openai")
+    base_url, handler = servidor_local
+    handler.taxa_429 = 1.0  # a primeira requisição recebe 429 com Retry-After: 1
+    esperas = []
+
+    def _dormir(segundos):
+        esperas.append(segundos)
+        handler.taxa_429 = 0.0
+
+    pool = app.LLMClientPool(backoff_max=30.0, dormir=_dormir)
+    trechos = list(pool.transmitir(None, client=app._cliente_openai("local", base_url), **_pedido()))
+    texto = "".join(c.choices[0].delta.content or "" for c in trechos if c.choices)
+    assert texto.startswith("# Relatório de Insights (simulado)")
+    assert esperas == [1.0]
+    assert pool.stats()['ultimas'][-1]['tentativas'] == 2
+
+
+def test_pool_registra_latencia_e_primeiro_trecho():
+    pool = app.LLMClientPool()
+    cliente = FakeStreamingClient(atraso=0.01, tamanho_pedaco=40)
+    pool.completar(None, client=cliente, **_pedido())
+    assert len(list(pool.transmitir(None, client=cliente, **_pedido()))) > 1
+    stats = pool.stats()
+    assert stats['chamadas'] == 2
+    assert [c['tipo'] for c in stats['ultimas']] == ['completo', 'stream']
+    assert stats['latencia_p95_s'] >= stats['latencia_p50_s'] > 0
+    assert 0 < stats['primeiro_trecho_p50_s'] <= stats['ultimas'][-1]['latencia_s']
+
+
+def _gerar(cache, cliente, contexto: str = CONTEXTO, forcar: bool = False):
+    return app.generate_insights_cached(
+        PROMPT, contexto, api_key=None, model="modelo-teste", temperature=0.2, forcar=forcar,
+        client=cliente, cache=cache, llm_pool=app.LLMClientPool(),
+    )
+
+
+def test_cache_responde_a_chamada_identica_sem_chamar_a_ia(tmp_path):
+    cache = app.AIResponseCache(str(tmp_path))
+    cliente = FakeStreamingClient(atraso=0)
+    relatorio, entrada = _gerar(cache, cliente)
+    assert entrada is None and cliente.chamadas == 1
+
+    repetido, entrada = _gerar(cache, cliente)
+    assert (repetido, entrada['resposta'], entrada['model']) == (relatorio, relatorio, "modelo-teste")
+    assert cliente.chamadas == 1
+    entrada, trechos = app.stream_insights_cached(
+        PROMPT, CONTEXTO, api_key=None, model="modelo-teste", temperature=0.2, client=cliente, cache=cache,
+    )
+    assert entrada is not None and list(trechos) == [relatorio] and cliente.chamadas == 1
+
+    _gerar(cache, cliente, contexto=CONTEXTO + "\n- Outro recorte: 1")
+    assert cliente.chamadas == 2
+    assert (cache.stats()['hits'], cache.stats()['entradas']) == (2, 2)
+
+
+def test_cache_expira_pelo_ttl(tmp_path, monkeypatch):
+    cache = app.AIResponseCache(str(tmp_path), ttl=60)
+    cliente = FakeStreamingClient(atraso=0)
+    _gerar(cache, cliente)
+    chave = cache.chave(PROMPT, CONTEXTO, "modelo-teste", 0.2, "FakeStreamingClient")
+    assert cache.get(chave) is not None
+
+    agora = time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: agora + 61)
+    assert cache.get(chave) is None
+    assert cache.stats()['entradas'] == 0  # a entrada vencida é apagada
+    monkeypatch.undo()
+
+    _, entrada = _gerar(cache, cliente)
+    assert entrada is None and cliente.chamadas == 2
+
+
+def test_cache_remove_as_entradas_menos_usadas_acima_do_limite(tmp_path):
+    cache = app.AIResponseCache(str(tmp_path))
+    cliente = FakeStreamingClient(atraso=0)
+    contextos = [f"{CONTEXTO}\n- Recorte: {i}" for i in range(3)]
+    chaves = [cache.chave(PROMPT, c, "modelo-teste", 0.2, "FakeStreamingClient") for c in contextos]
+    _gerar(cache, cliente, contextos[0])
+    _gerar(cache, cliente, contextos[1])
+    # a primeira entrada foi usada mais recentemente que a segunda
+    agora = time.time()
+    os.utime(cache._caminho(chaves[0]), (agora - 10, agora - 10))
+    os.utime(cache._caminho(chaves[1]), (agora - 20, agora - 20))
+    cache.max_bytes = 2 * os.path.getsize(cache._caminho(chaves[0])) + 16
+
+    _gerar(cache, cliente, contextos[2])
+    assert [cache.get(c) is not None for c in chaves] == [True, False, True]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_forcar_ignora_o_cache_e_substitui_a_entrada(tmp_path):
+    cache = app.AIResponseCache(str(tmp_path))
+    cliente = FakeStreamingClient(atraso=0)
+    _gerar(cache, cliente)
+    chave = cache.chave(PROMPT, CONTEXTO, "modelo-teste", 0.2, "FakeStreamingClient")
+    criado_em = cache.get(chave)['criado_em']
+
+    _, entrada = _gerar(cache, cliente, forcar=True)
+    assert entrada is None and cliente.chamadas == 2
+    assert cache.get(chave)['criado_em'] > criado_em
+    assert cache.stats()['entradas'] == 1
+
+
+def _esperar_job(jobs, job_id: str, limite_s: float = 10.0) -> dict:
+    fim = time.monotonic() + limite_s
+    while time.monotonic() < fim:
+        job = jobs.get(job_id)
+        if job['status'] in ('concluído', 'erro'):
+            return job
+        time.sleep(0.01)
+    pytest.fail(f"job {job_id} não terminou em {limite_s} s")
+
+
+def test_stream_em_ordem_e_pdf_so_depois_do_fim_fora_da_thread_do_script(tmp_path, monkeypatch):
+    cliente = FakeStreamingClient(atraso=0, tamanho_pedaco=8)
+    texto = cliente._relatorio(app._insights_messages(PROMPT, CONTEXTO))
+    jobs = app.ExportJobManager(max_workers=1, diretorio=str(tmp_path / 'exportacoes'))
+    montagens = []
+
+    def _pdf_falso(title, report_md):
+        montagens.append({'thread': threading.current_thread(), 'report_md': report_md})
+        return b"%PDF-1.4 simulado"
+
+    monkeypatch.setattr(app, '_report_md_to_pdf_bytes', _pdf_falso)
+    _, trechos = app.stream_insights_cached(
+        PROMPT, CONTEXTO, api_key=None, model="modelo-teste", temperature=0.2, client=cliente,
+        cache=app.AIResponseCache(str(tmp_path / 'ia')), llm_pool=app.LLMClientPool(),
+    )
+    resultado = {}
+    recebidos = []
+    for trecho in app.transmitir_com_pdf(trechos, "Relatório", resultado, jobs=jobs, cache=app.PDFCache(str(tmp_path / 'pdf'))):
+        recebidos.append(trecho)
+        assert 'job_pdf' not in resultado  # nada de PDF enquanto o stream não termina
+
+    assert recebidos == [texto[i:i + 8] for i in range(0, len(texto), 8)]
+    assert resultado['report_md'] == texto
+    job = _esperar_job(jobs, resultado['job_pdf'])
+    assert job['status'] == 'concluído'
+    assert len(montagens) == 1 and montagens[0]['report_md'] == texto
+    assert montagens[0]['thread'] is not threading.current_thread()
+    with open(job['caminho'], 'rb') as f:
+        assert f.read() == b"%PDF-1.4 simulado"
+
+
+def test_stream_vazio_nao_enfileira_pdf(tmp_path):
+    jobs = app.ExportJobManager(max_workers=1, diretorio=str(tmp_path / 'exportacoes'))
+    resultado = {}
+    assert list(app.transmitir_com_pdf(iter([]), "Relatório", resultado, jobs=jobs, cache=app.PDFCache(str(tmp_path / 'pdf')))) == []
+    assert resultado == {'report_md': ''}